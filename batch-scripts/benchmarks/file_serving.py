@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""Measure throughput of concurrent range requests against a local file.
+
+Compares paste.fileapp.FileApp (previously used by MediaController.serve)
+with mediadrop.lib.fileapp.FileApp. Both apps are served by a threaded
+wsgiref server on localhost, so the numbers include HTTP overhead but no
+network latency.
+
+Usage: file_serving.py [--size=MB] [--clients=N] [--requests=N] [--range=KB]
+"""
+
+from optparse import OptionParser
+import httplib
+import os
+import random
+import tempfile
+import threading
+import time
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from paste.fileapp import FileApp as PasteFileApp
+
+from mediadrop.lib.fileapp import FileApp
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # paste's FileApp passes bounded ranges to wsgi.file_wrapper which
+        # sends the file until EOF so the client closes the connection early.
+        pass
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def get_stderr(self):
+        return open(os.devnull, 'w')
+
+def create_test_file(size):
+    fd, filename = tempfile.mkstemp(suffix='.mp4')
+    block = os.urandom(1024 * 1024)
+    written = 0
+    while written < size:
+        written += os.write(fd, block[:size - written])
+    os.close(fd)
+    return filename
+
+def run_clients(port, file_size, clients, requests, range_size):
+    transferred = [0]
+    lock = threading.Lock()
+
+    def client():
+        connection = httplib.HTTPConnection('127.0.0.1', port)
+        received = 0
+        for i in range(requests):
+            start = random.randint(0, file_size - range_size)
+            headers = {'Range': 'bytes=%d-%d' % (start, start + range_size - 1)}
+            connection.request('GET', '/', headers=headers)
+            response = connection.getresponse()
+            received += len(response.read())
+            assert response.status == 206, response.status
+        connection.close()
+        lock.acquire()
+        transferred[0] += received
+        lock.release()
+
+    threads = [threading.Thread(target=client) for i in range(clients)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return transferred[0], time.time() - started
+
+def benchmark(name, app, options, file_size):
+    server = make_server('127.0.0.1', 0, app,
+        server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    port = server.server_address[1]
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    try:
+        transferred, duration = run_clients(port, file_size, options.clients,
+            options.requests, options.range_kb * 1024)
+    finally:
+        server.shutdown()
+    total_requests = options.clients * options.requests
+    print '%-28s %8.1f MB/s %8.1f requests/s' % (name,
+        transferred / duration / (1024 * 1024), total_requests / duration)
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option('--size', dest='size_mb', type='int', default=256,
+        help='size of the test file in MB (default: 256)')
+    parser.add_option('--clients', dest='clients', type='int', default=8,
+        help='number of concurrent clients (default: 8)')
+    parser.add_option('--requests', dest='requests', type='int', default=50,
+        help='range requests per client (default: 50)')
+    parser.add_option('--range', dest='range_kb', type='int', default=2048,
+        help='size of each requested range in KB (default: 2048)')
+    options, args = parser.parse_args()
+
+    file_size = options.size_mb * 1024 * 1024
+    filename = create_test_file(file_size)
+    try:
+        benchmark('paste.fileapp.FileApp', PasteFileApp(filename), options, file_size)
+        benchmark('mediadrop.lib.fileapp.FileApp', FileApp(filename), options, file_size)
+    finally:
+        os.remove(filename)
+
+if __name__ == '__main__':
+    main()
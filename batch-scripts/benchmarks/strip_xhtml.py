@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""Measure how long it takes to derive the plain text of descriptions.
+
+Compares the previous strip_xhtml() implementation (a BeautifulSoup parse
+for the text and another one to decode the entities) with the tokenizer
+based mediadrop.lib.xhtml.strip_xhtml(), once with an empty cache and once
+for descriptions which were stripped before.
+
+Usage: strip_xhtml.py [--documents=N] [--paragraphs=N]
+"""
+
+from optparse import OptionParser
+import random
+import string
+import time
+
+from BeautifulSoup import BeautifulSoup
+
+from mediadrop.lib.xhtml import clean_xhtml, strip_xhtml, text_cache
+from mediadrop.lib.xhtml.htmlsanitizer import entities_to_unicode
+
+
+snippets = [
+    u'<b>bold</b>', u'<i>italic</i>', u'<a href="http://example.com/">link</a>',
+    u'&amp;', u'&copy;', u'&quot;quoted&quot;', u'<br>', u'<h2>heading</h2>',
+]
+
+def random_paragraph(words=40):
+    parts = []
+    for i in range(words):
+        if random.random() < 0.1:
+            parts.append(random.choice(snippets))
+        else:
+            length = random.randint(1, 8)
+            parts.append(u''.join(random.choice(string.ascii_lowercase)
+                                  for j in range(length)))
+    return u' '.join(parts)
+
+def old_strip_xhtml(string, _decode_entities=False):
+    string = ''.join(BeautifulSoup(string).findAll(text=True))
+    if _decode_entities:
+        string = entities_to_unicode(string)
+    return string
+
+def benchmark(name, strip_func, documents):
+    started = time.time()
+    results = [strip_func(document, True) for document in documents]
+    duration = time.time() - started
+    print '%-28s %10.2f ms/document' % (name, duration * 1000 / len(documents))
+    return results
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option('--documents', dest='documents', type='int', default=200,
+        help='number of descriptions (default: 200)')
+    parser.add_option('--paragraphs', dest='paragraphs', type='int', default=5,
+        help='paragraphs per description (default: 5)')
+    options, args = parser.parse_args()
+
+    documents = []
+    for i in range(options.documents):
+        paragraphs = [random_paragraph() for j in range(options.paragraphs)]
+        documents.append(clean_xhtml(u'\n\n'.join(paragraphs)))
+
+    old = benchmark('old strip_xhtml()', old_strip_xhtml, documents)
+    text_cache.clear()
+    new = benchmark('new strip_xhtml()', strip_xhtml, documents)
+    benchmark('new strip_xhtml() (cached)', strip_xhtml, documents)
+    changed = len([1 for a, b in zip(old, new) if a != b])
+    if changed:
+        print '%d of %d documents stripped differently' % (changed, len(documents))
+
+if __name__ == '__main__':
+    main()
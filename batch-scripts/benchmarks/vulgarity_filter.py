@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""Measure how long it takes to filter filtered words from long comments.
+
+Compares the previous filter_vulgarity() implementation (which compiled an
+alternation of all words for every call) with the cached trie-based
+mediadrop.lib.vulgarity.VulgarityFilter. The word list and the comments
+are random lowercase words.
+
+Usage: vulgarity_filter.py [--words=N] [--comments=N] [--length=N]
+"""
+
+from optparse import OptionParser
+import random
+import re
+import string
+import time
+
+from mediadrop.lib.vulgarity import VulgarityFilter, vulgarity_filter
+
+
+def random_word(min_length=3, max_length=10):
+    length = random.randint(min_length, max_length)
+    return u''.join(random.choice(string.ascii_lowercase) for i in range(length))
+
+def old_filter_vulgarity(vulgar_words, text):
+    words = (word.strip() for word in vulgar_words.split(','))
+    word_pattern = '|'.join(re.escape(word) for word in words if word)
+    word_expr = re.compile(word_pattern, re.IGNORECASE)
+    def word_replacer(matchobj):
+        word = matchobj.group(0)
+        return '*' * len(word)
+    return word_expr.sub(word_replacer, text)
+
+def new_filter_vulgarity(vulgar_words, text):
+    return vulgarity_filter(vulgar_words)(text)
+
+def benchmark(name, filter_func, vulgar_words, comments):
+    started = time.time()
+    results = [filter_func(vulgar_words, comment) for comment in comments]
+    duration = time.time() - started
+    print '%-28s %10.2f ms/comment' % (name, duration * 1000 / len(comments))
+    return results
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option('--words', dest='words', type='int', default=5000,
+        help='number of filtered words (default: 5000)')
+    parser.add_option('--comments', dest='comments', type='int', default=20,
+        help='number of comments to filter (default: 20)')
+    parser.add_option('--length', dest='length', type='int', default=2000,
+        help='words per comment (default: 2000)')
+    options, args = parser.parse_args()
+
+    words = [random_word() for i in range(options.words)]
+    vulgar_words = u', '.join(words)
+    comments = []
+    for i in range(options.comments):
+        comment_words = [random_word(1, 8) for j in range(options.length)]
+        comments.append(u' '.join(comment_words))
+
+    started = time.time()
+    VulgarityFilter(vulgar_words.split(','))
+    print '%-28s %10.2f ms' % ('compiling VulgarityFilter', (time.time() - started) * 1000)
+    old = benchmark('old filter_vulgarity()', old_filter_vulgarity, vulgar_words, comments)
+    new = benchmark('new filter_vulgarity()', new_filter_vulgarity, vulgar_words, comments)
+    changed = len([1 for a, b in zip(old, new) if a != b])
+    if changed:
+        # overlapping words: the new filter replaces the longest word
+        print '%d of %d comments filtered differently' % (changed, len(comments))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""Measure how long it takes to clean user submitted descriptions.
+
+Compares the previous clean_xhtml() implementation (two runs of the
+BeautifulSoup based Cleaner) with mediadrop.lib.xhtml.sanitizer.XHTMLSanitizer.
+The documents are random paragraphs with some markup, entities and URLs.
+
+Usage: xhtml_sanitizer.py [--documents=N] [--paragraphs=N]
+"""
+
+from optparse import OptionParser
+import random
+import string
+import time
+
+from mediadrop.lib.xhtml import (blank_line, block_spaces, clean_xhtml,
+    cleaner_settings)
+from mediadrop.lib.xhtml.htmlsanitizer import Cleaner
+
+
+snippets = [
+    u'<b>bold</b>', u'<i>italic</i>', u'<a href="http://example.com/">link</a>',
+    u'http://example.com/path?q=1', u'&amp;', u'&copy;', u'<br>',
+    u'<div>block</div>', u'<span style="color: red">span</span>',
+    u'<script>alert(1)</script>', u'<h2>heading</h2>',
+]
+
+def random_paragraph(words=40):
+    parts = []
+    for i in range(words):
+        if random.random() < 0.1:
+            parts.append(random.choice(snippets))
+        else:
+            length = random.randint(1, 8)
+            parts.append(u''.join(random.choice(string.ascii_lowercase)
+                                  for j in range(length)))
+    return u' '.join(parts)
+
+def old_clean_xhtml(string):
+    string = string.replace(u'\r', u'').replace(u'\xa0', u' ')
+    string = blank_line.sub(u'<br/>', string.replace(u'&nbsp;', u' '))
+    string = Cleaner(string, **cleaner_settings)()
+    cleaner = Cleaner(string, **cleaner_settings)
+    string = cleaner()
+    if len(cleaner.root.contents) == 1 \
+        and isinstance(cleaner.root.contents[0], basestring):
+        string = u'<p>%s</p>' % string.strip()
+    return block_spaces.sub(u'\\1', string).strip()
+
+def benchmark(name, clean_func, documents):
+    started = time.time()
+    results = [clean_func(document) for document in documents]
+    duration = time.time() - started
+    print '%-28s %10.2f ms/document' % (name, duration * 1000 / len(documents))
+    return results
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option('--documents', dest='documents', type='int', default=50,
+        help='number of documents to clean (default: 50)')
+    parser.add_option('--paragraphs', dest='paragraphs', type='int', default=5,
+        help='paragraphs per document (default: 5)')
+    options, args = parser.parse_args()
+
+    documents = []
+    for i in range(options.documents):
+        paragraphs = [random_paragraph() for j in range(options.paragraphs)]
+        documents.append(u'\n\n'.join(paragraphs))
+
+    old = benchmark('old clean_xhtml()', old_clean_xhtml, documents)
+    new = benchmark('new clean_xhtml()', clean_xhtml, documents)
+    changed = len([1 for a, b in zip(old, new) if a != b])
+    if changed:
+        print '%d of %d documents cleaned differently' % (changed, len(documents))
+
+if __name__ == '__main__':
+    main()
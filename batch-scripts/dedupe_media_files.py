@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from mediadrop.lib.cli_commands import LoadAppCommand, load_app
+
+_script_name = "Deduplicate Local Media Files"
+_script_description = """Store identical media files only once.
+
+Specify your ini config file as the first argument to this script.
+
+Files of all Local File Storage engines with identical contents are moved
+into content-addressed folders (named after their SHA-256 checksum) and
+replaced by hard links to a single copy. Files with a unique size are left
+alone. Enable "Store identical files only once" in the storage settings to
+deduplicate new uploads as well."""
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('--dry-run',
+        action='store_true',
+        dest='dry_run',
+        help='Only report duplicate files, do not change anything.',
+        default=False
+    )
+    load_app(cmd)
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import os
+import sys
+
+from mediadrop.lib.storage.localfiles import (content_dir,
+    link_to_identical_file, LocalFileStorage)
+from mediadrop.lib.uploads import file_sha256
+from mediadrop.model import DBSession
+
+
+def files_by_size(engines):
+    by_size = {}
+    for engine in engines:
+        for media_file in engine.files:
+            path = engine._get_path(media_file.unique_id)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                print 'missing file for %r: %s' % (media_file, path)
+                continue
+            by_size.setdefault(size, []).append((engine, media_file))
+    return by_size
+
+def move_to_content_dir(engine, media_file, digest):
+    old_path = engine._get_path(media_file.unique_id)
+    unique_id = '%s/%s' % (content_dir(digest), os.path.basename(old_path))
+    new_path = engine._get_path(unique_id)
+    if link_to_identical_file(new_path):
+        os.remove(old_path)
+        freed = os.path.getsize(new_path)
+    else:
+        if not os.path.isdir(os.path.dirname(new_path)):
+            os.makedirs(os.path.dirname(new_path))
+        os.rename(old_path, new_path)
+        freed = 0
+    media_file.unique_id = unique_id
+    try:
+        DBSession.commit()
+    except:
+        # keep the old name so the database and file system stay consistent
+        DBSession.rollback()
+        os.rename(new_path, old_path)
+        raise
+    return freed
+
+def main(parser, options, args):
+    engines = DBSession.query(LocalFileStorage).all()
+    freed = 0
+    for size, candidates in sorted(files_by_size(engines).items()):
+        if len(candidates) < 2:
+            continue
+        by_digest = {}
+        for engine, media_file in candidates:
+            media_fp = open(engine._get_path(media_file.unique_id), 'rb')
+            try:
+                digest = file_sha256(media_fp)
+            finally:
+                media_fp.close()
+            by_digest.setdefault((engine._get_path(''), digest), []).append((engine, media_file))
+
+        for (base_path, digest), duplicates in by_digest.items():
+            if len(duplicates) < 2:
+                continue
+            print '%s: %d files (%d bytes each)' % (digest, len(duplicates), size)
+            for engine, media_file in duplicates:
+                if options.dry_run or media_file.unique_id.startswith(content_dir(digest) + '/'):
+                    continue
+                freed += move_to_content_dir(engine, media_file, digest)
+    if not options.dry_run:
+        print 'freed %d bytes' % freed
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from mediadrop.lib.cli_commands import LoadAppCommand, load_app
+
+_script_name = "Export Catalogue"
+_script_description = """Export all published media as newline delimited JSON.
+
+Specify your ini config file as the first argument to this script.
+
+Every line contains the same data as the media API (/api/media/export),
+including the files and categories of the media. The media are exported
+in batches ordered by ID, so memory usage does not depend on the size of
+the catalogue. Use --modified-since for incremental exports.
+
+The public URL of the site (--base-url) is required because all URLs in the
+export are absolute."""
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('--base-url',
+        dest='base_url',
+        help='The public URL of the site, e.g. "https://site.example" '
+             '(required).',
+        default=None
+    )
+    cmd.parser.add_option('--modified-since',
+        dest='modified_since',
+        help='Only export media modified on or after this date '
+             '("YYYY-MM-DD HH:MM:SS").',
+        default=None
+    )
+    cmd.parser.add_option('--output',
+        dest='output',
+        help='Write the export to this file instead of stdout.',
+        default=None
+    )
+    cmd.parser.add_option('--batch-size',
+        type='int',
+        dest='batch_size',
+        help='Number of media which are loaded in one query.',
+        default=500
+    )
+    load_app(cmd)
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+
+from mediadrop.lib.catalogue_export import export_lines, parse_modified_since
+from mediadrop.lib.cli_commands import set_base_url
+
+
+def main(parser, options, args):
+    if not options.base_url:
+        sys.stderr.write('Please specify the URL of your site with '
+                         '--base-url.\n')
+        sys.exit(1)
+    try:
+        set_base_url(options.base_url)
+        modified_since = parse_modified_since(options.modified_since)
+    except ValueError, e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
+    if options.output:
+        output = open(options.output, 'wb')
+    else:
+        output = sys.stdout
+    try:
+        for chunk in export_lines(modified_since, options.batch_size):
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
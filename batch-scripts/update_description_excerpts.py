@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from mediadrop.lib.cli_commands import LoadAppCommand, load_app
+
+_script_name = "Update Description Excerpts"
+_script_description = """Generate the stored excerpts of media and podcast descriptions.
+
+Specify your ini config file as the first argument to this script.
+
+Media and podcasts store excerpts of their descriptions (and podcasts the
+plain text of their description) so pages and feeds don't have to parse the
+XHTML for every request. They are generated whenever a description is
+changed. Run this script once after upgrading to generate them for
+existing media and podcasts. Use --all to regenerate all excerpts (e.g.
+after changing the excerpt lengths)."""
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('--all',
+        action='store_true',
+        dest='all',
+        help='Regenerate existing excerpts, too.',
+        default=False
+    )
+    cmd.parser.add_option('--batch-size',
+        type='int',
+        dest='batch_size',
+        help='Number of items which are updated in one transaction.',
+        default=100
+    )
+    load_app(cmd)
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+
+from sqlalchemy.orm.attributes import flag_modified
+
+from mediadrop.model import DBSession, Media, Podcast
+
+
+def update_excerpts(model, only_missing=True, batch_size=100):
+    query = DBSession.query(model.id).order_by(model.id)
+    if only_missing:
+        query = query.filter(model.description_excerpt == None)
+    ids = [row.id for row in query]
+    for start in range(0, len(ids), batch_size):
+        batch_ids = ids[start:start+batch_size]
+        for item in model.query.filter(model.id.in_(batch_ids)):
+            # assigning the description again generates the excerpts
+            item.description = item.description
+            # keep the modification date (it is used for caching and
+            # sitemaps) as only derived data changed.
+            flag_modified(item, 'modified_on')
+        DBSession.commit()
+    return len(ids)
+
+def main(parser, options, args):
+    for model in (Media, Podcast):
+        count = update_excerpts(model, only_missing=not options.all,
+                                batch_size=options.batch_size)
+        print '%s: updated %d items' % (model.__name__, count)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from mediadrop.lib.cli_commands import LoadAppCommand, load_app
+
+_script_name = "Warm Template Cache"
+_script_description = """Parse all templates and store them in the template cache.
+
+Specify your ini config file as the first argument to this script.
+
+Parsed templates are stored in the directory configured by
+templates.cache_dir (by default "templates" inside the cache_dir if
+templates.auto_reload is disabled). Run this script after deploying a new
+version of MediaDrop (or after changing templates) and before starting the
+server so new server processes can load all templates from the cache."""
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    load_app(cmd)
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+import time
+
+from pylons import app_globals, config
+
+from mediadrop.lib.templating import find_templates
+
+
+def main(parser, options, args):
+    loader = app_globals.genshi_loader
+    if not loader.cache_dir:
+        sys.stderr.write('No template cache configured, set '
+                         'templates.cache_dir in your ini file.\n')
+        sys.exit(1)
+    names = find_templates(config['pylons.paths']['templates'],
+                           app_globals.plugin_mgr)
+    started = time.time()
+    count = loader.preload(names)
+    print 'Loaded %d of %d templates into %s (%.1f seconds)' % (
+        count, len(names), loader.cache_dir, time.time() - started)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
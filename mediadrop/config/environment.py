@@ -10,6 +10,7 @@ import os
 
 from formencode.api import get_localedir as get_formencode_localedir
 from genshi.filters.i18n import Translator
+from paste.deploy.converters import asbool
 import pylons
 from pylons import translator
 from pylons.configuration import PylonsConfig
@@ -19,7 +20,7 @@ import mediadrop.lib.app_globals as app_globals
 import mediadrop.lib.helpers
 
 from mediadrop.config.routing import create_mapper, add_routes
-from mediadrop.lib.templating import TemplateLoader
+from mediadrop.lib.templating import TemplateLoader, find_templates
 from mediadrop.model import Media, Podcast, init_model
 from mediadrop.plugin import PluginManager, events
 
@@ -63,11 +64,21 @@ def load_environment(global_conf, app_conf):
         translations = Translator(translator)
         translations.setup(template)
 
-    # Create the Genshi TemplateLoader
+    # Create the Genshi TemplateLoader. Without auto_reload (production
+    # mode) the template files are not checked for changes on every render
+    # so the cache must be large enough to keep all templates.
+    template_names = find_templates(paths['templates'], plugin_mgr)
+    auto_reload = asbool(config.get('templates.auto_reload', True))
+    template_cache_dir = config.get('templates.cache_dir')
+    if template_cache_dir is None and not auto_reload:
+        template_cache_dir = os.path.join(config['cache_dir'], 'templates')
     config['pylons.app_globals'].genshi_loader = TemplateLoader(
         search_path=paths['templates'] + plugin_mgr.template_loaders(),
-        auto_reload=True,
-        max_cache_size=100,
+        auto_reload=auto_reload,
+        # leave room for ToscaWidgets templates and templates which are
+        # included by absolute name
+        max_cache_size=auto_reload and 100 or 2 * len(template_names) + 100,
+        cache_dir=template_cache_dir,
         callback=enable_i18n_for_template,
     )
 
@@ -101,6 +112,9 @@ def load_environment(global_conf, app_conf):
 
     # END CUSTOM CONFIGURATION OPTIONS
 
+    if asbool(config.get('templates.preload', False)):
+        config['pylons.app_globals'].genshi_loader.preload(template_names)
+
     events.Environment.loaded(config)
 
     return config
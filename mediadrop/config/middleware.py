@@ -6,16 +6,22 @@
 # See LICENSE.txt in the main project directory, for more information.
 """Pylons middleware initialization"""
 
+from email.utils import formatdate
+import itertools
 import logging
 import os
 import threading
+import time
+from urlparse import parse_qs
+import zlib
 
 from beaker.middleware import SessionMiddleware
 from genshi.template import loader
 from genshi.template.plugin import MarkupTemplateEnginePlugin
 from paste import gzipper
 from paste.cascade import Cascade
-from paste.registry import RegistryManager
+from paste.registry import (Registry, RegistryManager as _RegistryManager,
+    restorer)
 from paste.response import header_value, remove_header
 from paste.urlmap import URLMap
 from paste.urlparser import StaticURLParser
@@ -33,6 +39,10 @@ import tw.api
 from mediadrop import monkeypatch_method
 from mediadrop.config.environment import load_environment
 from mediadrop.lib.auth import add_auth
+from mediadrop.lib.response_cache import setup_response_cache
+from mediadrop.lib.storage.api import uploads_need_checksum
+from mediadrop.lib.templating import STREAMING_RESPONSE_KEY
+from mediadrop.lib.uploads import UploadSpoolMiddleware, upload_temp_dir
 from mediadrop.migrations.util import MediaDropMigrator
 from mediadrop.model import DBSession
 from mediadrop.plugin import events
@@ -73,16 +83,66 @@ def setup_prefix_middleware(app, global_conf, proxy_prefix):
     app = PrefixMiddleware(app, global_conf, proxy_prefix)
     return app
 
+class ClosingIterator(object):
+    """Call ``callback`` after the response ``app_iter`` was sent."""
+    def __init__(self, app_iter, callback):
+        self.app_iter = app_iter
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.app_iter)
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            self.callback()
+
 class DBSessionRemoverMiddleware(object):
-    """Ensure the contextual session ends at the end of the request."""
+    """Ensure the contextual session ends at the end of the request.
+
+    Streamed responses (see ``expose(streaming=True)``) load data while
+    they are sent so the session is removed after that.
+    """
     def __init__(self, app):
         self.app = app
 
     def __call__(self, environ, start_response):
         try:
-            return self.app(environ, start_response)
-        finally:
+            app_iter = self.app(environ, start_response)
+        except:
             DBSession.remove()
+            raise
+        if environ.get(STREAMING_RESPONSE_KEY):
+            return ClosingIterator(app_iter, DBSession.remove)
+        DBSession.remove()
+        return app_iter
+
+class RegistryManager(_RegistryManager):
+    """paste.registry.RegistryManager which keeps the registered globals
+    (request, tmpl_context, translator, ...) until a streamed response was
+    sent as its template is rendered while it is sent.
+
+    Unlike ``RegistryManager(app, streaming=True)`` other responses are
+    passed to the server unchanged (e.g. a ``wsgi.file_wrapper``).
+    """
+    def __call__(self, environ, start_response):
+        registry = environ.setdefault('paste.registry', Registry())
+        registry.prepare()
+        try:
+            app_iter = self.application(environ, start_response)
+        except Exception, e:
+            expected = tuple(environ.get('paste.expected_exceptions', ()))
+            if environ.get('paste.evalexception') and not isinstance(e, expected):
+                # keep the state for the interactive debugger
+                restorer.save_registry_state(environ)
+            registry.cleanup()
+            raise
+        if environ.get(STREAMING_RESPONSE_KEY):
+            return ClosingIterator(app_iter, registry.cleanup)
+        registry.cleanup()
+        return app_iter
 
 class FastCGIScriptStripperMiddleware(object):
     """Strip the given fcgi_script_name from the end of environ['SCRIPT_NAME'].
@@ -101,6 +161,35 @@ class FastCGIScriptStripperMiddleware(object):
             environ['SCRIPT_NAME'] = script_name[:-self.cut]
         return self.app(environ, start_response)
 
+class VersionedStaticFilesMiddleware(object):
+    """Send far-future caching headers for content-versioned static files.
+
+    URLs carrying a ``v`` query parameter (e.g. thumbnails, see
+    :func:`mediadrop.lib.thumbnails.thumb_url`) change whenever the file
+    contents change so browsers and proxies may cache them forever.
+    Requests without a version are passed through untouched so old URLs
+    keep working with the default revalidation behavior.
+    """
+    def __init__(self, app, max_age=365*24*60*60):
+        self.app = app
+        self.max_age = max_age
+
+    def __call__(self, environ, start_response):
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        if not query.get('v'):
+            return self.app(environ, start_response)
+
+        def versioned_start_response(status, headers, exc_info=None):
+            if status[:3] in ('200', '304'):
+                remove_header(headers, 'cache-control')
+                remove_header(headers, 'expires')
+                headers.append(('Cache-Control',
+                    'public, max-age=%d, immutable' % self.max_age))
+                headers.append(('Expires',
+                    formatdate(time.time() + self.max_age, usegmt=True)))
+            return start_response(status, headers, exc_info)
+        return self.app(environ, versioned_start_response)
+
 def create_tw_engine_manager(app_globals):
     def filename_suffix_adder(inner_loader, suffix):
         def _add_suffix(filename):
@@ -236,12 +325,63 @@ def setup_db_sanity_checks(app, config):
     return DBSanityCheckingMiddleware(app, check_for_leaked_connections=check_for_leaked_connections,
                                       enable_pessimistic_disconnect_handling=enable_pessimistic_disconnect_handling)
 
+class GzipMiddleware(gzipper.middleware):
+    """paste.gzipper middleware which does not buffer uncompressed responses.
+
+    The stock middleware collects every response body in memory, even if
+    it decides not to compress it. For media files that means copying
+    (possibly) gigabytes through Python and defeating ``wsgi.file_wrapper``.
+
+    Streamed responses (anything but a list or tuple, e.g. from
+    ``expose(streaming=True)``) are compressed chunk by chunk while they
+    are sent, without a ``Content-Length``.
+    """
+    def __call__(self, environ, start_response):
+        if 'gzip' not in environ.get('HTTP_ACCEPT_ENCODING', ''):
+            return self.application(environ, start_response)
+        response = gzipper.GzipResponse(start_response, self.compress_level)
+        app_iter = self.application(environ, response.gzip_start_response)
+        is_started = hasattr(response, 'status')
+        if is_started and not response.compressible \
+                and response.buffer.tell() == 0:
+            # pass the original app_iter to the server unchanged
+            start_response(response.status, response.headers)
+            return app_iter
+        if is_started and response.compressible \
+                and not isinstance(app_iter, (list, tuple)):
+            start_response(response.status, response.headers)
+            return gzip_chunks(app_iter, self.compress_level,
+                               prefix=response.buffer.getvalue())
+        if app_iter is not None:
+            response.finish_response(app_iter)
+        return response.write()
+
+def gzip_chunks(app_iter, compress_level=6, prefix=''):
+    """Compress the response body ``app_iter`` chunk by chunk (gzip format).
+
+    :param prefix: Data which was written before (e.g. with the ``write``
+        callable returned by ``start_response``).
+    """
+    # wbits > 15 means gzip header and trailer instead of zlib's
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    try:
+        for chunk in itertools.chain([prefix], app_iter):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+
 def setup_gzip_middleware(app, global_conf):
     """Make paste.gzipper middleware with a monkeypatch to exempt SWFs.
 
     Gzipping .swf files (application/x-shockwave-flash) provides no
     extra compression and it also breaks Flowplayer 3.2.3, and
-    potentially others.
+    potentially others. Partial content (byte ranges of a file) must not
+    be compressed either.
 
     """
     @monkeypatch_method(gzipper.GzipResponse)
@@ -250,19 +390,19 @@ def setup_gzip_middleware(app, global_conf):
         ct = header_value(headers, 'content-type')
         ce = header_value(headers, 'content-encoding')
         self.compressible = False
-        # This statement is the only change in this monkeypatch:
         if ct and (ct.startswith('text/') or ct.startswith('application/')) \
-            and 'zip' not in ct and ct != 'application/x-shockwave-flash':
+            and 'zip' not in ct and ct != 'application/x-shockwave-flash' \
+            and not status.startswith('206'):
             self.compressible = True
         if ce:
             self.compressible = False
         if self.compressible:
             headers.append(('content-encoding', 'gzip'))
-        remove_header(headers, 'content-length')
+            remove_header(headers, 'content-length')
         self.headers = headers
         self.status = status
         return self.buffer.write
-    return gzipper.make_gzip_middleware(app, global_conf)
+    return GzipMiddleware(app)
 
 def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
     """Create a Pylons WSGI application and return it
@@ -311,6 +451,11 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
     # add repoze.who middleware with our own authorization library
     app = add_auth(app, config)
 
+    # Parse uploads before anything else accesses the POST data so uploaded
+    # files are spooled next to the media dir and can be moved into place.
+    app = UploadSpoolMiddleware(app, upload_temp_dir(config),
+                                hash_uploads=uploads_need_checksum)
+
     # ToscaWidgets Middleware
     app = setup_tw_middleware(app, config)
 
@@ -343,6 +488,9 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
             app = StatusCodeRedirect(app, errors=(400, 401, 403, 404, 500),
                                      path=error_path)
 
+    # Serve cached pages to anonymous visitors (if enabled)
+    app = setup_response_cache(app, config)
+
     # Cleanup the DBSession only after errors are handled
     app = DBSessionRemoverMiddleware(app)
 
@@ -360,11 +508,14 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
         for dir, path in plugin_mgr.public_paths().iteritems():
             static_urlmap[dir] = StaticURLParser(path)
 
-        # Serve static media and podcast images from outside our public directory
+        # Serve static media and podcast images from outside our public
+        # directory. Thumbnail URLs contain a content version so they can be
+        # cached forever.
         for image_type in ('media', 'podcasts'):
             dir = '/images/' + image_type
             path = os.path.join(config['image_dir'], image_type)
-            static_urlmap[dir] = StaticURLParser(path)
+            static_urlmap[dir] = \
+                VersionedStaticFilesMiddleware(StaticURLParser(path))
 
         # Serve appearance directory outside of public as well
         dir = '/appearance'
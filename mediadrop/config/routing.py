@@ -102,6 +102,22 @@ def add_routes(map):
         controller='media',
         action='serve',
         requirements={'id': r'\d+'})
+    map.connect('/upload/resumable',
+        controller='resumable_upload',
+        action='create',
+        conditions=dict(method=['POST']))
+    map.connect('/upload/resumable/{upload_id}',
+        controller='resumable_upload',
+        action='status',
+        conditions=dict(method=['GET', 'HEAD']))
+    map.connect('/upload/resumable/{upload_id}',
+        controller='resumable_upload',
+        action='append',
+        conditions=dict(method=['PATCH']))
+    map.connect('/upload/resumable/{upload_id}',
+        controller='resumable_upload',
+        action='delete',
+        conditions=dict(method=['DELETE']))
     map.connect('/upload/{action}',
         controller='upload',
         action='index')
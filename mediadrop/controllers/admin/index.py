@@ -6,10 +6,11 @@
 # See LICENSE.txt in the main project directory, for more information.
 
 import webhelpers.paginate
+from pylons import app_globals
 
 from mediadrop.lib.auth import has_permission
 from mediadrop.lib.base import BaseController
-from mediadrop.lib.decorators import expose, observable
+from mediadrop.lib.decorators import cache_statistics, expose, observable
 from mediadrop.model import Comment, Media
 from mediadrop.plugin import events
 
@@ -52,6 +53,13 @@ class IndexController(BaseController):
                 Total unreviewed comments
             comment_count_trash
                 Total deleted comments
+            response_cache
+                The :class:`~mediadrop.lib.response_cache.ResponseCache`
+                or ``None`` if the page cache is disabled.
+            cache_stats
+                A list of ``(action, stats)`` tuples of the cached feeds
+                and sitemaps, see
+                :class:`~mediadrop.lib.decorators.CacheStatistics`.
 
         """
         # Any publishable video that does have a publish_on date that is in the
@@ -65,6 +73,8 @@ class IndexController(BaseController):
             publish_page = self._fetch_page('awaiting_publishing'),
             recent_media = recent_media,
             comments = Comment.query,
+            response_cache = app_globals.response_cache,
+            cache_stats = cache_statistics.summary(),
         )
 
 
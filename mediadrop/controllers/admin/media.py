@@ -15,6 +15,7 @@ from formencode import Invalid, validators
 from pylons import request, tmpl_context
 from sqlalchemy import orm
 
+from mediadrop.controllers.resumable_upload import add_resumable_upload
 from mediadrop.forms.admin import SearchForm, ThumbForm
 from mediadrop.forms.admin.media import AddFileForm, EditFileForm, MediaForm, UpdateStatusForm
 from mediadrop.lib import helpers
@@ -259,7 +260,7 @@ class MediaController(BaseController):
     @validate(add_file_form, error_handler=json_error)
     @autocommit
     @observable(events.Admin.MediaController.add_file)
-    def add_file(self, id, file=None, url=None, **kwargs):
+    def add_file(self, id, file=None, url=None, upload_id=None, **kwargs):
         """Save action for the :class:`~mediadrop.forms.admin.media.AddFileForm`.
 
         Creates a new :class:`~mediadrop.model.media.MediaFile` from the
@@ -271,6 +272,9 @@ class MediaController(BaseController):
         :type file: :class:`cgi.FieldStorage` or ``None``
         :param url: A URL to a recognizable audio or video file
         :type url: :class:`unicode` or ``None``
+        :param upload_id: The ID of a completed resumable upload, see
+            :mod:`mediadrop.controllers.resumable_upload`
+        :type upload_id: :class:`unicode` or ``None``
         :rtype: JSON dict
         :returns:
             success
@@ -304,7 +308,10 @@ class MediaController(BaseController):
         else:
             media = fetch_row(Media, id)
 
-        media_file = add_new_media_file(media, file, url)
+        if upload_id:
+            media_file = add_resumable_upload(media, upload_id)
+        else:
+            media_file = add_new_media_file(media, file, url)
         if media.slug.startswith('_stub_'):
             media.title = media_file.display_name
             media.slug = get_available_slug(Media, '_stub_' + media.title)
@@ -674,8 +681,7 @@ class MediaController(BaseController):
                     self._publish_media(m)
             rows = render_rows(media)
         elif type == 'delete':
-            for m in media:
-                self._delete_media(m)
+            self._delete_media(*media)
         else:
             success = False
 
@@ -694,18 +700,25 @@ class MediaController(BaseController):
             new_slug = get_available_slug(Media, media.slug[len('_stub_'):])
             media.slug = new_slug
 
-    def _delete_media(self, media):
+    def _delete_media(self, *media_list):
         # FIXME: Ensure that if the first file is deleted from the file system,
         #        then the second fails, the first file is deleted from the
         #        file system and not linking to a nonexistent file.
-        # Delete every file from the storage engine
-        for file in media.files:
-            file.storage.delete(file.unique_id)
-            # Remove this item from the DBSession so that the foreign key
+        # Delete every file from the storage engine, one batch per engine
+        files_by_storage = {}
+        for media in media_list:
+            for file in media.files:
+                files_by_storage.setdefault(file.storage, []).append(file)
+        for storage, files in files_by_storage.items():
+            storage.delete_many([file.unique_id for file in files])
+            # Remove these items from the DBSession so that the foreign key
             # ON DELETE CASCADE can take effect.
-            DBSession.expunge(file)
+            for file in files:
+                DBSession.expunge(file)
         # Delete the media
-        DBSession.delete(media)
+        for media in media_list:
+            DBSession.delete(media)
         DBSession.flush()
         # Cleanup the thumbnails
-        delete_thumbs(media)
+        for media in media_list:
+            delete_thumbs(media)
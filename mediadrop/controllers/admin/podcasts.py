@@ -168,6 +168,7 @@ class PodcastsController(BaseController):
 
     @expose('json', request_method='POST')
     @validate(thumb_form, error_handler=edit)
+    @autocommit
     @observable(events.Admin.PodcastsController.save_thumb)
     def save_thumb(self, id, thumb, **values):
         """Save a thumbnail uploaded with :class:`~mediadrop.forms.admin.ThumbForm`.
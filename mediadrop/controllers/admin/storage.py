@@ -7,14 +7,15 @@
 
 import logging
 
-from pylons import tmpl_context
+from pylons import request, tmpl_context
 from sqlalchemy import orm
 
 from mediadrop.lib.auth import has_permission
 from mediadrop.lib.base import BaseController
 from mediadrop.lib.decorators import autocommit, expose, observable, validate
 from mediadrop.lib.helpers import redirect, url_for
-from mediadrop.lib.storage import sort_engines, StorageEngine
+from mediadrop.lib.storage import (invalidate_engine_cache, sort_engines,
+    StorageEngine)
 from mediadrop.model import DBSession, fetch_row
 from mediadrop.plugin import events
 
@@ -91,6 +92,7 @@ class StorageController(BaseController):
             # since each can have radically different fields.
             save_func = getattr(form, 'save_engine_params')
             save_func(engine, **tmpl_context.form_values)
+            request.commit_callbacks.append(invalidate_engine_cache)
             redirect(controller='/admin/storage', action='index')
 
         return save_engine_params(id, **kwargs)
@@ -117,10 +119,9 @@ class StorageController(BaseController):
         :returns: Redirect back to :meth:`index` after successful delete.
         """
         engine = fetch_row(StorageEngine, id)
-        files = engine.files
-        for f in files:
-            engine.delete(f.unique_id)
+        engine.delete_many([f.unique_id for f in engine.files])
         DBSession.delete(engine)
+        request.commit_callbacks.append(invalidate_engine_cache)
         redirect(action='index', id=None)
 
     @expose(request_method='POST')
@@ -135,6 +136,7 @@ class StorageController(BaseController):
         """
         engine = fetch_row(StorageEngine, id)
         engine.enabled = True
+        request.commit_callbacks.append(invalidate_engine_cache)
         redirect(action='index', id=None)
 
     @expose(request_method='POST')
@@ -149,4 +151,5 @@ class StorageController(BaseController):
         """
         engine = fetch_row(StorageEngine, id)
         engine.enabled = False
+        request.commit_callbacks.append(invalidate_engine_cache)
         redirect(action='index', id=None)
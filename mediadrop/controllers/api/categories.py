@@ -15,6 +15,7 @@ from sqlalchemy import orm
 from mediadrop.controllers.api import APIException, get_order_by
 from mediadrop.lib import helpers
 from mediadrop.lib.base import BaseController
+from mediadrop.lib.conditional_get import check_conditional_get
 from mediadrop.lib.compat import any
 from mediadrop.lib.decorators import expose
 from mediadrop.lib.helpers import get_featured_category, url_for
@@ -94,9 +95,13 @@ class CategoriesController(BaseController):
             kwargs['offset'] = offset
             kwargs['limit'] = limit
             kwargs['tree'] = False
-            return self._get_query(**kwargs)
-
-        return self._index_query(order, offset, limit, tree=False)
+            result = self._get_query(**kwargs)
+        else:
+            result = self._index_query(order, offset, limit, tree=False)
+        # Categories have no modification date but the (small) result is
+        # cheap compared to sending it, so only the transfer is saved.
+        check_conditional_get(etag_data=result)
+        return result
 
     @expose('json')
     def tree(self, depth=10, api_key=None, **kwargs):
@@ -138,9 +143,11 @@ class CategoriesController(BaseController):
         if any(key in kwargs for key in ('id', 'slug', 'name')):
             kwargs['depth'] = depth
             kwargs['tree'] = True
-            return self._get_query(**kwargs)
-
-        return self._index_query(depth=depth, tree=True)
+            result = self._get_query(**kwargs)
+        else:
+            result = self._index_query(depth=depth, tree=True)
+        check_conditional_get(etag_data=result)
+        return result
 
     def _index_query(self, order=None, offset=0, limit=10, tree=False, depth=10, **kwargs):
         """Query a list of categories"""
@@ -10,14 +10,17 @@ from datetime import datetime, timedelta
 
 from paste.util.converters import asbool
 from pylons import app_globals, config, request, response, session, tmpl_context
+import simplejson
 from sqlalchemy import orm, sql
 
 from mediadrop.controllers.api import APIException, get_order_by
-from mediadrop.lib import helpers
+from mediadrop.lib.api_serializer import MediaSerializer, file_info, parse_fields
 from mediadrop.lib.base import BaseController
+from mediadrop.lib.catalogue_export import (export_lines, export_query,
+    parse_modified_since)
+from mediadrop.lib.conditional_get import check_conditional_get, media_validators
 from mediadrop.lib.decorators import expose, expose_xhr, observable, paginate, validate
-from mediadrop.lib.helpers import get_featured_category, url_for, url_for_media
-from mediadrop.lib.thumbnails import thumb
+from mediadrop.lib.helpers import get_featured_category, url_for_media
 from mediadrop.model import Category, Media, Podcast, Tag, fetch_row, get_available_slug
 from mediadrop.model.meta import DBSession
 from mediadrop.plugin import events
@@ -35,11 +38,13 @@ order_columns = {
     'popularity': Media.popularity_points,
     'description': Media.description,
     'description_plain': Media.description_plain,
-    'comment_count': 'comment_count_published %s'
+    'comment_count': Media.comment_count_published,
 }
 
 AUTHERROR = "Authentication Error"
 INVALIDFORMATERROR = "Invalid format (%s). Only json and mrss are supported"
+INVALIDIDSERROR = "Invalid id (%s). Only numeric IDs are supported"
+TOOMANYERROR = "Too many media requested (%d). At most %d are allowed"
 
 class MediaController(BaseController):
     """
@@ -51,7 +56,8 @@ class MediaController(BaseController):
     def index(self, type=None, podcast=None, tag=None, category=None, search=None,
               max_age=None, min_age=None, order=None, offset=0, limit=10,
               published_after=None, published_before=None, featured=False,
-              id=None, slug=None, include_embed=False, api_key=None, format="json", **kwargs):
+              id=None, slug=None, include_embed=False, fields=None, api_key=None,
+              format="json", **kwargs):
         """Query for a list of media.
 
         :param type:
@@ -122,6 +128,12 @@ class MediaController(BaseController):
             for all results.
         :type include_embed: bool
 
+        :param fields:
+            A comma separated list of the **media_info** fields to return,
+            e.g. 'id,title,thumbs'. Defaults to all fields. Loading the
+            data of fields which are not needed is skipped.
+        :type fields: unicode or None
+
         :param id:
             Filters the results to include the one item with the given ID.
             Note that we still return a list.
@@ -162,9 +174,12 @@ class MediaController(BaseController):
         if format not in ("json", "mrss"):
             return dict(error= INVALIDFORMATERROR % format)
 
-        query = Media.query\
-            .published()\
-            .options(orm.undefer('comment_count_published'))
+        try:
+            fields = parse_fields(fields)
+        except ValueError, e:
+            return dict(error=unicode(e))
+
+        query = Media.query.published()
 
         # Basic filters
         if id:
@@ -213,8 +228,8 @@ class MediaController(BaseController):
             if featured_cat:
                 query = query.in_category(featured_cat)
 
-        # Preload podcast slugs so we don't do n+1 queries
-        podcast_slugs = dict(DBSession.query(Podcast.id, Podcast.slug))
+        last_modified, etag_data = media_validators(query, counters=True)
+        check_conditional_get(last_modified, etag_data)
 
         # Rudimentary pagination support
         start = int(offset)
@@ -227,7 +242,8 @@ class MediaController(BaseController):
                 title = "Media Feed",
             )
 
-        media = [self._info(m, podcast_slugs, include_embed) for m in query[start:end]]
+        serializer = MediaSerializer(fields, include_embed=include_embed)
+        media = serializer.serialize(query[start:end])
 
         return dict(
             media = media,
@@ -269,6 +285,9 @@ class MediaController(BaseController):
         else:
             query = query.filter_by(slug=slug)
 
+        last_modified, etag_data = media_validators(query, counters=True)
+        check_conditional_get(last_modified, etag_data)
+
         try:
             media = query.one()
         except orm.exc.NoResultFound:
@@ -284,10 +303,13 @@ class MediaController(BaseController):
         return self._info(media, include_embed=True)
 
 
-    def _info(self, media, podcast_slugs=None, include_embed=False):
+    def _info(self, media, include_embed=False):
         """
         Return a **media_info** dict--a JSON-ready dict for describing a media instance.
 
+        Use :class:`mediadrop.lib.api_serializer.MediaSerializer` to
+        describe many media at once.
+
         :rtype: JSON-ready dict
         :returns: The returned dict has the following fields:
 
@@ -351,46 +373,8 @@ class MediaController(BaseController):
                     medium_width = thumbs['m']['x']
                     medium_height = thumbs['m']['y']
         """
-        if media.podcast_id:
-            media_url = url_for(controller='/media', action='view', slug=media.slug,
-                                podcast_slug=media.podcast.slug, qualified=True)
-        else:
-            media_url = url_for_media(media, qualified=True)
-
-        if media.podcast_id is None:
-            podcast_slug = None
-        elif podcast_slugs:
-            podcast_slug = podcast_slugs[media.podcast_id]
-        else:
-            podcast_slug = DBSession.query(Podcast.slug)\
-                .filter_by(id=media.podcast_id).scalar()
-
-        thumbs = {}
-        for size in config['thumb_sizes'][media._thumb_dir].iterkeys():
-            thumbs[size] = thumb(media, size, qualified=True)
-
-        info = dict(
-            id = media.id,
-            slug = media.slug,
-            url = media_url,
-            title = media.title,
-            author = media.author.name,
-            type = media.type,
-            podcast = podcast_slug,
-            description = media.description,
-            description_plain = media.description_plain,
-            comment_count = media.comment_count_published,
-            publish_on = unicode(media.publish_on),
-            likes = media.likes,
-            views = media.views,
-            thumbs = thumbs,
-            categories = dict((c.slug, c.name) for c in list(media.categories)),
-        )
-
-        if include_embed:
-            info['embed'] = unicode(helpers.embed_player(media))
-
-        return info
+        serializer = MediaSerializer(include_embed=include_embed)
+        return serializer.serialize([media])[0]
 
 
     @expose('json')
@@ -425,6 +409,9 @@ class MediaController(BaseController):
         else:
             query = query.filter_by(slug=slug)
 
+        last_modified, etag_data = media_validators(query)
+        check_conditional_get(last_modified, etag_data)
+
         try:
             media = query.one()
         except orm.exc.NoResultFound:
@@ -484,23 +471,180 @@ class MediaController(BaseController):
                         'http://mediadrop.net/docs')
 
         """
-        uris = []
-        info = dict(
-            container = file.container,
-            type = file.type,
-            display_name = file.display_name,
-            created = file.created_on.isoformat(),
-            url = url_for_media(media, qualified=True),
-            uris = uris,
+        return file_info(file, url_for_media(media, qualified=True))
+
+    @expose('json')
+    def get_many(self, id=None, slug=None, fields=None, include_embed=False,
+                 include_files=False, api_key=None, **kwargs):
+        """Expose info on many media items at once.
+
+        All media are loaded with a single query (and their related data
+        with one more query each), so this is much faster than calling
+        :meth:`get` and :meth:`files` for every item.
+
+        :param id: A comma separated list of
+            :attr:`ids <mediadrop.model.media.Media.id>` for lookup
+        :type id: unicode or None
+        :param slug: A comma separated list of
+            :attr:`slugs <mediadrop.model.media.Media.slug>` for lookup,
+            used if no IDs are given.
+        :type slug: unicode or None
+        :param fields: A comma separated list of the **media_info** fields
+            to return. Defaults to all fields.
+        :type fields: unicode or None
+        :param include_embed: If nonzero, the HTML for the embeddable player
+            is included for all results.
+        :type include_embed: bool
+        :param include_files: If nonzero, a list of **file_info** dicts (see
+            :meth:`_file_info <mediadrop.controllers.api.media.MediaController._file_info>`)
+            is included as 'files' for all results.
+        :type include_files: bool
+        :param api_key: The api access key if required in settings
+        :type api_key: unicode or None
+        :rtype: JSON-ready dict
+        :returns: The returned dict has the following fields:
+
+            media (list of dicts)
+                A list of **media_info** dicts in the order of the given
+                IDs or slugs. The number of IDs or slugs may not exceed
+                :attr:`request.settings['api_media_max_results']`.
+            missing (list)
+                The IDs or slugs which did not match any published media.
+
+        """
+        if asbool(request.settings['api_secret_key_required']) \
+            and api_key != request.settings['api_secret_key']:
+            return dict(error=AUTHERROR)
+
+        try:
+            fields = parse_fields(fields)
+        except ValueError, e:
+            return dict(error=unicode(e))
+
+        query, keys, error = self._query_many(id, slug)
+        if error:
+            return dict(error=error)
+
+        last_modified, etag_data = media_validators(query, counters=True)
+        check_conditional_get(last_modified, etag_data)
+
+        media, missing = self._fetch_many(query, keys, id)
+        serializer = MediaSerializer(fields, include_embed=include_embed,
+                                     include_files=include_files)
+        return dict(
+            media = serializer.serialize(media),
+            missing = missing,
         )
-        for uri in file.get_uris():
-            uris.append({
-                'scheme': uri.scheme,
-                'uri': str(uri),
-                'server': uri.server_uri,
-                'file': uri.file_uri,
-            })
-        return info
+
+    @expose('json')
+    def files_many(self, id=None, slug=None, api_key=None, **kwargs):
+        """List all files of many media items at once.
+
+        :param id: A comma separated list of
+            :attr:`ids <mediadrop.model.media.Media.id>` for lookup
+        :type id: unicode or None
+        :param slug: A comma separated list of
+            :attr:`slugs <mediadrop.model.media.Media.slug>` for lookup,
+            used if no IDs are given.
+        :type slug: unicode or None
+        :param api_key: The api access key if required in settings
+        :type api_key: unicode or None
+        :rtype: JSON-ready dict
+        :returns: The returned dict has the following fields:
+
+            media (list of dicts)
+                A dict for each media (in the order of the given IDs or
+                slugs) with its 'id', 'slug' and 'files', a list of
+                **file_info** dicts as generated by the
+                :meth:`_file_info <mediadrop.controllers.api.media.MediaController._file_info>`
+                method.
+            missing (list)
+                The IDs or slugs which did not match any published media.
+
+        """
+        if asbool(request.settings['api_secret_key_required']) \
+            and api_key != request.settings['api_secret_key']:
+            return dict(error=AUTHERROR)
+
+        query, keys, error = self._query_many(id, slug)
+        if error:
+            return dict(error=error)
+
+        last_modified, etag_data = media_validators(query)
+        check_conditional_get(last_modified, etag_data)
+
+        media, missing = self._fetch_many(query, keys, id)
+        serializer = MediaSerializer(['id', 'slug', 'files'])
+        return dict(
+            media = serializer.serialize(media),
+            missing = missing,
+        )
+
+    @expose(streaming=True)
+    def export(self, modified_since=None, api_key=None, **kwargs):
+        """Export all published media as newline delimited JSON.
+
+        Unlike :meth:`index` the number of results is not limited. The
+        response is generated while it is sent, one **media_info** dict
+        (including 'files') per line in the order of the media IDs.
+
+        :param modified_since:
+            If given, only media which (or whose files) were modified *on
+            or after* this date are exported. The expected format is
+            'YYYY-MM-DD HH:MM:SS' (ISO 8601). Use it for incremental syncs.
+            Note that deleted or unpublished media are not reported.
+        :type modified_since: unicode or None
+        :param api_key: The api access key if required in settings
+        :type api_key: unicode or None
+        :rtype: iterable of str
+        :returns: The NDJSON export, or a JSON dict with an 'error'.
+
+        """
+        if asbool(request.settings['api_secret_key_required']) \
+            and api_key != request.settings['api_secret_key']:
+            return self._json_error(AUTHERROR)
+
+        try:
+            modified_since = parse_modified_since(modified_since)
+        except ValueError, e:
+            return self._json_error(unicode(e))
+
+        last_modified, etag_data = media_validators(
+            export_query(modified_since), counters=True)
+        check_conditional_get(last_modified, etag_data)
+
+        response.headers['Content-Type'] = 'application/x-ndjson; charset=utf-8'
+        return export_lines(modified_since)
+
+    def _json_error(self, message):
+        response.headers['Content-Type'] = 'application/json'
+        return simplejson.dumps(dict(error=message))
+
+    def _query_many(self, id, slug):
+        """Return a query for the published media with the given IDs or
+        slugs, the list of IDs/slugs and an error message (or None)."""
+        keys = [key.strip() for key in (id or slug or '').split(',')]
+        keys = [key for key in keys if key]
+        if id:
+            try:
+                keys = [int(key) for key in keys]
+            except ValueError:
+                return None, None, INVALIDIDSERROR % id
+        max_results = int(request.settings['api_media_max_results'])
+        if len(keys) > max_results:
+            return None, None, TOOMANYERROR % (len(keys), max_results)
+        column = id and Media.id or Media.slug
+        query = Media.query.published().filter(column.in_(keys or [None]))
+        return query, keys, None
+
+    def _fetch_many(self, query, keys, by_id):
+        """Return the media in the order of the given keys and the keys
+        which did not match any media."""
+        attr = by_id and 'id' or 'slug'
+        found = dict((getattr(m, attr), m) for m in query.order_by(None))
+        media = [found[key] for key in keys if key in found]
+        missing = [key for key in keys if key not in found]
+        return media, missing
 
 #XXX: Dirty hack to set the actual strings for filetypes, in our docstrings,
 #     based on the canonical definitions in the filetypes module.
@@ -10,10 +10,12 @@ from pylons.controllers.util import abort
 from sqlalchemy import orm
 
 from mediadrop.lib.base import BaseController
+from mediadrop.lib.conditional_get import check_conditional_get, media_validators
 from mediadrop.lib.decorators import (beaker_cache, expose, observable, 
     paginate, validate)
 from mediadrop.lib.helpers import content_type_for_response, url_for, viewable_media
 from mediadrop.lib.i18n import _
+from mediadrop.lib.response_cache import cache_response
 from mediadrop.model import Category, Media, fetch_row
 from mediadrop.plugin import events
 from mediadrop.validation import LimitFeedItemsValidator
@@ -57,6 +59,7 @@ class CategoriesController(BaseController):
     @expose('categories/index.html')
     @observable(events.CategoriesController.index)
     def index(self, slug=None, **kwargs):
+        cache_response('media', 'categories')
         media = Media.query.published()
 
         if c.category:
@@ -82,6 +85,7 @@ class CategoriesController(BaseController):
     @paginate('media', items_per_page=20)
     @observable(events.CategoriesController.more)
     def more(self, slug, order, page=1, **kwargs):
+        cache_response('media', 'categories', query_params=('page',))
         media = Media.query.published()\
             .in_category(c.category)
 
@@ -96,8 +100,8 @@ class CategoriesController(BaseController):
         )
 
     @validate(validators={'limit': LimitFeedItemsValidator()})
-    @beaker_cache(expire=60 * 3, query_args=True)
-    @expose('sitemaps/mrss.xml')
+    @beaker_cache(expire=60 * 3, stale_expire=60 * 3, query_args=True)
+    @expose('sitemaps/mrss.xml', streaming=True)
     @observable(events.CategoriesController.feed)
     def feed(self, limit=None, **kwargs):
         """ Generate a media rss feed of the latest media
@@ -108,14 +112,19 @@ class CategoriesController(BaseController):
         if request.settings['rss_display'] != 'True':
             abort(404)
 
-        response.content_type = content_type_for_response(
-            ['application/rss+xml', 'application/xml', 'text/xml'])
-
         media = Media.query.published()
 
         if c.category:
             media = media.in_category(c.category)
 
+        last_modified, etag_data = media_validators(media)
+        category_data = c.category and (c.category.id, c.category.name)
+        check_conditional_get(last_modified, (etag_data, category_data),
+                              max_age=60 * 3)
+
+        response.content_type = content_type_for_response(
+            ['application/rss+xml', 'application/xml', 'text/xml'])
+
         media_query = media.order_by(Media.publish_on.desc())
         media = viewable_media(media_query)
         if limit is not None:
@@ -11,8 +11,6 @@ Publicly Facing Media Controllers
 import logging
 import os.path
 
-from akismet import Akismet
-from paste.fileapp import FileApp
 from paste.util import mimeparse
 from pylons import config, request, response
 from pylons.controllers.util import abort, forward
@@ -20,16 +18,18 @@ from sqlalchemy import orm, sql
 from sqlalchemy.exc import OperationalError
 from webob.exc import HTTPNotAcceptable, HTTPNotFound
 
-from mediadrop import USER_AGENT
 from mediadrop.forms.comments import PostCommentSchema
 from mediadrop.lib import helpers
 from mediadrop.lib.base import BaseController
 from mediadrop.lib.decorators import expose, expose_xhr, observable, paginate, validate_xhr, autocommit
-from mediadrop.lib.email import send_comment_notification
+from mediadrop.lib.email import comment_notification, send_comment_notification
+from mediadrop.lib.fileapp import FileApp
 from mediadrop.lib.helpers import (filter_vulgarity, redirect, url_for, 
     viewable_media)
 from mediadrop.lib.i18n import _
+from mediadrop.lib.response_cache import cache_response
 from mediadrop.lib.services import Facebook
+from mediadrop.lib.spam_check import check_for_spam_later, spam_check_enabled
 from mediadrop.lib.templating import render
 from mediadrop.model import (DBSession, fetch_row, Media, MediaFile, Comment, 
     Tag, Category, AuthorWithIP, Podcast)
@@ -72,6 +72,8 @@ class MediaController(BaseController):
                 The query the user searched for, if any
 
         """
+        # search results are not cached ('q' is no cacheable parameter)
+        cache_response('media', query_params=('page', 'show', 'tag'))
         media = Media.query.published()
 
         media, show = helpers.filter_library_controls(media, show)
@@ -125,6 +127,7 @@ class MediaController(BaseController):
                 Latest media
 
         """
+        cache_response('media', 'categories')
         media = Media.query.published()
 
         latest = media.order_by(Media.publish_on.desc())
@@ -211,6 +214,8 @@ class MediaController(BaseController):
             if url_for() != url_for(podcast_slug=media.podcast.slug):
                 redirect(podcast_slug=media.podcast.slug)
 
+        cache_response('media', 'categories', 'podcasts',
+                       'comments-%d' % media.id, count_view=media.id)
         try:
             media.increment_views()
             DBSession.commit()
@@ -298,22 +303,6 @@ class MediaController(BaseController):
 
         if request.settings['comments_engine'] != 'builtin':
             abort(404)
-        akismet_key = request.settings['akismet_key']
-        if akismet_key:
-            akismet = Akismet(agent=USER_AGENT)
-            akismet.key = akismet_key
-            akismet.blog_url = request.settings['akismet_url'] or \
-                url_for('/', qualified=True)
-            akismet.verify_key()
-            data = {'comment_author': name.encode('utf-8'),
-                    'user_ip': request.environ.get('REMOTE_ADDR'),
-                    'user_agent': request.environ.get('HTTP_USER_AGENT', ''),
-                    'referrer': request.environ.get('HTTP_REFERER',  'unknown'),
-                    'HTTP_ACCEPT': request.environ.get('HTTP_ACCEPT')}
-
-            if akismet.comment_check(body.encode('utf-8'), data):
-                return result(False, _(u'Your comment has been rejected.'))
-
         media = fetch_row(Media, slug=slug)
         request.perm.assert_permission(u'view', media.resource)
 
@@ -325,13 +314,19 @@ class MediaController(BaseController):
         c.body = filter_vulgarity(body)
 
         require_review = request.settings['req_comment_approval']
-        if not require_review:
+        # The comment stays unreviewed until the spam check (which runs after
+        # the comment was saved) publishes or trashes it.
+        spam_check = spam_check_enabled()
+        if not (require_review or spam_check):
             c.reviewed = True
             c.publishable = True
 
         media.comments.append(c)
         DBSession.flush()
-        send_comment_notification(media, c)
+        if spam_check:
+            check_for_spam_later(c, comment_notification(media, c))
+        else:
+            send_comment_notification(media, c)
 
         if require_review:
             message = _('Thank you for your comment! We will post it just as '
@@ -407,7 +402,11 @@ class MediaController(BaseController):
 
 
         else:
-            app = FileApp(file_path, headers, content_type=file_type)
+            # Supports range requests (seeking in HTML5 players) and uses
+            # the server's wsgi.file_wrapper (sendfile) where possible.
+            chunk_size = int(config.get('file_serve_chunk_size', 256 * 1024))
+            app = FileApp(file_path, headers, content_type=file_type,
+                          chunk_size=chunk_size)
             return forward(app)
 
         response.headers['Content-Type'] = file_type
@@ -11,9 +11,11 @@ from sqlalchemy import orm
 from mediadrop.lib.auth.util import viewable_media
 from mediadrop.lib import helpers
 from mediadrop.lib.base import BaseController
+from mediadrop.lib.conditional_get import check_conditional_get, media_validators
 from mediadrop.lib.decorators import (beaker_cache, expose, observable, 
     paginate, validate)
 from mediadrop.lib.helpers import content_type_for_response, url_for, redirect
+from mediadrop.lib.response_cache import cache_response
 from mediadrop.model import Media, Podcast, fetch_row
 from mediadrop.plugin import events
 from mediadrop.validation import LimitFeedItemsValidator
@@ -40,6 +42,7 @@ class PodcastsController(BaseController):
                 The :class:`~mediadrop.model.podcasts.Podcast` instance
 
         """
+        cache_response('media', 'podcasts')
         podcasts = Podcast.query\
             .options(orm.undefer('media_count_published'))\
             .all()
@@ -78,6 +81,7 @@ class PodcastsController(BaseController):
                 A list of all the other podcasts
 
         """
+        cache_response('media', 'podcasts', query_params=('page', 'show'))
         podcast = fetch_row(Podcast, slug=slug)
         episodes = podcast.media.published()
 
@@ -98,8 +102,8 @@ class PodcastsController(BaseController):
         )
 
     @validate(validators={'limit': LimitFeedItemsValidator()})
-    @beaker_cache(expire=60 * 20)
-    @expose('podcasts/feed.xml')
+    @beaker_cache(expire=60 * 20, stale_expire=60 * 20)
+    @expose('podcasts/feed.xml', streaming=True)
     @observable(events.PodcastsController.feed)
     def feed(self, slug, limit=None, **kwargs):
         """Serve the feed as RSS 2.0.
@@ -128,10 +132,16 @@ class PodcastsController(BaseController):
             and not kwargs.get('feedburner_bypass', False)):
             redirect(podcast.feedburner_url.encode('utf-8'))
 
+        episode_query = podcast.media.published()
+        last_modified, etag_data = media_validators(episode_query)
+        if last_modified is None or podcast.modified_on > last_modified:
+            last_modified = podcast.modified_on
+        check_conditional_get(last_modified, etag_data, max_age=60 * 20)
+
         response.content_type = content_type_for_response(
             ['application/rss+xml', 'application/xml', 'text/xml'])
 
-        episode_query = podcast.media.published().order_by(Media.publish_on.desc())
+        episode_query = episode_query.order_by(Media.publish_on.desc())
         episodes = viewable_media(episode_query)
         if limit is not None:
             episodes = episodes.limit(limit)
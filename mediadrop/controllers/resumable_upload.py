@@ -0,0 +1,196 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Resumable Upload Controller
+
+Large files can be uploaded in several requests so a broken connection
+does not mean the whole file has to be uploaded again. The protocol
+follows the core of tus.io (http://tus.io/protocols/resumable-upload.html):
+
+    1. ``POST /upload/resumable`` with an ``Upload-Length`` header (and an
+       optional ``Upload-Metadata: filename <base64>`` header) creates a new
+       upload. The ``Location`` header contains the URL of the upload.
+    2. ``PATCH /upload/resumable/<id>`` with an ``Upload-Offset`` header
+       and ``Content-Type: application/offset+octet-stream`` appends the
+       request body to the upload.
+    3. ``HEAD /upload/resumable/<id>`` returns the current offset in the
+       ``Upload-Offset`` header, ``GET`` returns the progress as JSON.
+
+Clients which can not send PATCH or DELETE requests may POST with a
+``_method`` query parameter instead.
+
+Once all bytes were received the upload is submitted with its ID in the
+``upload_id`` field of the regular upload forms (instead of a file).
+"""
+
+import base64
+
+from pylons import config, request, response
+from pylons.controllers.util import abort
+
+from mediadrop.lib.base import BaseController
+from mediadrop.lib.decorators import expose
+from mediadrop.lib.helpers import url_for
+from mediadrop.lib.storage import add_new_media_file
+from mediadrop.lib.uploads import (ResumableUpload, ResumableUploadError,
+    ResumableUploadLocked, upload_temp_dir)
+
+import logging
+log = logging.getLogger(__name__)
+
+TUS_VERSION = '1.0.0'
+
+def _int_header(name):
+    try:
+        value = int(request.headers.get(name, ''))
+    except ValueError:
+        value = -1
+    if value < 0:
+        abort(400, 'Missing or invalid %s header' % name)
+    return value
+
+def _parse_metadata(value):
+    """Parse a tus ``Upload-Metadata`` header into a dict."""
+    metadata = {}
+    for pair in (value or '').split(','):
+        key, sep, encoded = pair.strip().partition(' ')
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(encoded).decode('utf-8')
+        except (TypeError, UnicodeDecodeError):
+            abort(400, 'Invalid Upload-Metadata header')
+    return metadata
+
+def fetch_resumable_upload(upload_id):
+    """Return the :class:`~mediadrop.lib.uploads.ResumableUpload` with the
+    given ID if the current user started it, otherwise raise a 404."""
+    upload = ResumableUpload.load(upload_temp_dir(config), upload_id)
+    if upload is None or upload.owner != _owner():
+        abort(404)
+    return upload
+
+def add_resumable_upload(media, upload_id):
+    """Store the completed upload as a new MediaFile of the given media.
+
+    :rtype: :class:`~mediadrop.model.media.MediaFile`
+    """
+    upload = fetch_resumable_upload(upload_id)
+    if not upload.is_complete:
+        abort(409, 'Upload %s is not complete' % upload_id)
+    uploaded_file = upload.field_storage()
+    try:
+        media_file = add_new_media_file(media, file=uploaded_file)
+    finally:
+        uploaded_file.file.close()
+    # not in the finally block: if storing failed the user can try again
+    upload.delete()
+    return media_file
+
+def _owner():
+    user = request.perm.user
+    return user and user.id
+
+class ResumableUploadController(BaseController):
+
+    def __before__(self, *args, **kwargs):
+        result = BaseController.__before__(self, *args, **kwargs)
+        # Editors may upload files in the admin panel even if user uploads
+        # are disabled.
+        may_upload = request.settings['appearance_enable_user_uploads'] \
+            and request.perm.contains_permission(u'upload')
+        if not (may_upload or request.perm.contains_permission(u'edit')):
+            abort(404)
+        response.headers['Tus-Resumable'] = TUS_VERSION
+        response.headers['Cache-Control'] = 'no-store'
+        return result
+
+    @expose('json', request_method='POST')
+    def create(self, **kwargs):
+        """Start a new upload.
+
+        :rtype: JSON dict
+        :returns:
+            upload_id
+                The ID needed to finish the upload later.
+            offset
+                Always 0.
+            length
+                The announced size of the file.
+
+        """
+        length = _int_header('Upload-Length')
+        max_size = int(config.get('resumable_upload_max_size', 0) or 0)
+        if max_size and length > max_size:
+            abort(413)
+        metadata = _parse_metadata(request.headers.get('Upload-Metadata'))
+        filename = metadata.get('filename') or kwargs.get('filename')
+        if not filename:
+            abort(400, 'No filename given')
+
+        upload = ResumableUpload.create(upload_temp_dir(config), length,
+                                        filename, owner=_owner())
+        response.status_int = 201
+        response.headers['Location'] = \
+            url_for(action='status', upload_id=upload.id, qualified=True)
+        response.headers['Upload-Offset'] = '0'
+        return dict(upload_id=upload.id, offset=0, length=length)
+
+    @expose('json')
+    def status(self, upload_id, **kwargs):
+        """Return the progress of an upload.
+
+        :rtype: JSON dict
+        :returns:
+            offset
+                The number of bytes received.
+            length
+                The size of the file.
+            complete
+                True if all bytes were received.
+
+        """
+        upload = fetch_resumable_upload(upload_id)
+        offset = upload.offset
+        response.headers['Upload-Offset'] = str(offset)
+        response.headers['Upload-Length'] = str(upload.length)
+        return dict(offset=offset, length=upload.length,
+                    complete=upload.is_complete)
+
+    @expose()
+    def append(self, upload_id, **kwargs):
+        """Append the request body at the offset given by the client.
+
+        Responds with ``409 Conflict`` if the offset is not the number of
+        bytes received so far and with ``423 Locked`` while another request
+        appends data to the same upload.
+        """
+        upload = fetch_resumable_upload(upload_id)
+        if request.content_type != 'application/offset+octet-stream':
+            abort(415)
+        offset = _int_header('Upload-Offset')
+        length = _int_header('Content-Length')
+        try:
+            offset = upload.append(offset, request.body_file_raw, length)
+        except ResumableUploadLocked, e:
+            log.info('Rejected chunk for upload %s: %s', upload_id, e)
+            response.headers['Upload-Offset'] = str(upload.offset)
+            abort(423, str(e))
+        except ResumableUploadError, e:
+            log.info('Rejected chunk for upload %s: %s', upload_id, e)
+            response.headers['Upload-Offset'] = str(upload.offset)
+            abort(409, str(e))
+        response.status_int = 204
+        response.headers['Upload-Offset'] = str(offset)
+        return ''
+
+    @expose()
+    def delete(self, upload_id, **kwargs):
+        """Cancel an upload and remove the data received so far."""
+        fetch_resumable_upload(upload_id).delete()
+        response.status_int = 204
+        return ''
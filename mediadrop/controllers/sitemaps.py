@@ -9,20 +9,21 @@
 Sitemaps Controller
 """
 import logging
-import math
 import os
 
 from formencode import validators
-from paste.fileapp import FileApp
 from pylons import config, request, response
 from pylons.controllers.util import abort, forward
 from webob.exc import HTTPNotFound
 
 from mediadrop.plugin import events
 from mediadrop.lib.base import BaseController
+from mediadrop.lib.conditional_get import check_conditional_get, media_validators
 from mediadrop.lib.decorators import expose, beaker_cache, observable, validate
+from mediadrop.lib.fileapp import FileApp
 from mediadrop.lib.helpers import (content_type_for_response, 
-    get_featured_category, url_for, viewable_media)
+    get_featured_category, viewable_media)
+from mediadrop.lib.sitemap_files import update_sitemap_files
 from mediadrop.model import Media
 from mediadrop.validation import LimitFeedItemsValidator
 
@@ -38,92 +39,72 @@ class SitemapsController(BaseController):
     Sitemap generation
     """
 
-    @validate(validators={
-        'page': validators.Int(if_empty=None, if_missing=None, if_invalid=None), 
-        'limit': validators.Int(if_empty=10000, if_missing=10000, if_invalid=10000)
-    })
-    @beaker_cache(expire=60 * 60 * 4)
-    @expose('sitemaps/google.xml')
+    @expose()
     @observable(events.SitemapsController.google)
-    def google(self, page=None, limit=10000, **kwargs):
-        """Generate a sitemap which contains googles Video Sitemap information.
+    def google(self, page=None, **kwargs):
+        """Serve a sitemap which contains googles Video Sitemap information.
 
-        This action may return a <sitemapindex> or a <urlset>, depending
-        on how many media items are in the database, and the values of the
-        page and limit params.
+        The sitemaps are pre-generated, see
+        :class:`~mediadrop.lib.sitemap_files.SitemapFiles`. Without a page
+        the sitemap index is returned, otherwise the sitemap of the
+        shard with that number.
 
-        :param page: Page number, defaults to 1.
-        :type page: int
-        :param page: max records to display on page, defaults to 10000.
-        :type page: int
+        :param page: Shard number from the URL (``/sitemap<page>.xml``),
+            defaults to None.
+        :type page: str
 
         """
         if request.settings['sitemaps_display'] != 'True':
             abort(404)
-
-        response.content_type = \
-            content_type_for_response(['application/xml', 'text/xml'])
-
-        media = viewable_media(Media.query.published())
-
         if page is None:
-            if media.count() > limit:
-                return dict(pages=math.ceil(media.count() / float(limit)))
-        else:
-            page = int(page)
-            media = media.offset(page * limit).limit(limit)
-
-        if page:
-            links = []
+            filename = 'sitemap.xml'
         else:
-            links = [
-                url_for(controller='/', qualified=True),
-                url_for(controller='/media', show='popular', qualified=True),
-                url_for(controller='/media', show='latest', qualified=True),
-                url_for(controller='/categories', qualified=True),
-            ]
+            filename = 'sitemap%d.xml' % int(page)
+        return self._serve_sitemap_file(filename,
+            ['application/xml', 'text/xml'], max_age=60 * 60 * 4)
 
-        return dict(
-            media = media,
-            page = page,
-            links = links,
-        )
-
-    @beaker_cache(expire=60 * 60, query_args=True)
-    @expose('sitemaps/mrss.xml')
+    @expose()
     @observable(events.SitemapsController.mrss)
     def mrss(self, **kwargs):
-        """Generate a media rss (mRSS) feed of all the sites media."""
+        """Serve the pre-generated media rss (mRSS) feed of all the sites
+        media."""
         if request.settings['sitemaps_display'] != 'True':
             abort(404)
-
-
-        response.content_type = content_type_for_response(
-            ['application/rss+xml', 'application/xml', 'text/xml'])
-
-        media = viewable_media(Media.query.published())
-
-        return dict(
-            media = media,
-            title = 'MediaRSS Sitemap',
-        )
+        return self._serve_sitemap_file('mrss.xml',
+            ['application/rss+xml', 'application/xml', 'text/xml'],
+            max_age=60 * 60)
+
+    def _serve_sitemap_file(self, filename, content_types, max_age):
+        files = update_sitemap_files()
+        path = files.path(filename)
+        if not os.path.isfile(path):
+            abort(404)
+        # FileApp answers conditional and range requests and uses the
+        # server's wsgi.file_wrapper (sendfile) where possible.
+        headers = [('Cache-Control', 'public, max-age=%d' % max_age)]
+        content_type = content_type_for_response(content_types)
+        return forward(FileApp(path, headers, content_type=content_type))
 
     @validate(validators={
         'limit': LimitFeedItemsValidator(),
         'skip': validators.Int(if_empty=0, if_missing=0, if_invalid=0)
     })
-    @beaker_cache(expire=60 * 3)
-    @expose('sitemaps/mrss.xml')
+    @beaker_cache(expire=60 * 3, stale_expire=60 * 3)
+    @expose('sitemaps/mrss.xml', streaming=True)
     @observable(events.SitemapsController.latest)
     def latest(self, limit=None, skip=0, **kwargs):
         """Generate a media rss (mRSS) feed of all the sites media."""
         if request.settings['rss_display'] != 'True':
             abort(404)
 
+        media_query = Media.query.published()
+        last_modified, etag_data = media_validators(media_query)
+        check_conditional_get(last_modified, etag_data, max_age=60 * 3)
+
         response.content_type = content_type_for_response(
             ['application/rss+xml', 'application/xml', 'text/xml'])
 
-        media_query = Media.query.published().order_by(Media.publish_on.desc())
+        media_query = media_query.order_by(Media.publish_on.desc())
         media = viewable_media(media_query)
         if limit is not None:
             media = media.limit(limit)
@@ -140,20 +121,23 @@ class SitemapsController(BaseController):
         'limit': LimitFeedItemsValidator(),
         'skip': validators.Int(if_empty=0, if_missing=0, if_invalid=0)
     })
-    @beaker_cache(expire=60 * 3)
-    @expose('sitemaps/mrss.xml')
+    @beaker_cache(expire=60 * 3, stale_expire=60 * 3)
+    @expose('sitemaps/mrss.xml', streaming=True)
     @observable(events.SitemapsController.featured)
     def featured(self, limit=None, skip=0, **kwargs):
         """Generate a media rss (mRSS) feed of the sites featured media."""
         if request.settings['rss_display'] != 'True':
             abort(404)
 
+        media_query = Media.query.in_category(get_featured_category())\
+            .published()
+        last_modified, etag_data = media_validators(media_query)
+        check_conditional_get(last_modified, etag_data, max_age=60 * 3)
+
         response.content_type = content_type_for_response(
             ['application/rss+xml', 'application/xml', 'text/xml'])
 
-        media_query = Media.query.in_category(get_featured_category())\
-            .published()\
-            .order_by(Media.publish_on.desc())
+        media_query = media_query.order_by(Media.publish_on.desc())
         media = viewable_media(media_query)
         if limit is not None:
             media = media.limit(limit)
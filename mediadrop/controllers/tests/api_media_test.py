@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from datetime import datetime
+
+import simplejson
+
+from mediadrop.lib.storage.api import add_new_media_file
+from mediadrop.lib.test import ControllerTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.model import Comment, DBSession, Media
+from mediadrop.model.authors import AuthorWithIP
+
+
+class MediaAPIControllerTest(ControllerTestCase):
+    def call_controller_for(self, request_uri, **settings):
+        request = self.init_fake_request(request_uri=request_uri)
+        request.settings['api_secret_key_required'] = u'false'
+        request.settings.update(settings)
+        # the module needs a translator for its docstrings
+        from mediadrop.controllers.api.media import MediaController
+        response = self.call_controller(MediaController, request)
+        assert_equals(200, response.status_int)
+        return response
+
+    def call_api(self, request_uri, **settings):
+        response = self.call_controller_for(request_uri, **settings)
+        return simplejson.loads(response.body)
+
+    def publish_media(self, title):
+        media = Media.example(title=title, reviewed=True, encoded=True,
+            publishable=True, publish_on=datetime(2013, 1, 1))
+        DBSession.commit()
+        return media
+
+    def _comment(self, media):
+        comment = Comment()
+        comment.author = AuthorWithIP(u'Joe', u'joe@site.example', '127.0.0.1')
+        comment.subject = u'Re: %s' % media.title
+        comment.body = u'Nice video!'
+        comment.publishable = True
+        media.comments.append(comment)
+        DBSession.commit()
+
+    def test_can_select_fields(self):
+        media = self.publish_media(u'Selected')
+        result = self.call_api('/api/media?slug=selected&fields=id,title,embed')
+        assert_equals(1, result['count'])
+        info, = result['media']
+        assert_equals(set(['id', 'title', 'embed']), set(info))
+        assert_equals(media.id, info['id'])
+        assert_contains('<iframe', info['embed'])
+
+        result = self.call_api('/api/media?fields=id,secret')
+        assert_contains('secret', result['error'])
+
+    def test_returns_all_fields_by_default(self):
+        self.publish_media(u'Complete')
+        info, = self.call_api('/api/media?slug=complete')['media']
+        assert_not_contains('embed', info)
+        assert_equals(u'Complete', info['title'])
+        assert_equals(set(['s', 'm', 'l']), set(info['thumbs']))
+
+    def test_can_order_by_comment_count(self):
+        quiet = self.publish_media(u'Quiet')
+        discussed = self.publish_media(u'Discussed')
+        self._comment(discussed)
+
+        result = self.call_api('/api/media?order=comment_count%20desc')
+        media_ids = [m['id'] for m in result['media']]
+        assert_equals(discussed.id, media_ids[0])
+        assert_contains(quiet.id, media_ids)
+        assert_equals(1, result['media'][0]['comment_count'])
+
+    def test_can_get_many_media_at_once(self):
+        first = self.publish_media(u'First')
+        second = self.publish_media(u'Second')
+        add_new_media_file(second, url=u'http://site.example/second.mp4')
+        DBSession.commit()
+        DBSession.refresh(second)
+
+        result = self.call_api('/api/media/get_many?id=%d,0,%d&include_files=1'
+                               % (second.id, first.id))
+        assert_equals([second.id, first.id], [m['id'] for m in result['media']])
+        assert_equals([0], result['missing'])
+        second_info, first_info = result['media']
+        assert_equals([], first_info['files'])
+        assert_length(1, second_info['files'])
+        assert_equals('http://site.example/second.mp4',
+                      second_info['files'][0]['uris'][0]['uri'])
+
+        result = self.call_api('/api/media/files_many?slug=first,second,third')
+        assert_equals([u'first', u'second'], [m['slug'] for m in result['media']])
+        assert_equals([u'third'], result['missing'])
+        assert_length(1, result['media'][1]['files'])
+
+    def test_limits_number_of_media_per_request(self):
+        result = self.call_api('/api/media/get_many?id=1,2,3',
+                               api_media_max_results=u'2')
+        assert_contains('Too many', result['error'])
+
+        result = self.call_api('/api/media/get_many?id=1,abc')
+        assert_contains('Invalid id', result['error'])
+
+    def test_can_export_catalogue_as_ndjson(self):
+        media = self.publish_media(u'Exported')
+        response = self.call_controller_for('/api/media/export')
+        assert_equals('application/x-ndjson', response.content_type)
+        exported = [simplejson.loads(line) for line in response.body.splitlines()]
+        assert_equals(media.id, exported[-1]['id'])
+        assert_equals([], exported[-1]['files'])
+
+        response = self.call_controller_for(
+            '/api/media/export?modified_since=2100-01-01')
+        assert_equals('', response.body)
+
+        result = self.call_api('/api/media/export?modified_since=tomorrow')
+        assert_contains('Invalid date', result['error'])
+
+    def test_export_is_modified_by_new_comments(self):
+        media = self.publish_media(u'Discussed')
+        etag = self.call_controller_for('/api/media/export').headers['ETag']
+        self._comment(media)
+
+        request = self.init_fake_request(request_uri='/api/media/export')
+        request.settings['api_secret_key_required'] = u'false'
+        request.environ['HTTP_IF_NONE_MATCH'] = etag
+        from mediadrop.controllers.api.media import MediaController
+        response = self.call_controller(MediaController, request)
+        assert_equals(200, response.status_int)
+        info = simplejson.loads(response.body.splitlines()[-1])
+        assert_equals(1, info['comment_count'])
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(MediaAPIControllerTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
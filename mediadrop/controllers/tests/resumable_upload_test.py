@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import base64
+import fcntl
+from StringIO import StringIO
+
+from pylons import config
+import simplejson
+
+from mediadrop.lib.test import ControllerTestCase
+from mediadrop.lib.uploads import ResumableUpload, upload_temp_dir
+from mediadrop.lib.test.pythonic_testcase import *
+
+
+class ResumableUploadControllerTest(ControllerTestCase):
+    def _call(self, method, request_uri, body=None, **headers):
+        request = self.init_fake_request(method=method, request_uri=request_uri)
+        if body is not None:
+            request.environ.update({
+                'wsgi.input': StringIO(body),
+                'CONTENT_LENGTH': str(len(body)),
+                'CONTENT_TYPE': 'application/offset+octet-stream',
+            })
+        for name, value in headers.items():
+            request.environ['HTTP_' + name.upper().replace('-', '_')] = value
+        from mediadrop.controllers.resumable_upload import ResumableUploadController
+        return self.call_controller(ResumableUploadController, request)
+
+    def _create(self, length):
+        metadata = 'filename %s' % base64.b64encode('awesome-song.mp3')
+        response = self._call('POST', '/upload/resumable',
+            **{'Upload-Length': str(length), 'Upload-Metadata': metadata})
+        assert_equals(201, response.status_int)
+        upload_id = simplejson.loads(response.body)['upload_id']
+        assert_true(response.headers['Location'].endswith('/upload/resumable/' + upload_id))
+        return '/upload/resumable/' + upload_id
+
+    def _offset(self, upload_uri):
+        response = self._call('GET', upload_uri)
+        assert_equals(200, response.status_int)
+        return simplejson.loads(response.body)
+
+    def test_can_upload_file_in_chunks(self):
+        upload_uri = self._create(10)
+        response = self._call('PATCH', upload_uri, 'abcd', **{'Upload-Offset': '0'})
+        assert_equals(204, response.status_int)
+        assert_equals('4', response.headers['Upload-Offset'])
+        assert_equals({'offset': 4, 'length': 10, 'complete': False},
+                      self._offset(upload_uri))
+
+        response = self._call('PATCH', upload_uri, 'efghij', **{'Upload-Offset': '4'})
+        assert_equals('10', response.headers['Upload-Offset'])
+        assert_true(self._offset(upload_uri)['complete'])
+
+    def test_rejects_chunks_with_wrong_offset(self):
+        upload_uri = self._create(10)
+        response = self._call('PATCH', upload_uri, 'abcd', **{'Upload-Offset': '2'})
+        assert_equals(409, response.status_int)
+        assert_equals(0, self._offset(upload_uri)['offset'])
+
+    def test_rejects_concurrent_chunks(self):
+        upload_uri = self._create(10)
+        upload = ResumableUpload.load(upload_temp_dir(config),
+                                      upload_uri.rsplit('/', 1)[1])
+        # another request is still appending its chunk
+        locked_file = open(upload.path, 'ab')
+        fcntl.flock(locked_file.fileno(), fcntl.LOCK_EX)
+        try:
+            response = self._call('PATCH', upload_uri, 'abcd', **{'Upload-Offset': '0'})
+        finally:
+            locked_file.close()
+        assert_equals(423, response.status_int)
+        assert_equals(0, self._offset(upload_uri)['offset'])
+
+        response = self._call('PATCH', upload_uri, 'abcd', **{'Upload-Offset': '0'})
+        assert_equals(204, response.status_int)
+
+    def test_returns_404_for_unknown_uploads(self):
+        response = self._call('GET', '/upload/resumable/' + 'a' * 32)
+        assert_equals(404, response.status_int)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ResumableUploadControllerTest))
+    return suite
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import os
+
+from pylons import app_globals
+
+from mediadrop.controllers.sitemaps import SitemapsController
+from mediadrop.lib.test import ControllerTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+
+
+class SitemapsControllerTest(ControllerTestCase):
+    def setUp(self):
+        super(SitemapsControllerTest, self).setUp()
+        self.pylons_config['sitemaps.directory'] = \
+            os.path.join(self.env_dir, 'sitemaps')
+
+    def call_sitemaps(self, request_uri, **headers):
+        request = self.init_fake_request(request_uri=request_uri)
+        request.environ.update(headers)
+        # memory caches are shared by all tests in the process
+        app_globals.sitemap_sweeps.clear()
+        return self.call_controller(SitemapsController, request)
+
+    def call_latest(self, **headers):
+        request = self.init_fake_request(request_uri='/latest.xml')
+        request.environ.update(headers)
+        return self.call_controller(SitemapsController, request)
+
+    def test_answers_conditional_requests_with_not_modified(self):
+        response = self.call_latest()
+        assert_equals(200, response.status_int)
+        assert_contains('<rss', response.body)
+        assert_not_none(response.etag)
+        assert_equals('public, max-age=180', response.headers['Cache-Control'])
+
+        etag = response.headers['ETag']
+        response = self.call_latest(HTTP_IF_NONE_MATCH=etag)
+        assert_equals(304, response.status_int)
+        assert_equals('', response.body)
+
+        response = self.call_latest(
+            HTTP_IF_MODIFIED_SINCE='Thu, 01 Jan 2004 00:00:00 GMT')
+        assert_equals(200, response.status_int)
+
+    def test_serves_pre_generated_sitemaps(self):
+        response = self.call_sitemaps('/sitemap.xml')
+        assert_equals(200, response.status_int)
+        assert_contains('<sitemapindex', response.body)
+        assert_contains('/sitemap0.xml</loc>', response.body)
+        assert_equals('public, max-age=14400', response.headers['Cache-Control'])
+
+        response = self.call_sitemaps('/sitemap0.xml')
+        assert_equals(200, response.status_int)
+        assert_contains('<urlset', response.body)
+        assert_contains('/media/adding-a-video-in-mediadrop</loc>', response.body)
+
+        etag = response.headers['ETag']
+        response = self.call_sitemaps('/sitemap0.xml', HTTP_IF_NONE_MATCH=etag)
+        assert_equals(304, response.status_int)
+
+        assert_equals(404, self.call_sitemaps('/sitemap1.xml').status_int)
+
+    def test_serves_pre_generated_mrss_feed(self):
+        response = self.call_sitemaps('/mrss.xml')
+        assert_equals(200, response.status_int)
+        assert_equals('application/rss+xml', response.headers['Content-Type'])
+        assert_contains('<title>Adding a Video in MediaDrop</title>',
+                        response.body)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SitemapsControllerTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -10,6 +10,7 @@ import simplejson as json
 from pylons import request, tmpl_context
 from pylons.controllers.util import abort
 
+from mediadrop.controllers.resumable_upload import add_resumable_upload
 from mediadrop.forms.uploader import UploadForm
 from mediadrop.lib import email
 from mediadrop.lib.base import BaseController
@@ -128,6 +129,7 @@ class UploadController(BaseController):
                     kwargs['name'], kwargs['email'],
                     kwargs['title'], kwargs['description'],
                     None, kwargs['file'], kwargs['url'],
+                    kwargs.get('upload_id'),
                 )
                 email.send_media_notification(media_obj)
                 data = dict(
@@ -151,6 +153,7 @@ class UploadController(BaseController):
             kwargs['name'], kwargs['email'],
             kwargs['title'], kwargs['description'],
             None, kwargs['file'], kwargs['url'],
+            kwargs.get('upload_id'),
         )
         email.send_media_notification(media_obj)
 
@@ -167,7 +170,7 @@ class UploadController(BaseController):
     def failure(self, **kwargs):
         return dict()
 
-    def save_media_obj(self, name, email, title, description, tags, uploaded_file, url):
+    def save_media_obj(self, name, email, title, description, tags, uploaded_file, url, upload_id=None):
         # create our media object as a status-less placeholder initially
         media_obj = Media()
         media_obj.author = Author(name, email)
@@ -183,7 +186,11 @@ class UploadController(BaseController):
         DBSession.flush()
 
         # Create a MediaFile object, add it to the media_obj, and store the file permanently.
-        media_file = add_new_media_file(media_obj, file=uploaded_file, url=url)
+        if upload_id:
+            # the file was sent before with the resumable upload protocol
+            media_file = add_resumable_upload(media_obj, upload_id)
+        else:
+            media_file = add_new_media_file(media_obj, file=uploaded_file, url=url)
 
         # The thumbs may have been created already by add_new_media_file
         if not has_thumbs(media_obj):
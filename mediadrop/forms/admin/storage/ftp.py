@@ -12,7 +12,8 @@ from mediadrop.forms.admin.storage import StorageForm
 from mediadrop.lib.i18n import N_
 from mediadrop.lib.storage.ftp import (FTP_SERVER,
     FTP_USERNAME, FTP_PASSWORD,
-    FTP_UPLOAD_DIR, FTP_MAX_INTEGRITY_RETRIES,
+    FTP_UPLOAD_DIR, FTP_MAX_INTEGRITY_RETRIES, FTP_MAX_RESUME_RETRIES,
+    FTP_BLOCK_SIZE, FTP_POOL_SIZE,
     HTTP_DOWNLOAD_URI, RTMP_SERVER_URI)
 from mediadrop.plugin import events
 
@@ -29,6 +30,9 @@ class FTPStorageForm(StorageForm):
                 TextField('password', label_text=N_('Password')),
                 TextField('upload_dir', label_text=N_('Subdirectory on server to upload to')),
                 TextField('upload_integrity_retries', label_text=N_('How many times should MediaDrop try to verify the FTP upload before declaring it a failure?'), validator=Int()),
+                TextField('upload_resume_retries', label_text=N_('How many times should MediaDrop try to resume an interrupted FTP upload?'), validator=Int(min=0)),
+                TextField('block_size', label_text=N_('Block size for FTP uploads (bytes)'), validator=Int(min=1024)),
+                TextField('pool_size', label_text=N_('Maximum number of simultaneous FTP connections'), validator=Int(min=1)),
                 TextField('http_download_uri', label_text=N_('HTTP URL to access remotely stored files')),
                 TextField('rtmp_server_uri', label_text=N_('RTMP Server URL to stream remotely stored files (Optional)')),
             ]
@@ -55,6 +59,9 @@ class FTPStorageForm(StorageForm):
         ftp.setdefault('password', data.get(FTP_PASSWORD, None))
         ftp.setdefault('upload_dir', data.get(FTP_UPLOAD_DIR, None))
         ftp.setdefault('upload_integrity_retries', data.get(FTP_MAX_INTEGRITY_RETRIES, None))
+        ftp.setdefault('upload_resume_retries', data.get(FTP_MAX_RESUME_RETRIES, None))
+        ftp.setdefault('block_size', data.get(FTP_BLOCK_SIZE, None))
+        ftp.setdefault('pool_size', data.get(FTP_POOL_SIZE, None))
         ftp.setdefault('http_download_uri', data.get(HTTP_DOWNLOAD_URI, None))
         ftp.setdefault('rtmp_server_uri', data.get(RTMP_SERVER_URI, None))
         return StorageForm.display(self, value, engine, **kwargs)
@@ -81,5 +88,8 @@ class FTPStorageForm(StorageForm):
         engine._data[FTP_PASSWORD] = ftp['password']
         engine._data[FTP_UPLOAD_DIR] = ftp['upload_dir']
         engine._data[FTP_MAX_INTEGRITY_RETRIES] = ftp['upload_integrity_retries']
+        engine._data[FTP_MAX_RESUME_RETRIES] = ftp['upload_resume_retries']
+        engine._data[FTP_BLOCK_SIZE] = ftp['block_size']
+        engine._data[FTP_POOL_SIZE] = ftp['pool_size']
         engine._data[HTTP_DOWNLOAD_URI] = ftp['http_download_uri']
         engine._data[RTMP_SERVER_URI] = ftp['rtmp_server_uri']
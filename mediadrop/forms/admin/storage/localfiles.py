@@ -5,6 +5,9 @@
 # (at your option) any later version.
 # See LICENSE.txt in the main project directory, for more information.
 
+from formencode.validators import Int
+from tw.forms import CheckBox
+
 from mediadrop.forms import ListFieldSet, TextField
 from mediadrop.forms.admin.storage import StorageForm
 from mediadrop.lib.i18n import N_
@@ -26,8 +29,34 @@ class LocalFileStorageForm(StorageForm):
                     label_text=N_('RTMP Server URL'),
                     help_text=N_('Files must be accessible under the same name as they are stored with locally.'),
                 ),
+                CheckBox('content_addressed',
+                    label_text=N_('Store identical files only once'),
+                    help_text=N_('New files are stored in folders named after their SHA-256 checksum so uploading the same file again uses no extra disk space.'),
+                ),
+            ],
+        ),
+        ListFieldSet('secure_links',
+            suppress_label=True,
+            legend=N_('Signed download links (served by nginx without MediaDrop):'),
+            children=[
+                TextField('url',
+                    label_text=N_('Base URL for signed links'),
+                    help_text=N_('An nginx location using the "secure_link" module which serves your media directory. Leave empty to serve files through MediaDrop.'),
+                ),
+                TextField('secret',
+                    label_text=N_('Secret key'),
+                    help_text=N_('The secret used in "secure_link_md5".'),
+                ),
+                TextField('key_id',
+                    label_text=N_('Key ID'),
+                    help_text=N_('Optional, added to the URL path. Use a new key ID whenever you change the secret so links signed with the old secret keep working until they expire.'),
+                ),
+                TextField('lifetime',
+                    label_text=N_('Link lifetime (seconds)'),
+                    validator=Int(min=60),
+                ),
             ],
-        )
+        ),
     ] + StorageForm.buttons
 
 
@@ -47,6 +76,12 @@ class LocalFileStorageForm(StorageForm):
         specifics = value.setdefault('specifics', {})
         specifics.setdefault('path', engine._data.get('path', None))
         specifics.setdefault('rtmp_server_uri', engine._data.get('rtmp_server_uri', None))
+        specifics.setdefault('content_addressed', engine._data.get('content_addressed', False))
+        secure_links = value.setdefault('secure_links', {})
+        secure_links.setdefault('url', engine._data.get('secure_link_url', None))
+        secure_links.setdefault('secret', engine._data.get('secure_link_secret', None))
+        secure_links.setdefault('key_id', engine._data.get('secure_link_key_id', None))
+        secure_links.setdefault('lifetime', engine._data.get('secure_link_lifetime', 3600))
         return StorageForm.display(self, value, engine, **kwargs)
 
     def save_engine_params(self, engine, **kwargs):
@@ -68,3 +103,9 @@ class LocalFileStorageForm(StorageForm):
         specifics = kwargs['specifics']
         engine._data['path'] = specifics['path'] or None
         engine._data['rtmp_server_uri'] = specifics['rtmp_server_uri'] or None
+        engine._data['content_addressed'] = bool(specifics['content_addressed'])
+        secure_links = kwargs['secure_links']
+        engine._data['secure_link_url'] = secure_links['url'] or None
+        engine._data['secure_link_secret'] = secure_links['secret'] or None
+        engine._data['secure_link_key_id'] = secure_links['key_id'] or None
+        engine._data['secure_link_lifetime'] = secure_links['lifetime'] or 3600
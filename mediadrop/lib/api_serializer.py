@@ -0,0 +1,218 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Serialize many media for the JSON API at once.
+
+Serializing one media at a time loads its categories, its podcast and its
+comment count with separate queries. :class:`MediaSerializer` fetches them
+for all media with one query each and generates the thumbnail URLs without
+calling Routes (or checking the file system) for every size. Data for
+fields which were not requested is not loaded at all.
+
+The files of all media are loaded with a single query, too (see
+:func:`file_info` for the format).
+"""
+
+from sqlalchemy import func
+
+from mediadrop.lib.fragments import cached_fragment
+from mediadrop.lib.players import embed_player
+from mediadrop.lib.thumbnails import thumbs_for
+from mediadrop.lib.util import url_for, url_for_media
+
+__all__ = [
+    'MEDIA_FIELDS',
+    'MediaSerializer',
+    'file_info',
+    'parse_fields',
+]
+
+MEDIA_FIELDS = (
+    'id', 'slug', 'url', 'title', 'author', 'type', 'podcast', 'description',
+    'description_plain', 'comment_count', 'publish_on', 'likes', 'views',
+    'thumbs', 'categories', 'embed', 'files',
+)
+
+def parse_fields(fields):
+    """Parse a comma separated list of field names.
+
+    :param fields: The ``fields`` parameter of an API request.
+    :type fields: unicode or None
+    :returns: A list of field names or ``None`` if no field was given.
+    :raises ValueError: If an unknown field is requested.
+    """
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = sorted(set(names).difference(MEDIA_FIELDS))
+    if unknown:
+        raise ValueError('Invalid fields (%s). Only %s are supported'
+                         % (', '.join(unknown), ', '.join(MEDIA_FIELDS)))
+    return names or None
+
+
+class MediaSerializer(object):
+    """Build JSON-ready **media_info** dicts for many media.
+
+    :param fields: The names of the fields to include (see
+        :data:`MEDIA_FIELDS`), ``None`` includes all fields except
+        ``embed`` and ``files``.
+    :param include_embed: Include the ``embed`` field, too, if no fields
+        were given.
+    :type include_embed: bool
+    :param include_files: Include the ``files`` field (a list of
+        **file_info** dicts), too, if no fields were given.
+    :type include_files: bool
+    """
+    def __init__(self, fields=None, include_embed=False, include_files=False):
+        if fields is None:
+            optional = dict(embed=include_embed, files=include_files)
+            fields = [name for name in MEDIA_FIELDS
+                      if optional.get(name, True)]
+        self.fields = frozenset(fields)
+
+    def serialize(self, media_list):
+        """Return a **media_info** dict for each of the given media.
+
+        :type media_list: list of :class:`~mediadrop.model.media.Media`
+        :rtype: list of dicts
+        """
+        media_list = list(media_list)
+        if not media_list:
+            return []
+        media_ids = [m.id for m in media_list]
+        fields = self.fields
+        if fields.intersection(('url', 'podcast')):
+            podcast_slugs = self._podcast_slugs(media_list)
+        if 'categories' in fields:
+            categories = self._categories(media_ids)
+        if 'comment_count' in fields:
+            comment_counts = self._comment_counts(media_ids)
+        if 'thumbs' in fields:
+            thumbs = thumbs_for(media_list, qualified=True)
+        if 'files' in fields:
+            files = self._files(media_ids)
+
+        infos = []
+        for i, media in enumerate(media_list):
+            info = {}
+            if 'id' in fields:
+                info['id'] = media.id
+            if 'slug' in fields:
+                info['slug'] = media.slug
+            if 'url' in fields:
+                info['url'] = self._url(media, podcast_slugs)
+            if 'title' in fields:
+                info['title'] = media.title
+            if 'author' in fields:
+                info['author'] = media.author.name
+            if 'type' in fields:
+                info['type'] = media.type
+            if 'podcast' in fields:
+                info['podcast'] = podcast_slugs.get(media.podcast_id)
+            if 'description' in fields:
+                info['description'] = media.description
+            if 'description_plain' in fields:
+                info['description_plain'] = media.description_plain
+            if 'comment_count' in fields:
+                info['comment_count'] = comment_counts.get(media.id, 0)
+            if 'publish_on' in fields:
+                info['publish_on'] = unicode(media.publish_on)
+            if 'likes' in fields:
+                info['likes'] = media.likes
+            if 'views' in fields:
+                info['views'] = media.views
+            if 'thumbs' in fields:
+                info['thumbs'] = thumbs[i]
+            if 'categories' in fields:
+                info['categories'] = categories.get(media.id, {})
+            if 'embed' in fields:
+                info['embed'] = self._embed(media)
+            if 'files' in fields:
+                media_url = url_for_media(media, qualified=True)
+                info['files'] = [file_info(file, media_url)
+                                 for file in files.get(media.id, ())]
+            infos.append(info)
+        return infos
+
+    def _url(self, media, podcast_slugs):
+        if media.podcast_id:
+            return url_for(controller='/media', action='view', slug=media.slug,
+                           podcast_slug=podcast_slugs[media.podcast_id],
+                           qualified=True)
+        return url_for(controller='/media', action='view', slug=media.slug,
+                       qualified=True)
+
+    def _embed(self, media):
+        return unicode(cached_fragment('api-embed', media,
+                                       lambda: unicode(embed_player(media))))
+
+    def _podcast_slugs(self, media_list):
+        from mediadrop.model import DBSession, Podcast
+        podcast_ids = set(m.podcast_id for m in media_list if m.podcast_id)
+        if not podcast_ids:
+            return {}
+        return dict(DBSession.query(Podcast.id, Podcast.slug)\
+            .filter(Podcast.id.in_(podcast_ids)))
+
+    def _categories(self, media_ids):
+        from mediadrop.model import Category, DBSession
+        from mediadrop.model.media import media_categories
+        categories = {}
+        rows = DBSession.query(media_categories.c.media_id,
+                               Category.slug, Category.name)\
+            .filter(Category.id == media_categories.c.category_id)\
+            .filter(media_categories.c.media_id.in_(media_ids))
+        for media_id, slug, name in rows:
+            categories.setdefault(media_id, {})[slug] = name
+        return categories
+
+    def _files(self, media_ids):
+        from mediadrop.model import MediaFile
+        files = {}
+        query = MediaFile.query\
+            .filter(MediaFile.media_id.in_(media_ids))\
+            .order_by(MediaFile.type.asc(), MediaFile.id)
+        for file in query:
+            files.setdefault(file.media_id, []).append(file)
+        return files
+
+    def _comment_counts(self, media_ids):
+        from mediadrop.model import Comment, DBSession
+        return dict(DBSession.query(Comment.media_id, func.count(Comment.id))\
+            .filter(Comment.media_id.in_(media_ids))\
+            .filter(Comment.publishable == True)\
+            .group_by(Comment.media_id))
+
+
+def file_info(file, media_url):
+    """Return a **file_info** dict for the given file.
+
+    See :meth:`mediadrop.controllers.api.media.MediaController._file_info`
+    for the fields.
+
+    :type file: :class:`~mediadrop.model.media.MediaFile`
+    :param media_url: The URL of the view page of the file's media.
+    :rtype: JSON-ready dict
+    """
+    uris = []
+    for uri in file.get_uris():
+        uris.append({
+            'scheme': uri.scheme,
+            'uri': str(uri),
+            'server': uri.server_uri,
+            'file': uri.file_uri,
+        })
+    return dict(
+        container = file.container,
+        type = file.type,
+        display_name = file.display_name,
+        created = file.created_on.isoformat(),
+        url = media_url,
+        uris = uris,
+    )
@@ -24,6 +24,18 @@ class Globals(object):
         self.settings_cache = cache.get_cache('app_settings',
                                               expire=3600,
                                               type='memory')
+        # Rendered fragments of media, see mediadrop.lib.fragments
+        self.fragment_cache_expire = int(config.get('fragment_cache.expire',
+                                                    3600))
+        self.fragment_cache = cache.get_cache('fragments',
+                                              expire=self.fragment_cache_expire)
+        self.fragment_versions = cache.get_cache('fragment_versions')
+        # Pre-generated sitemap files are checked for changes whenever this
+        # value expired, see mediadrop.lib.sitemap_files
+        self.sitemap_sweeps = cache.get_cache('sitemap_sweeps',
+            expire=int(config.get('sitemaps.sweep_interval', 300)))
+        # set by mediadrop.lib.response_cache.setup_response_cache()
+        self.response_cache = None
 
         # We'll store the primary translator here for sharing between requests
         self.primary_language = None
@@ -0,0 +1,113 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Export the published catalogue as newline delimited JSON (NDJSON).
+
+The media are fetched in batches ordered by ID. Every batch continues after
+the last ID of the previous one (keyset pagination) instead of using an
+OFFSET, so each query is as fast as the first and only one batch is kept in
+memory no matter how many media there are. Every line is a **media_info**
+dict (see :class:`~mediadrop.lib.api_serializer.MediaSerializer`) which
+includes the files and categories of the media.
+
+Used by :meth:`mediadrop.controllers.api.media.MediaController.export` and
+``batch-scripts/export_catalogue.py``.
+"""
+
+from datetime import datetime
+
+import simplejson
+from sqlalchemy import sql
+
+from mediadrop.lib.api_serializer import MediaSerializer
+
+__all__ = [
+    'export_lines',
+    'export_media',
+    'export_query',
+    'parse_modified_since',
+]
+
+DATETIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+def parse_modified_since(value):
+    """Parse a date in "YYYY-MM-DD HH:MM:SS" (ISO 8601) format.
+
+    :param value: The date, the time may be omitted.
+    :type value: unicode or None
+    :rtype: :class:`datetime.datetime` or ``None``
+    :raises ValueError: If the date has an invalid format.
+    """
+    if not value:
+        return None
+    for format in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), format)
+        except ValueError:
+            pass
+    raise ValueError('Invalid date (%s). The expected format is '
+                     '"YYYY-MM-DD HH:MM:SS"' % value)
+
+def export_query(modified_since=None):
+    """Return a query for all published media (which were modified since
+    the given date).
+
+    Media count as modified if the media itself or one of its files was
+    changed. Media which were deleted or unpublished since then are not
+    included.
+
+    :type modified_since: :class:`datetime.datetime` or ``None``
+    :rtype: :class:`~mediadrop.model.media.MediaQuery`
+    """
+    from mediadrop.model import DBSession, Media, MediaFile
+    query = Media.query.published()
+    if modified_since is not None:
+        changed_files = DBSession.query(MediaFile.media_id)\
+            .filter(MediaFile.modified_on >= modified_since)
+        query = query.filter(sql.or_(
+            Media.modified_on >= modified_since,
+            Media.id.in_(changed_files.subquery()),
+        ))
+    return query
+
+def export_media(modified_since=None, batch_size=500):
+    """Yield a **media_info** dict (including files) for every exported
+    media in ID order.
+
+    :type modified_since: :class:`datetime.datetime` or ``None``
+    :param batch_size: The number of media loaded per query.
+    """
+    from mediadrop.model import Media
+    serializer = MediaSerializer(include_files=True)
+    query = export_query(modified_since).order_by(Media.id)
+    last_id = None
+    while True:
+        batch_query = query
+        if last_id is not None:
+            batch_query = batch_query.filter(Media.id > last_id)
+        batch = batch_query.limit(batch_size).all()
+        if not batch:
+            return
+        for info in serializer.serialize(batch):
+            yield info
+        last_id = batch[-1].id
+
+def export_lines(modified_since=None, batch_size=500):
+    """Yield the NDJSON export, one string per batch of media.
+
+    :type modified_since: :class:`datetime.datetime` or ``None``
+    :param batch_size: The number of media per query (and per string).
+    """
+    lines = []
+    for info in export_media(modified_since, batch_size):
+        lines.append(simplejson.dumps(info) + '\n')
+        if len(lines) >= batch_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
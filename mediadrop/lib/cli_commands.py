@@ -9,18 +9,21 @@
 
 import os
 import sys
+from urlparse import urlsplit
 
 import paste.fixture
 import paste.registry
 import paste.deploy.config
 from paste.deploy import loadapp, appconfig
 from paste.script.command import Command, BadCommand
+from routes.lru import LRUCache
 
 import pylons
 
 __all__ = [
     'LoadAppCommand',
     'load_app',
+    'set_base_url',
 ]
 
 class LoadAppCommand(Command):
@@ -121,3 +124,27 @@ def load_app(cmd):
         cmd.parser.print_help()
         sys.exit(1)
     return cmd
+
+def set_base_url(base_url):
+    """Generate qualified URLs for the given site instead of the fake
+    ``http://localhost`` request of :class:`LoadAppCommand`.
+
+    :param base_url: The public URL of the site, e.g.
+        ``https://videos.site.example/mediadrop``.
+    :raises ValueError: If the URL is not an absolute http(s) URL.
+    """
+    scheme, netloc, path, query, fragment = urlsplit(base_url)
+    if scheme not in ('http', 'https') or not netloc:
+        raise ValueError('Invalid base URL (%s), expected something like '
+                         '"http://site.example"' % base_url)
+    environ = pylons.request.environ
+    environ['wsgi.url_scheme'] = scheme
+    environ['HTTP_HOST'] = netloc
+    environ['SCRIPT_NAME'] = path.rstrip('/')
+    environ.pop('HTTPS', None)
+    # Routes caches the host of the first generated URL and all URLs which
+    # were generated without a SCRIPT_NAME
+    environ.pop('routes.cached_hostinfo', None)
+    mapper = pylons.config['routes.map']
+    if mapper.urlcache is not None:
+        mapper.urlcache = LRUCache(mapper.urlcache.size)
@@ -0,0 +1,137 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Answer conditional GET requests for feeds, sitemaps and API responses.
+
+Actions compute cheap validators (a modification date and some data for the
+ETag) *before* they render anything and call :func:`check_conditional_get`.
+If the client already has the current version (``If-None-Match`` or
+``If-Modified-Since``) a ``304 Not Modified`` is raised so the response is
+neither rendered nor transferred again.
+"""
+
+import calendar
+from hashlib import sha1
+import time
+
+from pylons import request, response
+from sqlalchemy import func
+from webob.exc import HTTPNotModified
+
+from mediadrop import __version__
+
+__all__ = [
+    'abort_if_not_modified',
+    'check_conditional_get',
+    'media_validators',
+]
+
+def media_validators(query, counters=False):
+    """Return the last modification date and ETag data of a media query.
+
+    Only aggregates are fetched (no media rows). Besides the latest
+    modification date the number of media and the sum of their IDs are
+    returned so deleted media and media which were added to or removed from
+    a category/podcast are detected, too. The latest publish date catches
+    media which were published at a scheduled time without any change.
+
+    Views and likes do not change the modification date. Feeds and sitemaps
+    show them as they were rendered (like the ``beaker_cache`` did before),
+    responses which must show the current numbers pass ``counters=True``.
+
+    :param query: A :class:`~mediadrop.model.media.MediaQuery` (without
+        limit or offset).
+    :param counters: Include views, likes and comments in the ETag data.
+    :returns: A tuple ``(last_modified, etag_data)``.
+    """
+    from mediadrop.model import Comment, DBSession, Media, MediaFile
+    query = query.order_by(None)
+    media_ids = query.with_entities(Media.id).subquery()
+    columns = [
+        func.count(Media.id),
+        func.sum(Media.id),
+        func.max(Media.modified_on),
+        func.max(Media.publish_on),
+    ]
+    if counters:
+        columns += [func.sum(Media.views), func.sum(Media.likes)]
+    row = query.with_entities(*columns).one()
+    dates = list(row[2:4])
+    etag_data = [row[0]] + [value and int(value) for value in row[1:2] + row[4:]]
+    dates.append(DBSession.query(func.max(MediaFile.modified_on))\
+        .filter(MediaFile.media_id.in_(media_ids))\
+        .scalar())
+    if counters:
+        comment_count, comments_modified = DBSession\
+            .query(func.count(Comment.id), func.max(Comment.modified_on))\
+            .filter(Comment.media_id.in_(media_ids))\
+            .one()
+        etag_data.append(comment_count)
+        dates.append(comments_modified)
+    dates = [d for d in dates if d is not None]
+    last_modified = dates and max(dates) or None
+    return last_modified, tuple(etag_data)
+
+def check_conditional_get(last_modified=None, etag_data=(), max_age=None):
+    """Set the validators of the current response, abort with 304 if the
+    client's copy is still current.
+
+    The ETag is derived from ``last_modified``, ``etag_data``, the settings,
+    the groups of the current user and the MediaDrop version (which changes
+    the templates).
+
+    :type last_modified: :class:`datetime.datetime` or ``None``
+    :param last_modified: The (local) date of the last change.
+    :param etag_data: Additional data the response depends on, it must have
+        a stable ``repr()``.
+    :param max_age: Number of seconds clients may use the response without
+        revalidation (match the ``beaker_cache`` expiry of the action).
+        ``None`` keeps the default ``Cache-Control: no-cache`` so clients
+        revalidate every time.
+    :raises webob.exc.HTTPNotModified: If the client's copy is current.
+    """
+    group_ids = sorted(group.group_id for group in request.perm.groups)
+    etag_key = (
+        etag_data,
+        last_modified,
+        sorted(request.settings.items()),
+        group_ids,
+        __version__,
+    )
+    response.etag = sha1(repr(etag_key)).hexdigest()
+    if last_modified is not None:
+        response.last_modified = int(time.mktime(last_modified.timetuple()))
+    if max_age is not None:
+        private = request.environ.get('repoze.who.identity') is not None
+        response.headers['Cache-Control'] = '%s, max-age=%d' \
+            % (private and 'private' or 'public', max_age)
+        response.headers.pop('Pragma', None)
+    abort_if_not_modified()
+
+def abort_if_not_modified():
+    """Raise a 304 if the validators of the current response match the
+    request (e.g. after the response was restored from a cache).
+
+    :raises webob.exc.HTTPNotModified: If the client's copy is current.
+    """
+    if not _is_not_modified(response.etag, response.last_modified):
+        return
+    # The headers of the response are merged into the 304 response.
+    response.headers.pop('Content-Type', None)
+    response.headers.pop('Content-Length', None)
+    raise HTTPNotModified()
+
+def _is_not_modified(etag, last_modified):
+    if 'HTTP_IF_NONE_MATCH' in request.environ:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 2616)
+        return etag is not None and etag in request.if_none_match
+    if_modified_since = request.if_modified_since
+    if last_modified is None or if_modified_since is None:
+        return False
+    return calendar.timegm(last_modified.utctimetuple()) \
+        <= calendar.timegm(if_modified_since.utctimetuple())
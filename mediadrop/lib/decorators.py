@@ -5,10 +5,14 @@
 # (at your option) any later version.
 # See LICENSE.txt in the main project directory, for more information.
 
+import itertools
 import logging
+import random
 import warnings
 import simplejson
+import threading
 import time
+import types
 
 import formencode
 import tw.forms
@@ -20,13 +24,17 @@ from pylons.decorators.cache import create_cache_key, _make_dict_from_args
 from pylons.decorators.util import get_pylons
 from webob.exc import HTTPException, HTTPMethodNotAllowed
 
+from mediadrop.lib.conditional_get import abort_if_not_modified
 from mediadrop.lib.paginate import paginate
-from mediadrop.lib.templating import render
+from mediadrop.lib.templating import (STREAMING_RESPONSE_KEY, render,
+    render_chunks)
 
 __all__ = [
+    'CacheStatistics',
     'ValidationState',
     'autocommit',
     'beaker_cache',
+    'cache_statistics',
     'expose',
     'expose_xhr',
     'memoize',
@@ -67,13 +75,15 @@ def _get_func_attrs(f):
         result[x] = getattr(f, x, (None,))
     return result
 
-def _expose_wrapper(f, template, request_method=None, permission=None):
+def _expose_wrapper(f, template, request_method=None, permission=None,
+                    streaming=False):
     """Returns a function that will render the passed in function according
     to the passed in template"""
     f.exposed = True
 
     # Shortcut for simple expose of strings
-    if template == 'string' and not request_method and not permission:
+    if template == 'string' and not request_method and not permission \
+            and not streaming:
         return f
 
     if request_method:
@@ -90,6 +100,9 @@ def _expose_wrapper(f, template, request_method=None, permission=None):
             tmpl = request.override_template
 
         if tmpl == 'string':
+            if streaming and not isinstance(result, basestring):
+                # an iterable of strings, see below
+                request.environ[STREAMING_RESPONSE_KEY] = True
             return result
 
         if tmpl == 'json':
@@ -117,6 +130,12 @@ def _expose_wrapper(f, template, request_method=None, permission=None):
             if response.content_type == 'text/html':
                 response.content_type = 'application/xhtml+xml'
 
+        if streaming:
+            # The registry and the DBSession are kept until the response
+            # was sent (see mediadrop.config.middleware).
+            request.environ[STREAMING_RESPONSE_KEY] = True
+            return render_chunks(render(tmpl, tmpl_vars=result),
+                                 template_name=tmpl)
         return render(tmpl, tmpl_vars=result, method='auto')
 
     if permission:
@@ -125,7 +144,8 @@ def _expose_wrapper(f, template, request_method=None, permission=None):
 
     return wrapped_f
 
-def expose(template='string', request_method=None, permission=None):
+def expose(template='string', request_method=None, permission=None,
+           streaming=False):
     """Simple expose decorator for controller actions.
 
     Transparently wraps a method in a function that will render the method's
@@ -155,9 +175,17 @@ def expose(template='string', request_method=None, permission=None):
         POST is given and the method of the current request does not match,
         a 405 Method Not Allowed error is raised.
 
+    :param streaming: Render the template while the response is sent
+        (in chunks, see :func:`~mediadrop.lib.templating.render_chunks`)
+        instead of rendering the complete response in memory first. Use
+        this for responses which may be very large (e.g. feeds). With the
+        'string' template the action may return an iterable (e.g. a
+        generator) of strings which is sent as it is consumed.
+
     """
     def wrap(f):
-        wrapped_f = _expose_wrapper(f, template, request_method, permission)
+        wrapped_f = _expose_wrapper(f, template, request_method, permission,
+                                    streaming)
         _copy_func_attrs(f, wrapped_f)
         return wrapped_f
     return wrap
@@ -410,11 +438,50 @@ class validate_xhr(validate):
         else:
             return super(validate_xhr, self)._call_error_handler(args, kwargs)
 
+class CacheStatistics(object):
+    """Count how :func:`beaker_cache` answered requests (per process).
+
+    For each decorated action the number of ``hits``, ``stale`` hits (served
+    while another request regenerated the value), ``misses`` and
+    ``regenerations`` is counted as well as the total and the maximum number
+    of seconds spent regenerating values.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.actions = {}
+
+    def record(self, name, event, duration=None):
+        self._lock.acquire()
+        try:
+            stats = self.actions.setdefault(name, dict(hits=0, stale=0,
+                misses=0, regenerations=0, regeneration_time=0.0,
+                max_regeneration_time=0.0))
+            stats[event] += 1
+            if duration is not None:
+                stats['regeneration_time'] += duration
+                stats['max_regeneration_time'] = \
+                    max(stats['max_regeneration_time'], duration)
+        finally:
+            self._lock.release()
+
+    def summary(self):
+        """Return a sorted list of ``(name, stats)`` tuples."""
+        self._lock.acquire()
+        try:
+            return sorted((name, dict(stats))
+                          for name, stats in self.actions.items())
+        finally:
+            self._lock.release()
+
+cache_statistics = CacheStatistics()
+
 def beaker_cache(key="cache_default", expire="never", type=None,
                  query_args=False,
-                 cache_headers=('content-type', 'content-length'),
+                 cache_headers=('content-type', 'content-length', 'etag',
+                                'last-modified', 'cache-control'),
                  invalidate_on_startup=False,
-                 cache_response=True, **b_kwargs):
+                 cache_response=True, stale_expire=0, jitter=0.1,
+                 max_size=1024 * 1024, **b_kwargs):
     """Cache decorator utilizing Beaker. Caches action or other
     function that returns a pickle-able object as a result.
 
@@ -435,7 +502,8 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         Uses the query arguments as the key, defaults to False
     ``cache_headers``
         A tuple of header names indicating response headers that
-        will also be cached.
+        will also be cached. If the cached ``ETag``/``Last-Modified``
+        headers match the request a ``304 Not Modified`` is returned.
     ``invalidate_on_startup``
         If True, the cache will be invalidated each time the application
         starts or is restarted.
@@ -446,6 +514,24 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         .. note::
             When cache_response is set to False, the cache_headers
             argument is ignored as none of the response is cached.
+    ``stale_expire``
+        Number of seconds an expired value is still served while one
+        request regenerates it, defaults to 0 (requests wait for the new
+        value).
+    ``jitter``
+        Fraction of ``expire`` by which values expire earlier at random so
+        values which were created together are not regenerated together,
+        defaults to 0.1.
+    ``max_size``
+        Streamed results (see ``expose(streaming=True)``) are only cached
+        if they are smaller than this many bytes, larger results are
+        streamed to the client without caching them. Defaults to 1 MB.
+
+    Only one request (per key) regenerates an expired value, concurrent
+    requests wait for it or get the stale value. The lock is provided by
+    the Beaker backend (file locks for ``file`` and ``ext:memcached`` so
+    all processes on a host share it). Hits, misses and regeneration times
+    are recorded in :data:`cache_statistics`.
 
     If cache_enabled is set to False in the .ini file, then cache is
     disabled globally.
@@ -492,6 +578,7 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         if args:
             self = args[0]
         namespace, cache_key = create_cache_key(func, key_dict, self)
+        stats_name = '%s.%s' % (namespace, func.__name__)
 
         if type:
             b_kwargs['type'] = type
@@ -506,7 +593,9 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         if expire == "never":
             cache_expire = None
         else:
-            cache_expire = expire
+            # Beaker removes the value only after the stale period, the
+            # value itself records when it has to be regenerated.
+            cache_expire = expire + stale_expire
 
         def create_func():
             log.debug("Creating new cache copy with key: %s, type: %s",
@@ -517,6 +606,8 @@ def beaker_cache(key="cache_default", expire="never", type=None,
             if hasattr(result, '__html__'):
                 # Genshi Markup object, can not be pickled
                 result = unicode(result.__html__())
+            elif isinstance(result, types.GeneratorType):
+                result = _buffer_chunks(result, max_size)
             glob_response = pylons.response
             headers = glob_response.headerlist
             status = glob_response.status
@@ -524,18 +615,72 @@ def beaker_cache(key="cache_default", expire="never", type=None,
                                  cookies=None, content=result)
             return full_response
 
-        response = my_cache.get_value(cache_key, createfunc=create_func,
-                                      expiretime=cache_expire,
-                                      starttime=starttime)
+        def cached_response():
+            try:
+                return my_cache.get(cache_key, starttime=starttime)
+            except KeyError:
+                return None
+
+        def is_fresh(response):
+            return response is not None and (cache_expire is None
+                or response.get('fresh_until', 0) > time.time())
+
+        def regenerate():
+            start = time.time()
+            response = create_func()
+            if cache_expire is not None:
+                response['fresh_until'] = time.time() \
+                    + expire * (1 - jitter * random.random())
+            if not isinstance(response['content'], itertools.chain):
+                # only oversized streamed results are not cached
+                my_cache.put(cache_key, response, expiretime=cache_expire)
+            duration = time.time() - start
+            cache_statistics.record(stats_name, 'regenerations', duration)
+            log.debug("Regenerated %s in %.3f seconds", stats_name, duration)
+            return response
+
+        response = cached_response()
+        if is_fresh(response):
+            cache_statistics.record(stats_name, 'hits')
+        else:
+            creation_lock = my_cache.namespace.get_creation_lock(cache_key)
+            if response is not None and not creation_lock.acquire(wait=False):
+                # another request regenerates the value already
+                cache_statistics.record(stats_name, 'stale')
+            else:
+                if response is None:
+                    cache_statistics.record(stats_name, 'misses')
+                    creation_lock.acquire()
+                try:
+                    # the value may have been created while we waited
+                    response = cached_response()
+                    if not is_fresh(response):
+                        response = regenerate()
+                finally:
+                    creation_lock.release()
+
         if cache_response:
             glob_response = pylons.response
             glob_response.headerlist = [header for header in response['headers']
                                         if header[0].lower() in cache_headers]
             glob_response.status = response['status']
+            abort_if_not_modified()
 
         return response['content']
     return decorator(wrapper)
 
+def _buffer_chunks(chunks, max_size):
+    """Return the complete output as a string if it is smaller than
+    ``max_size`` bytes, otherwise an iterator over all chunks."""
+    buffered = []
+    size = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        size += len(chunk)
+        if size > max_size:
+            return itertools.chain(buffered, chunks)
+    return ''.join(buffered)
+
 def observable(event):
     """Filter the result of the decorated action through the events observers.
 
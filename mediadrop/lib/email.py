@@ -18,17 +18,19 @@ Email Helpers
 
 .. autofunction:: send_comment_notification
 
+.. autofunction:: comment_notification
+
 .. autofunction:: parse_email_string
 
 """
 
-import smtplib
-
+from paste.util.converters import asbool
 from pylons import config, request
 
 from mediadrop.lib.helpers import (line_break_xhtml, strip_xhtml, url_for, 
     url_for_media)
 from mediadrop.lib.i18n import _
+from mediadrop.lib.mail_queue import SMTPConnection, get_mail_queue
 
 def parse_email_string(string):
     """
@@ -47,6 +49,9 @@ def parse_email_string(string):
 def send(to_addrs, from_addr, subject, body):
     """A simple method to send a simple email.
 
+    Unless ``mail_queue`` is disabled in the config the message is only
+    added to the outbound mail queue and sent by a background thread.
+
     :param to_addrs: Comma separated list of email addresses to send to.
     :type to_addrs: unicode
 
@@ -59,25 +64,24 @@ def send(to_addrs, from_addr, subject, body):
     :param body: Body text of the email, optionally marked up with HTML.
     :type body: unicode
     """
-    smtp_server = config.get('smtp_server', 'localhost')
-    server = smtplib.SMTP(smtp_server)
     if isinstance(to_addrs, basestring):
         to_addrs = parse_email_string(to_addrs)
 
-    to_addrs = ", ".join(to_addrs)
-
-    msg = ("To: %(to_addrs)s\n"
+    msg = ("To: %(to_header)s\n"
            "From: %(from_addr)s\n"
            "Subject: %(subject)s\n\n"
-           "%(body)s\n") % locals()
-
-    smtp_username = config.get('smtp_username')
-    smtp_password = config.get('smtp_password')
-    if smtp_username and smtp_password:
-        server.login(smtp_username, smtp_password)
+           "%(body)s\n") % dict(to_header=", ".join(to_addrs),
+           from_addr=from_addr, subject=subject, body=body)
 
-    server.sendmail(from_addr, to_addrs, msg.encode('utf-8'))
-    server.quit()
+    if asbool(config.get('mail_queue', True)):
+        get_mail_queue(config).put(from_addr, to_addrs, msg)
+        return
+    connection = SMTPConnection(config.get('smtp_server', 'localhost'),
+        config.get('smtp_username'), config.get('smtp_password'))
+    try:
+        connection.send(from_addr, to_addrs, msg.encode('utf-8'))
+    finally:
+        connection.close()
 
 
 def send_media_notification(media_obj):
@@ -132,10 +136,22 @@ def send_comment_notification(media_obj, comment):
     :param comment: The newly posted comment.
     :type comment: :class:`~mediadrop.model.comments.Comment` instance
     """
+    notification = comment_notification(media_obj, comment)
+    if notification:
+        send(**notification)
+
+def comment_notification(media_obj, comment):
+    """
+    Return the arguments for :func:`send` to notify the admins about a new
+    comment, or None if comment notification emails are disabled.
+
+    The message is prepared while there is a request so it can be sent
+    later, e.g. after the comment was checked for spam.
+    """
     send_to = request.settings['email_comment_posted']
     if not send_to:
         # Comment notification emails are disabled!
-        return
+        return None
 
     author_name = media_obj.author.name
     comment_subject = comment.subject
@@ -150,7 +166,8 @@ Post: %(post_url)s
 Body: %(comment_body)s
 """) % locals()
 
-    send(send_to, request.settings['email_send_from'], subject, body)
+    return dict(to_addrs=send_to, from_addr=request.settings['email_send_from'],
+                subject=subject, body=body)
 
 def send_support_request(email, url, description, get_vars, post_vars):
     """
@@ -0,0 +1,266 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Range-aware WSGI application for serving files from the local filesystem.
+
+Unlike :class:`paste.fileapp.FileApp` this app supports multiple byte
+ranges per request, answers conditional requests based on a strong ETag
+and hands contiguous file regions to ``wsgi.file_wrapper`` so servers can
+use ``sendfile(2)`` instead of copying the data through Python.
+"""
+
+import mimetypes
+import os
+from rfc822 import mktime_tz, parsedate_tz
+from wsgiref.handlers import format_date_time
+
+__all__ = [
+    'FileApp',
+    'parse_range_header',
+]
+
+# Reading small blocks is what makes the pure-python fallback slow, 256 KB
+# keeps the per-chunk overhead low without wasting too much memory.
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+# Clients may request several ranges at once. Bound the number so a single
+# request can not make us generate an enormous multipart response.
+MAX_RANGES = 64
+
+def parse_range_header(value, size):
+    """Parse a HTTP ``Range`` header value for a file of the given size.
+
+    Overlapping and adjacent ranges are merged.
+
+    :param value: The raw header value, e.g. ``'bytes=0-499,-500'``.
+    :param size: The size of the file in bytes.
+    :returns: ``None`` if the header is invalid and should be ignored,
+        otherwise a sorted list of ``(start, stop)`` tuples where ``stop``
+        is exclusive. An empty list means that none of the ranges can be
+        satisfied.
+    """
+    units, sep, range_set = value.partition('=')
+    if not sep or units.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    for spec in range_set.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, sep, last = spec.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first or last):
+            return None
+        try:
+            if not first:
+                # suffix range: the last N bytes of the file
+                suffix_length = int(last)
+                if suffix_length == 0:
+                    continue
+                start, stop = max(size - suffix_length, 0), size
+            else:
+                start = int(first)
+                stop = (int(last) + 1) if last else size
+                if last and stop <= start:
+                    return None
+        except ValueError:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(stop, size)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+        else:
+            merged.append((start, stop))
+    return merged
+
+def _parse_http_date(value):
+    if not value:
+        return None
+    parsed = parsedate_tz(value.split(';', 1)[0].strip())
+    if parsed is None:
+        return None
+    return mktime_tz(parsed)
+
+def _etag_list(value):
+    return [tag.strip().lstrip('W/') for tag in value.split(',')]
+
+
+class FileApp(object):
+    """Serve a single file, supporting (multi-)range and conditional GETs.
+
+    :param filename: Absolute path to the file on disk.
+    :param headers: Extra response headers, e.g. a ``Content-Disposition``.
+    :param content_type: Mime type, guessed from the file name if omitted.
+    :param chunk_size: Read size used when the server can not send the
+        file by itself.
+    """
+    def __init__(self, filename, headers=None, content_type=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        self.filename = filename
+        self.headers = list(headers or ())
+        if content_type is None:
+            content_type = mimetypes.guess_type(filename)[0] \
+                or 'application/octet-stream'
+        self.content_type = content_type
+        self.chunk_size = chunk_size
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        if method not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed',
+                [('Allow', 'GET, HEAD'), ('Content-Length', '0')])
+            return []
+
+        try:
+            file_ = open(self.filename, 'rb')
+        except (IOError, OSError):
+            start_response('404 Not Found', [('Content-Length', '0')])
+            return []
+
+        stat = os.fstat(file_.fileno())
+        size = stat.st_size
+        mtime = int(stat.st_mtime)
+        etag = '"%x-%x-%x"' % (stat.st_ino, mtime, size)
+        headers = self.headers + [
+            ('Accept-Ranges', 'bytes'),
+            ('ETag', etag),
+            ('Last-Modified', format_date_time(mtime)),
+        ]
+
+        if self._is_not_modified(environ, etag, mtime):
+            file_.close()
+            start_response('304 Not Modified', headers)
+            return []
+
+        ranges = None
+        if environ.get('HTTP_RANGE') and \
+                self._if_range_matches(environ, etag, mtime):
+            ranges = parse_range_header(environ['HTTP_RANGE'], size)
+
+        if ranges == []:
+            file_.close()
+            headers += [
+                ('Content-Range', 'bytes */%d' % size),
+                ('Content-Length', '0'),
+            ]
+            start_response('416 Requested Range Not Satisfiable', headers)
+            return []
+
+        if not ranges:
+            status = '200 OK'
+            headers += [
+                ('Content-Type', self.content_type),
+                ('Content-Length', str(size)),
+            ]
+            body = lambda: self._send_region(environ, file_, 0, size, size)
+        elif len(ranges) == 1:
+            status = '206 Partial Content'
+            start, stop = ranges[0]
+            headers += [
+                ('Content-Type', self.content_type),
+                ('Content-Length', str(stop - start)),
+                ('Content-Range', 'bytes %d-%d/%d' % (start, stop - 1, size)),
+            ]
+            body = lambda: self._send_region(environ, file_, start, stop, size)
+        else:
+            status = '206 Partial Content'
+            boundary = os.urandom(12).encode('hex')
+            parts = [(self._part_header(boundary, start, stop, size), start, stop)
+                     for start, stop in ranges]
+            trailer = '\r\n--%s--\r\n' % boundary
+            length = sum(len(head) + stop - start for head, start, stop in parts)
+            headers += [
+                ('Content-Type', 'multipart/byteranges; boundary=%s' % boundary),
+                ('Content-Length', str(length + len(trailer))),
+            ]
+            body = lambda: self._send_multipart(file_, parts, trailer)
+
+        start_response(status, headers)
+        if method == 'HEAD':
+            file_.close()
+            return []
+        return body()
+
+    def _is_not_modified(self, environ, etag, mtime):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            tags = _etag_list(if_none_match)
+            return ('*' in tags) or (etag in tags)
+        since = _parse_http_date(environ.get('HTTP_IF_MODIFIED_SINCE'))
+        return (since is not None) and (mtime <= since)
+
+    def _if_range_matches(self, environ, etag, mtime):
+        if_range = environ.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            # weak validators must not be used for ranges
+            return if_range == etag
+        since = _parse_http_date(if_range)
+        return (since is not None) and (mtime <= since)
+
+    def _part_header(self, boundary, start, stop, size):
+        return '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' \
+            % (boundary, self.content_type, start, stop - 1, size)
+
+    def _send_region(self, environ, file_, start, stop, size):
+        file_.seek(start)
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        # The server (and every middleware) might iterate a file_wrapper until
+        # EOF so it is only safe to use for regions extending to the end of the
+        # file. Fortunately that is what players send when seeking.
+        if file_wrapper is not None and stop == size:
+            return file_wrapper(file_, self.chunk_size)
+        return FileRegionIterator(file_, stop - start, self.chunk_size)
+
+    def _send_multipart(self, file_, parts, trailer):
+        try:
+            for head, start, stop in parts:
+                yield head
+                file_.seek(start)
+                for chunk in FileRegionIterator(file_, stop - start,
+                                                self.chunk_size, close=False):
+                    yield chunk
+            yield trailer
+        finally:
+            file_.close()
+
+
+class FileRegionIterator(object):
+    """Iterate over ``length`` bytes of an open file, from its current
+    position, in chunks of ``chunk_size`` bytes."""
+    def __init__(self, file_, length, chunk_size=DEFAULT_CHUNK_SIZE, close=True):
+        self.file = file_
+        self.remaining = length
+        self.chunk_size = chunk_size
+        self._close = close
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.remaining <= 0:
+            raise StopIteration
+        chunk = self.file.read(min(self.chunk_size, self.remaining))
+        if not chunk:
+            raise StopIteration
+        self.remaining -= len(chunk)
+        return chunk
+
+    def close(self):
+        if self._close:
+            self.file.close()
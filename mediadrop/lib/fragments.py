@@ -0,0 +1,135 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Cache rendered markup fragments of media (players, list items).
+
+Fragments are stored in the Beaker cache ``fragments`` (see
+:class:`mediadrop.lib.app_globals.Globals`). Their keys contain the media ID
+and modification date, a version token of the media, a version token of
+the settings and players, the current locale and the application URL.
+
+The version tokens are stored in the Beaker cache, too. They are replaced
+whenever a media, one of its files, a setting or a player is changed, so
+all fragments which were rendered before become unreachable. With a shared
+Beaker backend (e.g. memcached) this invalidates the fragments of all
+processes.
+
+Fragments expire after ``fragment_cache.expire`` seconds (1 hour by
+default), set it to 0 to disable the fragment cache.
+"""
+
+from hashlib import sha1
+import os
+
+from genshi.core import Markup
+from pylons import config, request, translator
+
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+__all__ = [
+    'cached_fragment',
+    'invalidate_fragments',
+]
+
+ALL_MEDIA = 'all'
+
+def _new_version():
+    return os.urandom(8).encode('hex')
+
+def _app_globals():
+    # The app config is only registered in requests and in background
+    # workers which push it (see mediadrop.lib.util.push_app_config), other
+    # threads see the empty default config of the process.
+    try:
+        return config['pylons.app_globals']
+    except (AttributeError, KeyError, TypeError):
+        return None
+
+def _version(versions, key):
+    return versions.get(key, createfunc=_new_version)
+
+def invalidate_fragments(media_id=None):
+    """Invalidate the cached fragments of the given media.
+
+    :param media_id: A media ID or ``None`` to invalidate the fragments of
+        all media (e.g. if the settings were changed).
+    """
+    g = _app_globals()
+    if g is None or getattr(g, 'fragment_versions', None) is None:
+        return
+    key = ALL_MEDIA if media_id is None else 'media-%d' % media_id
+    g.fragment_versions.put(key, _new_version())
+
+def cached_fragment(name, media, render_func, *args, **kwargs):
+    """Return the fragment rendered by ``render_func`` from the cache.
+
+    :param name: The fragment's name, e.g. ``'player'``.
+    :type media: :class:`~mediadrop.model.media.Media`
+    :param media: The media which is rendered.
+    :param render_func: A function without arguments which renders the
+        fragment as :class:`genshi.Markup` if it is not cached yet.
+    :param \*args: Additional values the fragment depends on (e.g. the
+        parameters for ``render_func``), they must have a stable ``repr()``.
+    :param state: Optional value which changes often (e.g. view counts). It
+        is not part of the key: the cached fragment is rendered again if the
+        state changed, so the cache keeps only one copy of the fragment.
+    :rtype: :class:`genshi.Markup`
+    """
+    state = kwargs.pop('state', None)
+    g = config['pylons.app_globals']
+    if not g.fragment_cache_expire or media.id is None:
+        return Markup(render_func())
+    versions = g.fragment_versions
+    key_data = (
+        name, media.id, media.modified_on,
+        _version(versions, 'media-%d' % media.id),
+        _version(versions, ALL_MEDIA),
+        str(translator.locale), request.application_url,
+    ) + args
+    # hashed so the key is short enough for all Beaker backends
+    key = sha1(repr(key_data)).hexdigest()
+    try:
+        cached_state, markup = g.fragment_cache.get(key)
+        if cached_state == state:
+            return markup
+    except KeyError:
+        pass
+    markup = Markup(render_func())
+    g.fragment_cache.put(key, (state, markup))
+    return markup
+
+@observes(
+    events.Media.after_update,
+    events.Media.after_delete,
+)
+def _media_changed(instance):
+    invalidate_fragments(instance.id)
+
+@observes(
+    events.MediaFile.after_insert,
+    events.MediaFile.after_update,
+    events.MediaFile.after_delete,
+)
+def _media_file_changed(instance):
+    if instance.media_id is not None:
+        invalidate_fragments(instance.media_id)
+
+@observes(
+    events.Setting.after_insert,
+    events.Setting.after_update,
+    events.Setting.after_delete,
+    events.MultiSetting.after_insert,
+    events.MultiSetting.after_update,
+    events.MultiSetting.after_delete,
+    events.PlayerPrefs.after_insert,
+    events.PlayerPrefs.after_update,
+    events.PlayerPrefs.after_delete,
+)
+def _settings_changed(instance):
+    invalidate_fragments()
@@ -28,15 +28,18 @@ from webhelpers.html.converters import format_paragraphs
 
 from mediadrop.lib.auth import viewable_media
 from mediadrop.lib.compat import any, md5
+from mediadrop.lib.fragments import cached_fragment
 from mediadrop.lib.i18n import (N_, _, format_date, format_datetime, 
     format_decimal, format_time)
 from mediadrop.lib.players import (embed_player, embed_iframe, media_player,
     pick_any_media_file, pick_podcast_media_file)
+from mediadrop.lib.templating import render_fragment
 from mediadrop.lib.thumbnails import thumb, thumb_url
 from mediadrop.lib.uri import (best_link_uri, download_uri, file_path,
     pick_uri, pick_uris, web_uri)
 from mediadrop.lib.util import (current_url, delete_files, merge_dicts, 
     redirect, url, url_for, url_for_media)
+from mediadrop.lib.vulgarity import vulgarity_filter
 from mediadrop.lib.xhtml import (clean_xhtml, decode_entities, encode_entities,
     excerpt_xhtml, line_break_xhtml, list_acceptable_xhtml, strip_xhtml,
     truncate_xhtml)
@@ -101,6 +104,7 @@ __all__ = [
     'gravatar_from_email',
     'is_admin',
     'js',
+    'media_grid_item',
     'mediadrop_version',
     'pick_any_media_file',
     'pick_podcast_media_file',
@@ -300,6 +304,24 @@ def filter_library_controls(query, show='latest'):
             query = query.in_category(featured_cat)
     return query, show
 
+def media_grid_item(media, thumb_size='s', title_len=60, desc_len=95):
+    """Render a list item of the media_grid() in helpers.html.
+
+    The rendered item is cached, see :mod:`mediadrop.lib.fragments`.
+
+    :rtype: :class:`genshi.Markup`
+    """
+    def render_item():
+        return render_fragment('media/_grid-item.html', {
+            'm': media,
+            'thumb_size': thumb_size,
+            'title_len': title_len,
+            'desc_len': desc_len,
+        })
+    # views and likes are updated without changing the modification date
+    return cached_fragment('grid-item', media, render_item, thumb_size,
+        title_len, desc_len, state=(media.views, media.likes))
+
 def has_permission(permission_name):
     """Return True if the logged in user has the given permission.
 
@@ -428,6 +450,8 @@ def filter_vulgarity(text):
 
     Words are defined in the Comments settings and are
     replaced with \*'s representing the length of the filtered word.
+    The compiled filter is cached until the setting changes (see
+    :func:`mediadrop.lib.vulgarity.vulgarity_filter`).
 
     :param text: The string to be filtered.
     :type text: str
@@ -438,13 +462,7 @@ def filter_vulgarity(text):
     """
     vulgar_words = request.settings.get('vulgarity_filtered_words', None)
     if vulgar_words:
-        words = (word.strip() for word in vulgar_words.split(','))
-        word_pattern = '|'.join(re.escape(word) for word in words if word)
-        word_expr = re.compile(word_pattern, re.IGNORECASE)
-        def word_replacer(matchobj):
-            word = matchobj.group(0)
-            return '*' * len(word)
-        text = word_expr.sub(word_replacer, text)
+        text = vulgarity_filter(vulgar_words)(text)
     return text
 
 def best_translation(a, b):
@@ -0,0 +1,357 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Outbound mail queue.
+
+Notification emails are written to a spool directory (one JSON file per
+message) instead of being sent while the user waits for the response. A
+background thread delivers them, keeping the (authenticated) SMTP
+connection open between messages, and retries failed deliveries with an
+exponential backoff.
+
+Several processes may share a spool directory: a worker claims a message
+by renaming it, so every message is sent only once.
+"""
+
+import logging
+import os
+import smtplib
+import socket
+import threading
+import time
+
+import simplejson as json
+
+__all__ = [
+    'MailQueue',
+    'MailSpool',
+    'SMTPConnection',
+    'get_mail_queue',
+    'mail_spool_dir',
+]
+
+log = logging.getLogger(__name__)
+
+def mail_spool_dir(config):
+    """Return the directory where outgoing messages are stored.
+
+    :param config: The pylons config.
+    """
+    return config.get('mail_spool_dir') or \
+        os.path.join(config['cache_dir'], 'mail')
+
+
+class MailSpool(object):
+    """Messages waiting for delivery, stored as files in ``spool_dir``.
+
+    New messages are written to ``new/``. File names start with the time
+    (in milliseconds) when the message is due so a sorted directory
+    listing is the delivery order. A worker moves a message to
+    ``sending/`` before delivering it. Messages which could not be
+    delivered end up in ``failed/``.
+    """
+    def __init__(self, spool_dir):
+        self.spool_dir = spool_dir
+        self.dirs = {}
+        for state in ('tmp', 'new', 'sending', 'failed'):
+            path = self.dirs[state] = os.path.join(spool_dir, state)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def put(self, from_addr, to_addrs, message):
+        """Add a message to the spool.
+
+        :type to_addrs: list
+        :type message: unicode
+        :param message: The complete message including headers.
+        :returns: The name of the message file.
+        """
+        entry = {
+            'from_addr': from_addr,
+            'to_addrs': list(to_addrs),
+            'message': message,
+            'attempts': 0,
+        }
+        return self._write('new', self._name(time.time()), entry)
+
+    def claim(self, limit):
+        """Move up to ``limit`` due messages to ``sending/``.
+
+        :returns: A list of ``(name, entry)`` tuples.
+        """
+        claimed = []
+        now_ms = int(time.time() * 1000)
+        for name in sorted(os.listdir(self.dirs['new'])):
+            if len(claimed) >= limit or _due(name) > now_ms:
+                break
+            path = os.path.join(self.dirs['sending'], name)
+            try:
+                os.rename(os.path.join(self.dirs['new'], name), path)
+            except OSError:
+                # claimed by another worker
+                continue
+            # rename() keeps the mtime of the spooled file, recover() must
+            # measure the age of the claim though.
+            os.utime(path, None)
+            try:
+                entry = self._read(path)
+            except (IOError, ValueError), e:
+                log.error('Can not read spooled message %r: %s', name, e)
+                os.rename(path, os.path.join(self.dirs['failed'], name))
+                continue
+            claimed.append((name, entry))
+        return claimed
+
+    def done(self, name):
+        """Remove a delivered message."""
+        os.remove(os.path.join(self.dirs['sending'], name))
+
+    def retry(self, name, entry, delay):
+        """Try to deliver a claimed message again in ``delay`` seconds."""
+        self._write('new', self._name(time.time() + delay), entry)
+        os.remove(os.path.join(self.dirs['sending'], name))
+
+    def fail(self, name, entry, error):
+        """Give up delivering a claimed message."""
+        entry['error'] = unicode(error)
+        self._write('failed', name, entry)
+        os.remove(os.path.join(self.dirs['sending'], name))
+
+    def recover(self, max_age):
+        """Release messages claimed more than ``max_age`` seconds ago (by a
+        worker which died while sending them)."""
+        expired = time.time() - max_age
+        for name in os.listdir(self.dirs['sending']):
+            path = os.path.join(self.dirs['sending'], name)
+            try:
+                if os.path.getmtime(path) < expired:
+                    os.rename(path, os.path.join(self.dirs['new'], name))
+            except OSError:
+                pass
+
+    def pending(self):
+        """Return the number of messages waiting for delivery."""
+        return len(os.listdir(self.dirs['new']))
+
+    def _name(self, due):
+        return '%013d.%s' % (due * 1000, os.urandom(6).encode('hex'))
+
+    def _read(self, path):
+        spool_file = open(path, 'rb')
+        try:
+            return json.load(spool_file)
+        finally:
+            spool_file.close()
+
+    def _write(self, state, name, entry):
+        tmp_path = os.path.join(self.dirs['tmp'], name)
+        spool_file = open(tmp_path, 'wb')
+        try:
+            json.dump(entry, spool_file)
+        finally:
+            spool_file.close()
+        # rename() is atomic so workers never see partially written files
+        os.rename(tmp_path, os.path.join(self.dirs[state], name))
+        return name
+
+def _due(name):
+    try:
+        return int(name.split('.', 1)[0])
+    except ValueError:
+        return 0
+
+
+class SMTPConnection(object):
+    """An SMTP connection which is opened on demand and then reused.
+
+    :param server: The SMTP server, optionally with a port (``host:port``).
+    """
+    def __init__(self, server, username=None, password=None, timeout=30):
+        self.server = server
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.smtp = None
+
+    def send(self, from_addr, to_addrs, message):
+        """Send a message, reconnecting once if the server closed the
+        connection in the meantime.
+
+        :returns: A dict of refused recipients (see
+            :meth:`smtplib.SMTP.sendmail`).
+        """
+        reused = self.smtp is not None
+        try:
+            return self._connect().sendmail(from_addr, to_addrs, message)
+        except smtplib.SMTPServerDisconnected:
+            self.smtp = None
+            if not reused:
+                raise
+        return self._connect().sendmail(from_addr, to_addrs, message)
+
+    def close(self):
+        smtp, self.smtp = self.smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, socket.error):
+            smtp.close()
+
+    def _connect(self):
+        if self.smtp is None:
+            smtp = smtplib.SMTP(self.server, timeout=self.timeout)
+            try:
+                if self.username and self.password:
+                    smtp.login(self.username, self.password)
+            except:
+                smtp.close()
+                raise
+            self.smtp = smtp
+        return self.smtp
+
+
+def _is_permanent(error):
+    """Return True if retrying won't help (5xx response codes)."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, msg in error.recipients.values())
+    code = getattr(error, 'smtp_code', None)
+    return code is not None and code >= 500
+
+
+class MailQueue(object):
+    """Deliver the messages of a :class:`MailSpool` in a background thread.
+
+    Due messages are sent in batches of ``batch_size`` over a single SMTP
+    connection which is closed after ``idle_timeout`` seconds without
+    mail. Failed deliveries are retried after ``retry_delay`` seconds,
+    doubling the delay for every attempt, until ``max_attempts`` is
+    reached.
+
+    :param start_worker: Start the worker thread when the first message is
+        added. If False messages are only sent by :meth:`process`.
+    """
+    def __init__(self, spool, connection, batch_size=50, max_attempts=8,
+                 retry_delay=60, idle_timeout=30, poll_interval=60,
+                 start_worker=True):
+        self.spool = spool
+        self.connection = connection
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.start_worker = start_worker
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def put(self, from_addr, to_addrs, message):
+        """Queue a message for delivery."""
+        self.spool.put(from_addr, to_addrs, message)
+        if self.start_worker:
+            self._ensure_worker()
+        self._wakeup.set()
+
+    def process(self):
+        """Send all due messages.
+
+        :returns: The number of messages delivered.
+        """
+        sent = 0
+        while True:
+            batch = self.spool.claim(self.batch_size)
+            if not batch:
+                return sent
+            for index, (name, entry) in enumerate(batch):
+                delivered = self._deliver(name, entry)
+                if delivered is None:
+                    # Most likely the server is unreachable, try the rest
+                    # of the batch later as well.
+                    for name, entry in batch[index+1:]:
+                        self.spool.retry(name, entry, 0)
+                    return sent
+                if delivered:
+                    sent += 1
+
+    def _deliver(self, name, entry):
+        """Send a claimed message.
+
+        :returns: True if the message was sent, False if it was rejected
+            by the server and None if the delivery failed temporarily.
+        """
+        try:
+            refused = self.connection.send(entry['from_addr'],
+                entry['to_addrs'], entry['message'].encode('utf-8'))
+        except (smtplib.SMTPException, socket.error), e:
+            self.connection.close()
+            entry['attempts'] += 1
+            if _is_permanent(e) or entry['attempts'] >= self.max_attempts:
+                log.error('Giving up sending mail to %r: %s',
+                          entry['to_addrs'], e)
+                self.spool.fail(name, entry, e)
+                if isinstance(e, socket.error):
+                    return None
+                return False
+            delay = self.retry_delay * 2 ** (entry['attempts'] - 1)
+            log.warn('Sending mail to %r failed, retrying in %d s: %s',
+                     entry['to_addrs'], delay, e)
+            self.spool.retry(name, entry, delay)
+            return None
+        if refused:
+            log.warn('Recipients refused: %r', refused)
+        self.spool.done(name)
+        return True
+
+    def _ensure_worker(self):
+        self._lock.acquire()
+        try:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run,
+                    name='mail-queue')
+                self._worker.daemon = True
+                self._worker.start()
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        # messages claimed by a worker which died an hour ago
+        self.spool.recover(max_age=60 * 60)
+        while True:
+            self._wakeup.clear()
+            try:
+                self.process()
+            except Exception, e:
+                log.exception(e)
+            if not self._wakeup.wait(self.idle_timeout):
+                self.connection.close()
+                # also look for messages spooled by other processes and
+                # deliveries which should be retried
+                self._wakeup.wait(self.poll_interval)
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+def get_mail_queue(config):
+    """Return the :class:`MailQueue` of this process for the given config.
+
+    :param config: The pylons config.
+    """
+    spool_dir = mail_spool_dir(config)
+    smtp_params = (config.get('smtp_server', 'localhost'),
+                   config.get('smtp_username'), config.get('smtp_password'))
+    key = (spool_dir, ) + smtp_params
+    _queues_lock.acquire()
+    try:
+        queue = _queues.get(key)
+        if queue is None:
+            queue = _queues[key] = MailQueue(MailSpool(spool_dir),
+                                             SMTPConnection(*smtp_params))
+        return queue
+    finally:
+        _queues_lock.release()
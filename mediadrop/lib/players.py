@@ -18,8 +18,9 @@ from sqlalchemy import sql
 from mediadrop.forms.admin import players as player_forms
 from mediadrop.lib.compat import any
 from mediadrop.lib.filetypes import AUDIO, VIDEO, AUDIO_DESC, CAPTIONS
+from mediadrop.lib.fragments import cached_fragment
 from mediadrop.lib.i18n import N_
-from mediadrop.lib.templating import render
+from mediadrop.lib.templating import render_fragment
 from mediadrop.lib.thumbnails import thumb_url
 from mediadrop.lib.uri import pick_uris
 from mediadrop.lib.util import url_for
@@ -1004,25 +1005,33 @@ def media_player(media, is_widescreen=False, show_like=True, show_dislike=True,
 
     :param \*\*kwargs: Extra kwargs for :meth:`AbstractPlayer.__init__`.
 
-    :rtype: `str` or `None`
-    :returns: A rendered player.
+    :rtype: :class:`genshi.Markup`
+    :returns: A rendered player (which is cached, see
+        :mod:`mediadrop.lib.fragments`, unless it contains expiring URLs).
     """
-    player = preferred_player_for_media(media, **kwargs)
-    return render('players/html5_or_flash.html', {
-        'player': player,
-        'media': media,
-        'uris': media.get_uris(),
-        'is_widescreen': is_widescreen,
-        'js_init': js_init,
-        'show_like': show_like,
-        'show_dislike': show_dislike,
-        'show_download': show_download,
-        'show_embed': show_embed,
-        'show_playerbar': show_playerbar,
-        'show_popout': show_popout,
-        'show_resize': show_resize and (player and player.supports_resizing),
-        'show_share': show_share,
-    })
+    def render_player():
+        player = preferred_player_for_media(media, **kwargs)
+        return render_fragment('players/html5_or_flash.html', {
+            'player': player,
+            'media': media,
+            'uris': media.get_uris(),
+            'is_widescreen': is_widescreen,
+            'js_init': js_init,
+            'show_like': show_like,
+            'show_dislike': show_dislike,
+            'show_download': show_download,
+            'show_embed': show_embed,
+            'show_playerbar': show_playerbar,
+            'show_popout': show_popout,
+            'show_resize': show_resize and (player and player.supports_resizing),
+            'show_share': show_share,
+        })
+    if any(file.storage.signs_urls for file in media.files):
+        # signed URLs expire and depend on the permissions of the user
+        return Markup(render_player())
+    return cached_fragment('player', media, render_player, is_widescreen,
+        show_like, show_dislike, show_download, show_embed, show_playerbar,
+        show_popout, show_resize, show_share, js_init, sorted(kwargs.items()))
 
 def pick_podcast_media_file(media):
     """Return a file playable in the most podcasting client: iTunes.
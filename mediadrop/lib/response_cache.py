@@ -0,0 +1,319 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Cache complete pages for anonymous visitors.
+
+Controller actions opt in by calling :func:`cache_response` with the tags
+of the data the page shows (e.g. ``'media'``, ``'comments-42'``). The
+:class:`ResponseCacheMiddleware` then stores the response (keyed on the
+URL and the site language) and serves it to other anonymous visitors
+without calling the controller again.
+
+Cached responses are stored in Beaker caches so any Beaker backend can
+be used (``memory``, ``file``, ``ext:memcached``, ...). Whenever data is
+changed the version token of the matching tag is replaced (see the event
+observers below) which invalidates all responses with that tag. With a
+shared backend this works across processes.
+
+Requests with an authentication or session cookie, non-GET requests and
+responses which set cookies or use the Facebook integration are never
+cached.
+"""
+
+from hashlib import sha1
+import logging
+import os
+import re
+import threading
+
+from paste.deploy.converters import asbool
+from paste.response import header_value
+from pylons import config, request
+from sqlalchemy.exc import OperationalError
+
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+__all__ = [
+    'ResponseCache',
+    'ResponseCacheMiddleware',
+    'cache_response',
+    'setup_response_cache',
+]
+
+log = logging.getLogger(__name__)
+
+ALL_PAGES = 'all'
+CACHE_OPTIONS_KEY = 'mediadrop.response_cache'
+CONFIG_PREFIX = 'response_cache.'
+
+def _new_version():
+    return os.urandom(8).encode('hex')
+
+
+class ResponseCache(object):
+    """Store responses and tag versions in Beaker caches.
+
+    :param cache_manager: A :class:`beaker.cache.CacheManager`.
+    :param expire: Number of seconds a response is cached.
+    :param \*\*cache_kwargs: Beaker options (e.g. ``type``, ``url``).
+    """
+    def __init__(self, cache_manager, expire=300, **cache_kwargs):
+        self.responses = cache_manager.get_cache('responses', expire=expire,
+                                                 **cache_kwargs)
+        self.tag_versions = cache_manager.get_cache('response_tags',
+                                                    **cache_kwargs)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _tag_version(self, tag):
+        return self.tag_versions.get(tag, createfunc=_new_version)
+
+    def mark(self, environ, tags, count_view=None):
+        """Allow the middleware to cache the response of this request.
+
+        The current versions of the tags are recorded immediately so data
+        changes while the page is rendered invalidate the cached response.
+        """
+        tags = set(tags)
+        tags.add(ALL_PAGES)
+        environ[CACHE_OPTIONS_KEY] = {
+            'tags': dict((tag, self._tag_version(tag)) for tag in tags),
+            'count_view': count_view,
+        }
+
+    def purge(self, *tags):
+        """Invalidate all cached responses with any of the given tags."""
+        for tag in tags:
+            self.tag_versions.put(tag, _new_version())
+
+    def get(self, key):
+        """Return the cached entry for the given key (or ``None``)."""
+        try:
+            entry = self.responses.get(key)
+        except KeyError:
+            entry = None
+        if entry is not None:
+            for tag, version in entry['tags'].iteritems():
+                if self._tag_version(tag) != version:
+                    entry = None
+                    break
+        self._lock.acquire()
+        try:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        finally:
+            self._lock.release()
+        return entry
+
+    def store(self, key, status, headers, body, options):
+        self.responses.put(key, dict(
+            status=status,
+            headers=headers,
+            body=body,
+            tags=options['tags'],
+            count_view=options['count_view'],
+        ))
+
+    @property
+    def hit_ratio(self):
+        requests = self.hits + self.misses
+        return requests and float(self.hits) / requests or 0.0
+
+
+class ResponseCacheMiddleware(object):
+    """Serve cached responses to anonymous GET requests.
+
+    :param app: The WSGI application.
+    :type cache: :class:`ResponseCache`
+    :param language: A function which returns the current site language.
+    :param bypass_cookies: Requests with any of these cookies are not
+        cached (e.g. the authentication and the session cookie).
+    """
+    def __init__(self, app, cache, language, bypass_cookies=()):
+        self.app = app
+        self.cache = cache
+        self.language = language
+        self.bypass_cookies = re.compile(r'(?:^|[;,])\s*(?:%s)=' %
+            '|'.join(re.escape(name) for name in bypass_cookies))
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'GET' \
+                or self.bypass_cookies.search(environ.get('HTTP_COOKIE', '')):
+            return self.app(environ, start_response)
+
+        key = self.cache_key(environ)
+        entry = self.cache.get(key)
+        if entry is not None:
+            if entry['count_view']:
+                count_media_view(entry['count_view'])
+            start_response(entry['status'], list(entry['headers']))
+            return [entry['body']]
+
+        response = []
+        def caching_start_response(status, headers, exc_info=None):
+            response[:] = [status, headers]
+            return start_response(status, headers, exc_info)
+        app_iter = self.app(environ, caching_start_response)
+
+        options = environ.get(CACHE_OPTIONS_KEY)
+        if options is None or not response \
+                or not self.is_cacheable(environ, *response):
+            return app_iter
+        try:
+            body = ''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        status, headers = response
+        self.cache.store(key, status, headers, body, options)
+        return [body]
+
+    def cache_key(self, environ):
+        key_data = (
+            environ['wsgi.url_scheme'],
+            environ.get('HTTP_HOST') or environ.get('SERVER_NAME'),
+            environ.get('SCRIPT_NAME', ''),
+            environ.get('PATH_INFO', ''),
+            environ.get('QUERY_STRING', ''),
+            environ.get('HTTP_X_REQUESTED_WITH'),
+            self.language(),
+        )
+        return sha1(repr(key_data)).hexdigest()
+
+    def is_cacheable(self, environ, status, headers):
+        if not status.startswith('200 '):
+            return False
+        if header_value(headers, 'set-cookie'):
+            return False
+        if 'private' in (header_value(headers, 'cache-control') or ''):
+            return False
+        if environ.get('repoze.who.identity'):
+            return False
+        pylons_obj = environ.get('pylons.pylons')
+        response = getattr(pylons_obj, 'response', None)
+        if getattr(response, 'facebook', None) is not None:
+            return False
+        return True
+
+
+def count_media_view(media_id):
+    """Increment the views of a media whose page was served from the cache
+    (see :meth:`~mediadrop.model.media.Media.increment_views`)."""
+    from mediadrop.model import DBSession
+    from mediadrop.model.media import media as media_table
+    try:
+        DBSession.execute(media_table.update()\
+            .values(views=media_table.c.views + 1)\
+            .where(media_table.c.id == media_id))
+        DBSession.commit()
+    except OperationalError:
+        DBSession.rollback()
+
+def setup_response_cache(app, config):
+    """Add the :class:`ResponseCacheMiddleware` if it is enabled."""
+    app_globals = config['pylons.app_globals']
+    if not asbool(config.get(CONFIG_PREFIX + 'enabled', False)):
+        return app
+    cache_kwargs = dict(type='memory')
+    for key, value in config.items():
+        if key.startswith(CONFIG_PREFIX):
+            cache_kwargs[key[len(CONFIG_PREFIX):]] = value
+    del cache_kwargs['enabled']
+    expire = int(cache_kwargs.pop('expire', 300))
+    cache = ResponseCache(app_globals.cache, expire=expire, **cache_kwargs)
+    app_globals.response_cache = cache
+
+    def language():
+        return app_globals.settings.get('primary_language')
+    bypass_cookies = ('authtkt', config.get('beaker.session.key', 'beaker.session.id'))
+    return ResponseCacheMiddleware(app, cache, language, bypass_cookies)
+
+def cache_response(*tags, **kwargs):
+    """Allow caching the current response for anonymous visitors.
+
+    Call this before loading the data which is displayed.
+
+    :param \*tags: Tags of the displayed data, cached responses are
+        invalidated when data with one of the tags is changed.
+    :param query_params: Names of the query parameters the page depends
+        on. Requests with other parameters are not cached so random
+        parameters can not fill up the cache.
+    :param count_view: Optional media ID, its views are incremented
+        whenever the response is served from the cache.
+    """
+    cache = getattr(config['pylons.app_globals'], 'response_cache', None)
+    query_params = kwargs.pop('query_params', ())
+    if cache is None or set(request.GET).difference(query_params):
+        return
+    cache.mark(request.environ, tags, **kwargs)
+
+def _purge(*tags):
+    # Background workers must push the app config for this to work (see
+    # mediadrop.lib.util.push_app_config).
+    try:
+        cache = config['pylons.app_globals'].response_cache
+    except (AttributeError, KeyError, TypeError):
+        return
+    if cache is not None:
+        cache.purge(*tags)
+
+@observes(
+    events.Media.after_insert,
+    events.Media.after_update,
+    events.Media.after_delete,
+    events.MediaFile.after_insert,
+    events.MediaFile.after_update,
+    events.MediaFile.after_delete,
+    events.Tag.after_update,
+    events.Tag.after_delete,
+)
+def _media_changed(instance):
+    _purge('media')
+
+@observes(
+    events.Category.after_insert,
+    events.Category.after_update,
+    events.Category.after_delete,
+)
+def _category_changed(instance):
+    _purge('categories')
+
+@observes(
+    events.Podcast.after_insert,
+    events.Podcast.after_update,
+    events.Podcast.after_delete,
+)
+def _podcast_changed(instance):
+    _purge('podcasts')
+
+@observes(
+    events.Comment.after_insert,
+    events.Comment.after_update,
+    events.Comment.after_delete,
+)
+def _comment_changed(instance):
+    if instance.media_id is not None:
+        _purge('comments-%d' % instance.media_id)
+
+@observes(
+    events.Setting.after_insert,
+    events.Setting.after_update,
+    events.Setting.after_delete,
+    events.MultiSetting.after_insert,
+    events.MultiSetting.after_update,
+    events.MultiSetting.after_delete,
+    events.PlayerPrefs.after_insert,
+    events.PlayerPrefs.after_update,
+    events.PlayerPrefs.after_delete,
+)
+def _settings_changed(instance):
+    _purge(ALL_PAGES)
@@ -0,0 +1,326 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Pre-generated sitemap and mRSS files.
+
+Rendering the Google sitemap and the mRSS feed of all media takes a long
+time on big sites. :class:`SitemapFiles` writes them to disk instead so the
+:class:`~mediadrop.controllers.sitemaps.SitemapsController` only has to
+serve a static file.
+
+The media are split in shards by ID: shard ``n`` contains the media with
+IDs from ``n * shard_size`` to ``(n + 1) * shard_size - 1``. Every shard is
+written as a sitemap (``sitemap<n>.xml``) and as a small mRSS feed
+(``mrss<n>.xml``). The sitemap index (``sitemap.xml``) lists all shards and
+the complete feed (``mrss.xml``) is assembled from the items of the shard
+feeds, so neither has to load any media.
+
+The fingerprints of all shards (number of published media, the sum of their
+IDs and the latest modification dates of the media and their files) are
+fetched with two aggregate queries. Only shards whose fingerprint changed
+are rendered again. Views (and names of tags and categories) are not part
+of the fingerprint, they are updated whenever the shard is rendered again.
+
+:func:`update_sitemap_files` checks the fingerprints at most every
+``sitemaps.sweep_interval`` seconds (5 minutes by default) and right after
+a media, a media file or a setting was changed.
+
+The files are rendered while a visitor's request is processed. Their links
+point to ``sitemaps.base_url`` (if configured) instead of the host of that
+request, and files are linked with permanent URLs instead of expiring
+signed URLs (see :class:`~mediadrop.lib.storage.localfiles.LocalFileStorage`).
+"""
+
+from hashlib import sha1
+import logging
+import os
+import tempfile
+from urlparse import urlsplit
+
+from genshi.core import Stream
+from genshi.input import XMLParser
+import pylons
+from pylons import config, request
+from routes.util import URLGenerator
+import simplejson
+from sqlalchemy import func
+
+from mediadrop import __version__
+from mediadrop.lib.storage.localfiles import SIGN_URLS_KEY
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+__all__ = [
+    'SitemapFiles',
+    'sitemap_files',
+    'update_sitemap_files',
+]
+
+log = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+SWEEP_KEY = 'swept'
+
+class SitemapFiles(object):
+    """Render the sitemap and mRSS files of all published media.
+
+    :param directory: The directory where the files are stored.
+    :param shard_size: The size of the media ID range of each shard (and so
+        the maximum number of media per sitemap).
+    :param base_url: The public URL of the site, e.g.
+        ``http://www.site.example``. The URL of the current request is used
+        if it is not given.
+    """
+    def __init__(self, directory, shard_size=10000, base_url=None):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.base_url = base_url and base_url.rstrip('/')
+
+    def path(self, filename):
+        """Return the absolute path of the given file."""
+        return os.path.join(self.directory, filename)
+
+    def update(self):
+        """Render all shards which changed since the last update.
+
+        The sitemap index and the complete feed are written again if any
+        shard was rendered or removed.
+
+        :returns: The number of rendered shards.
+        """
+        url_generator = self._url_generator()
+        pylons.url._push_object(url_generator)
+        # the files are served for hours, signed URLs would expire
+        request.environ[SIGN_URLS_KEY] = False
+        try:
+            return self._update()
+        finally:
+            del request.environ[SIGN_URLS_KEY]
+            pylons.url._pop_object(url_generator)
+
+    def _update(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        manifest = self._read_manifest()
+        context = self._context_digest()
+        if manifest.get('context') != context:
+            # e.g. the settings, the site URL or the templates changed
+            manifest = dict(context=context, shards={})
+        old_shards = manifest['shards']
+
+        shards = {}
+        rendered = 0
+        fingerprints = self.fingerprints()
+        for number, (fingerprint, last_modified) in fingerprints.iteritems():
+            key = str(number)
+            digest = sha1(repr(fingerprint)).hexdigest()
+            if old_shards.get(key, [None])[0] != digest \
+                    or not os.path.exists(self.path('sitemap%d.xml' % number)):
+                self._render_shard(number)
+                rendered += 1
+            lastmod = last_modified and last_modified.strftime('%Y-%m-%d')
+            shards[key] = [digest, lastmod]
+
+        removed = set(old_shards).difference(shards)
+        for key in removed:
+            for filename in ('sitemap%s.xml' % key, 'mrss%s.xml' % key):
+                if os.path.exists(self.path(filename)):
+                    os.remove(self.path(filename))
+        if rendered or removed or not os.path.exists(self.path('mrss.xml')):
+            numbers = sorted(int(key) for key in shards)
+            self._render_index(numbers, shards)
+            self._render_feed(numbers)
+
+        manifest['shards'] = shards
+        self._write(MANIFEST, simplejson.dumps(manifest))
+        if rendered or removed:
+            log.info('Rendered %d sitemap shards, removed %d',
+                     rendered, len(removed))
+        return rendered
+
+    def fingerprints(self):
+        """Return the fingerprint and the latest modification date of each
+        shard.
+
+        Shard 0 is always present as its sitemap contains the links to
+        the index pages, too.
+
+        :returns: A dict ``{shard number: (fingerprint, last_modified)}``.
+        """
+        from mediadrop.model import DBSession, Media, MediaFile
+        size = self.shard_size
+        query = Media.query.published().order_by(None)
+        media_shard = Media.id - Media.id % size
+        rows = query.with_entities(
+            media_shard,
+            func.count(Media.id),
+            func.sum(Media.id),
+            func.max(Media.modified_on),
+            func.max(Media.publish_on),
+        ).group_by(media_shard)
+        file_shard = MediaFile.media_id - MediaFile.media_id % size
+        files_modified = dict(DBSession\
+            .query(file_shard, func.max(MediaFile.modified_on))\
+            .filter(MediaFile.media_id.in_(
+                query.with_entities(Media.id).subquery()))\
+            .group_by(file_shard))
+
+        shards = {0: ((), None)}
+        for start, count, id_sum, modified, published in rows:
+            dates = (modified, published, files_modified.get(start))
+            fingerprint = (count, int(id_sum)) + dates
+            shards[int(start) // size] = (fingerprint, max(filter(None, dates)))
+        return shards
+
+    def _url_generator(self):
+        """Return a Routes URL generator for the base URL."""
+        environ = dict(request.environ)
+        if self.base_url:
+            scheme, netloc, path = urlsplit(self.base_url)[:3]
+            environ['wsgi.url_scheme'] = scheme
+            environ['HTTP_HOST'] = netloc
+            environ['SCRIPT_NAME'] = path
+            environ.pop('HTTPS', None)
+        environ.pop('routes.cached_hostinfo', None)
+        return URLGenerator(config['routes.map'], environ)
+
+    def _context_digest(self):
+        # Without a base URL the files contain the host of the request
+        # which rendered them first, other hosts must not render them again.
+        context = (
+            sorted(request.settings.items()),
+            self.base_url,
+            self.shard_size,
+            __version__,
+        )
+        return sha1(repr(context)).hexdigest()
+
+    def _read_manifest(self):
+        try:
+            with open(self.path(MANIFEST), 'rb') as manifest_file:
+                return simplejson.load(manifest_file)
+        except (IOError, ValueError):
+            return {}
+
+    def _shard_media(self, number):
+        from mediadrop.lib.auth import MediaDropPermissionSystem
+        from mediadrop.model import Media
+        start = number * self.shard_size
+        query = Media.query.published()\
+            .filter(Media.id >= start)\
+            .filter(Media.id < start + self.shard_size)\
+            .order_by(Media.id)
+        # the files are served to everybody
+        perm = MediaDropPermissionSystem.permissions_for_user(None, config)
+        return perm.permission_system\
+            .filter_restricted_items(query, u'view', perm)
+
+    def _render_shard(self, number):
+        from mediadrop.lib.helpers import url_for
+        if number == 0:
+            links = [
+                url_for(controller='/', qualified=True),
+                url_for(controller='/media', show='popular', qualified=True),
+                url_for(controller='/media', show='latest', qualified=True),
+                url_for(controller='/categories', qualified=True),
+            ]
+        else:
+            links = []
+        self._render('sitemap%d.xml' % number, 'sitemaps/google.xml', dict(
+            media = self._shard_media(number),
+            page = number,
+            links = links,
+        ))
+        self._render('mrss%d.xml' % number, 'sitemaps/mrss.xml', dict(
+            media = self._shard_media(number),
+            title = 'MediaRSS Sitemap',
+        ))
+
+    def _render_index(self, numbers, shards):
+        self._render('sitemap.xml', 'sitemaps/google.xml', dict(
+            pages = [(number, shards[str(number)][1]) for number in numbers],
+        ))
+
+    def _render_feed(self, numbers):
+        from mediadrop.lib.helpers import url_for
+        def shard_items():
+            for number in numbers:
+                with open(self.path('mrss%d.xml' % number), 'rb') as shard_file:
+                    parser = XMLParser(shard_file, filename=shard_file.name)
+                    for event in Stream(parser).select('//item'):
+                        yield event
+        self._render('mrss.xml', 'sitemaps/mrss.xml', dict(
+            media = (),
+            items = Stream(shard_items()),
+            title = 'MediaRSS Sitemap',
+            self_url = url_for(controller='/sitemaps', action='mrss',
+                               qualified=True),
+        ))
+
+    def _render(self, filename, template, tmpl_vars):
+        from mediadrop.lib.templating import render
+        stream = render(template, tmpl_vars)
+        self._write(filename, lambda f: stream.render(method='xml',
+                                                      encoding='utf-8', out=f))
+
+    def _write(self, filename, content):
+        """Replace the given file atomically so it is never served while it
+        is written."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                if callable(content):
+                    content(tmp_file)
+                else:
+                    tmp_file.write(content)
+            # mkstemp creates files which only the owner may read
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, self.path(filename))
+        except:
+            os.remove(tmp_path)
+            raise
+
+
+def sitemap_files():
+    """Return the :class:`SitemapFiles` configured in the ini file."""
+    directory = config.get('sitemaps.directory') or \
+        os.path.join(config['cache_dir'], 'sitemaps')
+    shard_size = int(config.get('sitemaps.shard_size', 10000))
+    return SitemapFiles(directory, shard_size=shard_size,
+                        base_url=config.get('sitemaps.base_url'))
+
+def update_sitemap_files():
+    """Update the sitemap files if the last update is older than the sweep
+    interval (or media were changed since then).
+
+    Only one thread updates the files, others wait until it is done.
+
+    :rtype: :class:`SitemapFiles`
+    """
+    files = sitemap_files()
+    sweeps = config['pylons.app_globals'].sitemap_sweeps
+    sweeps.get(SWEEP_KEY, createfunc=files.update)
+    return files
+
+@observes(
+    events.Media.after_insert,
+    events.Media.after_update,
+    events.Media.after_delete,
+    events.MediaFile.after_insert,
+    events.MediaFile.after_update,
+    events.MediaFile.after_delete,
+    events.Setting.after_insert,
+    events.Setting.after_update,
+    events.Setting.after_delete,
+)
+def _media_changed(instance):
+    try:
+        sweeps = config['pylons.app_globals'].sitemap_sweeps
+    except (AttributeError, KeyError, TypeError):
+        return
+    sweeps.remove_value(SWEEP_KEY)
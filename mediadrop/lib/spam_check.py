@@ -0,0 +1,272 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Check new comments for spam in the background.
+
+Asking Akismet whether a comment is spam takes one or two HTTP requests.
+Instead of doing that while the user waits, new comments are saved as
+unreviewed (the state of comments awaiting moderation) and checked by the
+worker threads of a :class:`SpamCheckQueue` after the request was
+committed. Spam is moved to the trash. All other comments are published
+unless comments require approval by a moderator.
+
+Plugins can provide additional checks by observing
+:attr:`mediadrop.plugin.events.comment_is_spam`.
+
+Jobs are kept in memory only: if the process is restarted before a job
+was processed the comment waits for a moderator. Every job keeps the app
+config of the request which submitted the comment, the workers register it
+while they process the job (e.g. to send the notification).
+"""
+
+import logging
+import threading
+from Queue import Queue
+
+from akismet import Akismet
+from pylons import config, request
+
+from mediadrop import USER_AGENT
+from mediadrop.lib.util import pop_app_config, push_app_config
+from mediadrop.plugin import events
+
+__all__ = [
+    'AkismetChecker',
+    'SpamCheckQueue',
+    'check_for_spam_later',
+    'spam_check_enabled',
+    'spam_check_queue',
+]
+
+log = logging.getLogger(__name__)
+
+
+class AkismetChecker(object):
+    """Ask Akismet if a comment is spam.
+
+    Whether the API key is valid is only checked once for every key and
+    blog URL (instead of for every comment).
+    """
+    akismet_class = Akismet
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._valid_keys = {}
+
+    def __call__(self, comment, job):
+        """Return True if the comment is spam, None if Akismet is not
+        configured or the key is invalid."""
+        if not job.akismet_key:
+            return None
+        akismet = self.akismet_class(job.akismet_key, job.akismet_url,
+                                     agent=USER_AGENT)
+        if not self._verify_key(akismet):
+            return None
+        data = dict(job.request_data)
+        data['comment_author'] = comment.author.name.encode('utf-8')
+        return akismet.comment_check(comment.body.encode('utf-8'), data)
+
+    def _verify_key(self, akismet):
+        cache_key = (akismet.key, akismet.blog_url)
+        self._lock.acquire()
+        try:
+            valid = self._valid_keys.get(cache_key)
+        finally:
+            self._lock.release()
+        if valid is None:
+            # network errors propagate so the key is checked again next time
+            valid = akismet.verify_key()
+            if not valid:
+                log.error('Invalid Akismet key %r for %r', *cache_key)
+            self._lock.acquire()
+            try:
+                self._valid_keys[cache_key] = valid
+            finally:
+                self._lock.release()
+        return valid
+
+
+class SpamCheckJob(object):
+    """Everything the workers need to know about a new comment.
+
+    :param request_data: The details of the request which submitted the
+        comment, as expected by Akismet (``user_ip``, ``user_agent``, ...).
+    :param notification: Keyword arguments for
+        :func:`mediadrop.lib.email.send` (or None) which are used to notify
+        the admins if the comment is not spam.
+    :param app_config: The app config for the workers, the config of the
+        current request by default.
+    """
+    def __init__(self, comment_id, request_data, akismet_key=None,
+                 akismet_url=None, require_review=False, notification=None,
+                 app_config=None):
+        self.comment_id = comment_id
+        self.request_data = request_data
+        self.akismet_key = akismet_key
+        self.akismet_url = akismet_url
+        self.require_review = require_review
+        self.notification = notification
+        if app_config is None:
+            app_config = config._current_obj()
+        self.app_config = app_config
+        self.attempts = 0
+
+
+class SpamCheckQueue(object):
+    """Check new comments for spam with a pool of ``workers`` threads.
+
+    Failed checks are retried ``max_retries`` times, waiting
+    ``retry_delay`` seconds (doubled for every attempt) in between. After
+    that the comment is left for a moderator.
+
+    :param start_worker: Start the worker threads when the first job is
+        added. If False jobs are only processed by :meth:`process_pending`.
+    """
+    def __init__(self, workers=2, max_retries=3, retry_delay=5,
+                 start_worker=True):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.start_worker = start_worker
+        self.akismet = AkismetChecker()
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def put(self, job):
+        """Check the comment of the given :class:`SpamCheckJob`."""
+        self._queue.put(job)
+        if self.start_worker:
+            self._ensure_workers()
+
+    def process_pending(self):
+        """Process all queued jobs in the current thread.
+
+        The caller is responsible for committing the database session.
+        """
+        while not self._queue.empty():
+            self._process(self._queue.get())
+            self._queue.task_done()
+
+    def join(self):
+        """Wait until the workers processed all queued jobs."""
+        self._queue.join()
+
+    def is_spam(self, comment, job):
+        """Return True if Akismet or any plugin thinks the comment is spam."""
+        if self.akismet(comment, job):
+            return True
+        for result in events.comment_is_spam(comment, job.request_data):
+            if result:
+                return True
+        return False
+
+    def _ensure_workers(self):
+        self._lock.acquire()
+        try:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run,
+                    name='spam-check-queue-%d' % len(self._threads))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        from mediadrop.model import DBSession
+        while True:
+            job = self._queue.get()
+            push_app_config(job.app_config)
+            try:
+                if self._process(job):
+                    DBSession.commit()
+                else:
+                    DBSession.rollback()
+            except Exception, e:
+                log.exception(e)
+                DBSession.rollback()
+            finally:
+                DBSession.remove()
+                pop_app_config(job.app_config)
+                self._queue.task_done()
+
+    def _process(self, job):
+        """Check a single comment and publish or trash it.
+
+        :returns: True if the comment was updated.
+        """
+        from mediadrop.lib.email import send
+        from mediadrop.model import Comment, DBSession
+        comment = DBSession.query(Comment).get(job.comment_id)
+        if comment is None or comment.reviewed:
+            # deleted or moderated in the meantime
+            return False
+        job.attempts += 1
+        try:
+            spam = self.is_spam(comment, job)
+        except Exception, e:
+            if job.attempts > self.max_retries:
+                log.error('Giving up checking comment %r for spam: %s',
+                          job.comment_id, e)
+                if job.notification:
+                    send(**job.notification)
+                return False
+            delay = self.retry_delay * 2 ** (job.attempts - 1)
+            log.info('Checking comment %r for spam failed (%s), retrying '
+                     'in %d s', job.comment_id, e, delay)
+            timer = threading.Timer(delay, self._queue.put, [job])
+            timer.daemon = True
+            timer.start()
+            return False
+
+        if spam:
+            comment.reviewed = True
+            comment.publishable = False
+        else:
+            if job.notification:
+                send(**job.notification)
+            if job.require_review:
+                return False
+            comment.reviewed = True
+            comment.publishable = True
+        DBSession.flush()
+        return True
+
+spam_check_queue = SpamCheckQueue()
+
+def spam_check_enabled():
+    """Return True if new comments must be checked for spam."""
+    return bool(request.settings['akismet_key']) or \
+        bool(events.comment_is_spam.observers)
+
+def check_for_spam_later(comment, notification=None):
+    """Check the given comment for spam after the current request was
+    committed (see :func:`mediadrop.lib.decorators.autocommit`).
+
+    :type comment: :class:`~mediadrop.model.comments.Comment`
+    :param notification: Keyword arguments for
+        :func:`mediadrop.lib.email.send` to notify the admins about the
+        comment unless it is spam.
+    """
+    from mediadrop.lib.helpers import url_for
+    environ = request.environ
+    request_data = {
+        'user_ip': environ.get('REMOTE_ADDR'),
+        'user_agent': environ.get('HTTP_USER_AGENT', ''),
+        'referrer': environ.get('HTTP_REFERER', 'unknown'),
+        'HTTP_ACCEPT': environ.get('HTTP_ACCEPT'),
+    }
+    job = SpamCheckJob(comment.id, request_data,
+        akismet_key=request.settings['akismet_key'],
+        akismet_url=request.settings['akismet_url'] or \
+            url_for('/', qualified=True),
+        require_review=bool(request.settings['req_comment_approval']),
+        notification=notification)
+    request.commit_callbacks.append(lambda: spam_check_queue.put(job))
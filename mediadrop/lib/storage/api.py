@@ -8,24 +8,31 @@
 import logging
 import os
 import re
+import shutil
+import socket
+import tempfile
 
-from cStringIO import StringIO
 from operator import attrgetter
 from urllib2 import URLError, urlopen
 
+from paste.util.converters import asbool
+from pylons import config
+
 from mediadrop.lib.compat import defaultdict, SEEK_END
 from mediadrop.lib.decorators import memoize
 from mediadrop.lib.filetypes import guess_container_format, guess_media_type
 from mediadrop.lib.i18n import _
 from mediadrop.lib.thumbnails import (create_thumbs_for, has_thumbs,
     has_default_thumbs)
+from mediadrop.lib.uploads import UploadFile
 from mediadrop.lib.xhtml import clean_xhtml
 from mediadrop.plugin.abc import (AbstractClass, abstractmethod,
     abstractproperty)
 
-__all__ = ['add_new_media_file', 'sort_engines', 'CannotTranscode', 
+__all__ = ['add_new_media_file', 'apply_metadata', 'sort_engines', 'CannotTranscode', 
     'FileStorageEngine', 'StorageError', 'StorageEngine', 
-    'UnsuitableEngineError', 'UserStorageError',
+    'UnsuitableEngineError', 'URLDispatcher', 'UserStorageError',
+    'invalidate_engine_cache', 'uploads_need_checksum',
 ]
 
 log = logging.getLogger(__name__)
@@ -71,6 +78,14 @@ class StorageEngine(AbstractClass):
     known keys are used.
     """
 
+    needs_upload_checksum = False
+    """A flag that indicates whether :meth:`store` needs the SHA-256
+    checksum of uploaded files (see :func:`uploads_need_checksum`)."""
+
+    signs_urls = False
+    """A flag that indicates whether :meth:`get_uris` returns expiring URLs
+    which must not be cached (e.g. in rendered players)."""
+
     try_before = []
     """Storage Engines that should :meth:`parse` after this class has.
 
@@ -208,6 +223,21 @@ class StorageEngine(AbstractClass):
 
         """
 
+    def delete_many(self, unique_ids):
+        """Delete several stored files, e.g. when deleting media in bulk.
+
+        Engines which can delete files more efficiently in a batch (e.g.
+        using a single connection to a remote server) should override this.
+
+        :type unique_ids: list
+        :param unique_ids: The identifying strings of the files.
+        :rtype: boolean
+        :returns: True if all files were deleted, False if an error occurred.
+
+        """
+        results = [self.delete(unique_id) for unique_id in unique_ids]
+        return all(results)
+
     def transcode(self, media_file):
         """Transcode an existing MediaFile.
 
@@ -281,12 +311,21 @@ class EmbedStorageEngine(StorageEngine):
     url_pattern = abstractproperty()
     """A compiled pattern object that uses named groupings for matches."""
 
+    fetch_timeout = 10
+    """Seconds to wait for a response of the remote API."""
+
     def parse(self, file=None, url=None):
         """Return metadata for the given URL or raise an error.
 
         If the given URL matches :attr:`url_pattern` then :meth:`_parse`
         is called with the named matches as kwargs and the result returned.
 
+        Unless ``embed_metadata_async`` is disabled in the config, engines
+        which can build the unique ID from the URL alone (see
+        :meth:`_parse_url`) return that right away. The remaining metadata
+        is then fetched in the background (see
+        :mod:`mediadrop.lib.storage.metadata_queue`).
+
         :type file: :class:`cgi.FieldStorage` or None
         :param file: A freshly uploaded file object.
         :type url: unicode or None
@@ -301,6 +340,50 @@ class EmbedStorageEngine(StorageEngine):
         match = self.url_pattern.match(url)
         if match is None:
             raise UnsuitableEngineError
+        return self._parse_match(url, match.groupdict())
+
+    def _parse_match(self, url, kwargs):
+        """Return metadata for a URL which matched :attr:`url_pattern`.
+
+        :param kwargs: The named matches from the url match object.
+
+        """
+        if asbool(config.get('embed_metadata_async', True)):
+            meta = self._parse_url(url, **kwargs)
+            if meta is not None:
+                meta['fetch_metadata'] = True
+                return meta
+        return self._parse(url, **kwargs)
+
+    def _parse_url(self, url, **kwargs):
+        """Return the metadata which can be derived without network access.
+
+        Override this if the unique ID can be built from the named matches
+        of :attr:`url_pattern`.
+
+        :type url: unicode
+        :param url: A remote URL string.
+        :param \*\*kwargs: The named matches from the url match object.
+        :rtype: dict or None
+        :returns: At least ``unique_id`` and ``type``, or None if
+            :meth:`_parse` must be called right away.
+
+        """
+        return None
+
+    def fetch_metadata(self, url):
+        """Return the complete metadata for the given URL.
+
+        Called by the background queue for files which were added with the
+        metadata from :meth:`_parse_url` only.
+
+        :type url: unicode
+        :param url: The URL the file was added with.
+        :rtype: dict
+        :returns: Same as :meth:`_parse`.
+
+        """
+        match = self.url_pattern.match(url)
         return self._parse(url, **match.groupdict())
 
     @abstractmethod
@@ -315,12 +398,161 @@ class EmbedStorageEngine(StorageEngine):
 
         """
 
-def enabled_engines():
+_group_name = re.compile(r'\(\?P([<=])(\w+)')
+
+class URLDispatcher(object):
+    """Match a URL against the :attr:`~EmbedStorageEngine.url_pattern` of
+    several engines in one pass.
+
+    The patterns are combined into a single alternation. The regex engine
+    tries the alternatives in order, so the result is the same as calling
+    :meth:`EmbedStorageEngine.parse` of each engine in turn. Patterns with
+    different flags (e.g. ``re.VERBOSE``) can not share an alternation and
+    end up in separate regexes.
+
+    Only engine IDs are stored so a dispatcher can be shared by requests.
+
+    :param engines: Sorted :class:`EmbedStorageEngine` instances.
+    """
+    def __init__(self, engines):
+        self.segments = []
+        group = []
+        for engine in engines:
+            pattern = engine.url_pattern
+            if group and group[0][1].flags != pattern.flags:
+                self._add_segment(group)
+                group = []
+            group.append((engine.id, pattern))
+        if group:
+            self._add_segment(group)
+
+    def _add_segment(self, group):
+        flags = group[0][1].flags
+        alternatives = []
+        for engine_id, pattern in group:
+            # Prefix the named groups so the same name can be used in
+            # several patterns.
+            prefix = r'(?P\1_%d_\2' % engine_id
+            alternative = _group_name.sub(prefix, pattern.pattern)
+            if flags & re.VERBOSE:
+                # the pattern might end with a comment
+                alternative += '\n'
+            alternatives.append('(?P<_%d>%s)' % (engine_id, alternative))
+        try:
+            regex = re.compile('|'.join(alternatives), flags)
+        except (re.error, AssertionError), e:
+            # e.g. Python 2 only supports 100 named groups per regex
+            log.debug('Can not combine url patterns: %s', e)
+            if len(group) == 1:
+                raise
+            middle = len(group) // 2
+            self._add_segment(group[:middle])
+            self._add_segment(group[middle:])
+            return
+        self.segments.append((regex, [engine_id for engine_id, p in group]))
+
+    def match(self, url):
+        """Return the ID of the first engine matching the URL together with
+        the named matches of its :attr:`~EmbedStorageEngine.url_pattern`.
+
+        :rtype: tuple
+        :returns: ``(engine_id, kwargs)`` or ``(None, None)``.
+        """
+        for regex, engine_ids in self.segments:
+            match = regex.match(url)
+            if match is None:
+                continue
+            for engine_id in engine_ids:
+                if match.group('_%d' % engine_id) is not None:
+                    break
+            prefix = '_%d_' % engine_id
+            kwargs = dict((name[len(prefix):], value)
+                          for name, value in match.groupdict().iteritems()
+                          if name.startswith(prefix))
+            return engine_id, kwargs
+        return None, None
+
+# (key, sorted engine IDs, URLDispatcher) for the last set of enabled engines
+_engine_chain = None
+
+def invalidate_engine_cache():
+    """Forget the cached engine order.
+
+    Call this after storage engines were added, enabled, disabled or
+    deleted. (The cache also notices changes made by other processes as it
+    is keyed by the IDs of the enabled engines.)
+    """
+    global _engine_chain
+    _engine_chain = None
+
+def _engine_chain_for(engines):
+    global _engine_chain
+    key = frozenset((engine.id, engine.__class__) for engine in engines)
+    chain = _engine_chain
+    if chain is None or chain[0] != key:
+        sorted_engines = list(sort_engines(engines))
+        embed_engines = [engine for engine in sorted_engines
+                         if isinstance(engine, EmbedStorageEngine)]
+        chain = (key, [engine.id for engine in sorted_engines],
+                 URLDispatcher(embed_engines))
+        _engine_chain = chain
+    return chain
+
+def _enabled_engines_and_dispatcher():
     from mediadrop.model import DBSession
     engines = DBSession.query(StorageEngine)\
         .filter(StorageEngine.enabled == True)\
         .all()
-    return list(sort_engines(engines))
+    key, engine_ids, dispatcher = _engine_chain_for(engines)
+    engines_by_id = dict((engine.id, engine) for engine in engines)
+    return [engines_by_id[engine_id] for engine_id in engine_ids], dispatcher
+
+def enabled_engines():
+    """Return all enabled storage engines in the order they should be tried.
+
+    The order is computed only once, see :func:`invalidate_engine_cache`.
+    """
+    return _enabled_engines_and_dispatcher()[0]
+
+def uploads_need_checksum():
+    """Return True if any enabled engine needs the checksum of uploads.
+
+    The :class:`~mediadrop.lib.uploads.UploadSpoolMiddleware` only hashes
+    uploads while they are received if this is the case.
+    """
+    return any(engine.needs_upload_checksum for engine in enabled_engines())
+
+def _parse_input(engines, dispatcher, file=None, url=None):
+    """Return the first engine which accepts the file or URL and its metadata.
+
+    All :class:`EmbedStorageEngine` instances are tried at once using the
+    dispatcher as soon as the first one is reached.
+    """
+    tried_embed_engines = False
+    for engine in engines:
+        if isinstance(engine, EmbedStorageEngine):
+            if tried_embed_engines or url is None:
+                continue
+            tried_embed_engines = True
+            engine_id, kwargs = dispatcher.match(url)
+            if engine_id is None:
+                log.debug('No embed engine suitable for %r', url)
+                continue
+            engine = [e for e in engines if e.id == engine_id][0]
+            try:
+                meta = engine._parse_match(url, kwargs)
+            except UnsuitableEngineError:
+                log.debug('Engine %r unsuitable for %r', engine, url)
+                continue
+            log.debug('Engine %r returned meta %r', engine, meta)
+            return engine, meta
+        try:
+            meta = engine.parse(file=file, url=url)
+            log.debug('Engine %r returned meta %r', engine, meta)
+            return engine, meta
+        except UnsuitableEngineError:
+            log.debug('Engine %r unsuitable for %r/%r', engine, file, url)
+    raise StorageError(_('Unusable file or URL provided.'), None, None)
 
 def add_new_media_file(media, file=None, url=None):
     """Create a MediaFile instance from the given file or URL.
@@ -339,17 +571,8 @@ def add_new_media_file(media, file=None, url=None):
         stored with any of the registered storage engines.
 
     """
-    sorted_engines = enabled_engines()
-    for engine in sorted_engines:
-        try:
-            meta = engine.parse(file=file, url=url)
-            log.debug('Engine %r returned meta %r', engine, meta)
-            break
-        except UnsuitableEngineError:
-            log.debug('Engine %r unsuitable for %r/%r', engine, file, url)
-            continue
-    else:
-        raise StorageError(_('Unusable file or URL provided.'), None, None)
+    sorted_engines, dispatcher = _enabled_engines_and_dispatcher()
+    engine, meta = _parse_input(sorted_engines, dispatcher, file, url)
 
     from mediadrop.model import DBSession, MediaFile
     mf = MediaFile()
@@ -376,16 +599,49 @@ def add_new_media_file(media, file=None, url=None):
     elif not mf.unique_id:
         raise StorageError('Engine %r returned no unique ID.', engine)
 
+    if meta.get('fetch_metadata'):
+        from mediadrop.lib.storage.metadata_queue import fetch_metadata_later
+        fetch_metadata_later(mf, url)
+
+    apply_metadata(media, mf, meta)
+
+    DBSession.flush()
+
+    engine.postprocess(mf)
+
+    # Try to transcode the file.
+    for engine in sorted_engines:
+        try:
+            engine.transcode(mf)
+            log.debug('Engine %r has agreed to transcode %r', engine, mf)
+            break
+        except CannotTranscode:
+            log.debug('Engine %r unsuitable for transcoding %r', engine, mf)
+            continue
+
+    return mf
+
+def apply_metadata(media, media_file, meta):
+    """Fill in missing media details from the metadata of a storage engine.
+
+    Thumbnails are only created if the media has none or the defaults.
+
+    :type media: :class:`~mediadrop.model.media.Media` instance
+    :type media_file: :class:`~mediadrop.model.media.MediaFile` instance
+    :type meta: dict
+    :param meta: The metadata returned by :meth:`StorageEngine.parse`.
+
+    """
     if not media.duration and meta.get('duration', 0):
         media.duration = meta['duration']
     if not media.description and meta.get('description'):
         media.description = clean_xhtml(meta['description'])
     if not media.title:
-        media.title = meta.get('title', None) or mf.display_name
+        media.title = meta.get('title', None) or media_file.display_name
     if media.type is None:
-        media.type = mf.type
+        media.type = media_file.type
 
-    if ('thumbnail_url' in meta or 'thumbnail_file' in meta) \
+    if (meta.get('thumbnail_url') or meta.get('thumbnail_file')) \
     and (not has_thumbs(media) or has_default_thumbs(media)):
         thumb_file = meta.get('thumbnail_file', None)
 
@@ -394,34 +650,35 @@ def add_new_media_file(media, file=None, url=None):
         else:
             thumb_url = meta['thumbnail_url']
             thumb_filename = os.path.basename(thumb_url)
-
-            # Download the image to a buffer and wrap it as a file-like object
-            try:
-                temp_img = urlopen(thumb_url)
-                thumb_file = StringIO(temp_img.read())
-                temp_img.close()
-            except URLError, e:
-                log.exception(e)
+            thumb_file = download_file(thumb_url,
+                timeout=getattr(media_file.storage, 'fetch_timeout', None))
 
         if thumb_file is not None:
             create_thumbs_for(media, thumb_file, thumb_filename)
             thumb_file.close()
 
-    DBSession.flush()
-
-    engine.postprocess(mf)
+def download_file(url, timeout=None, chunk_size=64*1024):
+    """Download the given URL to an anonymous temporary file.
 
-    # Try to transcode the file.
-    for engine in sorted_engines:
-        try:
-            engine.transcode(mf)
-            log.debug('Engine %r has agreed to transcode %r', engine, mf)
-            break
-        except CannotTranscode:
-            log.debug('Engine %r unsuitable for transcoding %r', engine, mf)
-            continue
-
-    return mf
+    :returns: The file, positioned at the start, or None if the download
+        failed.
+    """
+    try:
+        response = urlopen(url, timeout=timeout or socket.getdefaulttimeout())
+    except (URLError, socket.error), e:
+        log.warn('Could not download %r: %s', url, e)
+        return None
+    temp_file = tempfile.TemporaryFile()
+    try:
+        shutil.copyfileobj(response, temp_file, chunk_size)
+    except (URLError, socket.error), e:
+        log.warn('Could not download %r: %s', url, e)
+        temp_file.close()
+        return None
+    finally:
+        response.close()
+    temp_file.seek(0)
+    return temp_file
 
 def sort_engines(engines):
     """Yield a topological sort of the given list of engines.
@@ -472,6 +729,9 @@ def sort_engines(engines):
             yield engine
 
 def get_file_size(file):
+    if isinstance(file, UploadFile):
+        # counted while the upload was received
+        return file.size
     if hasattr(file, 'fileno'):
         size = os.fstat(file.fileno())[6]
     else:
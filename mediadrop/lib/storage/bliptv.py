@@ -48,7 +48,7 @@ class BlipTVStorage(EmbedStorageEngine):
         req = Request(url)
 
         try:
-            temp_data = urlopen(req)
+            temp_data = urlopen(req, timeout=self.fetch_timeout)
             xmlstring = temp_data.read()
             try:
                 try:
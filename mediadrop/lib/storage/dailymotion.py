@@ -32,6 +32,13 @@ class DailyMotionStorage(EmbedStorageEngine):
     )
     """A compiled pattern object that uses named groupings for matches."""
 
+    def _parse_url(self, url, **kwargs):
+        """Return the metadata which can be derived without network access."""
+        return {
+            'unique_id': kwargs['id'],
+            'type': VIDEO,
+        }
+
     def _parse(self, url, **kwargs):
         """Return metadata for the given URL that matches :attr:`url_pattern`.
 
@@ -45,6 +52,20 @@ class DailyMotionStorage(EmbedStorageEngine):
 
         """
         id = kwargs['id']
+        try:
+            data = self._fetch_data(id)
+        except URLError, e:
+            log.exception(e)
+            data = {}
+        return self._meta(id, data)
+
+    def fetch_metadata(self, url):
+        """Return the complete metadata, raising an error if DailyMotion can
+        not be reached so the fetch is retried later."""
+        id = self.url_pattern.match(url).group('id')
+        return self._meta(id, self._fetch_data(id))
+
+    def _fetch_data(self, id):
         # Ensure the video uses the .com TLD for the API request.
         url = 'http://www.dailymotion.com/video/%s' % id
         data_url = 'http://www.dailymotion.com/services/oembed?' + \
@@ -53,20 +74,17 @@ class DailyMotionStorage(EmbedStorageEngine):
         headers = {'User-Agent': USER_AGENT}
         req = Request(data_url, headers=headers)
 
+        temp_data = urlopen(req, timeout=self.fetch_timeout)
         try:
-            temp_data = urlopen(req)
-            try:
-                data_string = temp_data.read()
-                if data_string == 'This video cannot be embeded.':
-                    raise UserStorageError(
-                        _('This DailyMotion video does not allow embedding.'))
-                data = simplejson.loads(data_string)
-            finally:
-                temp_data.close()
-        except URLError, e:
-            log.exception(e)
-            data = {}
-
+            data_string = temp_data.read()
+            if data_string == 'This video cannot be embeded.':
+                raise UserStorageError(
+                    _('This DailyMotion video does not allow embedding.'))
+            return simplejson.loads(data_string)
+        finally:
+            temp_data.close()
+
+    def _meta(self, id, data):
         return {
             'unique_id': id,
             'display_name': unicode(data.get('title', u'')),
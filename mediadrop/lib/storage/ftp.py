@@ -5,18 +5,20 @@
 # (at your option) any later version.
 # See LICENSE.txt in the main project directory, for more information.
 
+import hashlib
 import logging
+import threading
 import time
 import os
 
-from ftplib import FTP, all_errors as ftp_errors
+from ftplib import FTP, all_errors as ftp_errors, error_perm
 from urllib2 import HTTPError, urlopen
 
 from formencode import Invalid
 
-from mediadrop.lib.compat import sha1
 from mediadrop.lib.i18n import N_, _
 from mediadrop.lib.storage.api import FileStorageEngine, safe_file_name
+from mediadrop.lib.uploads import file_sha256
 from mediadrop.lib.uri import StorageURI
 
 log = logging.getLogger(__name__)
@@ -26,15 +28,119 @@ FTP_USERNAME = 'ftp_username'
 FTP_PASSWORD = 'ftp_password'
 FTP_UPLOAD_DIR = 'ftp_upload_dir'
 FTP_MAX_INTEGRITY_RETRIES = 'ftp_max_integrity_retries'
+FTP_MAX_RESUME_RETRIES = 'ftp_max_resume_retries'
+FTP_BLOCK_SIZE = 'ftp_block_size'
+FTP_POOL_SIZE = 'ftp_pool_size'
 
 HTTP_DOWNLOAD_URI = 'http_download_uri'
 RTMP_SERVER_URI = 'rtmp_server_uri'
 
+# ftplib sends 8 KB per write by default which is far too small for
+# large media files on fast links.
+DEFAULT_BLOCK_SIZE = 256 * 1024
+
+# Seconds before a blocking socket operation fails so stalled transfers
+# can be resumed instead of hanging forever.
+SOCKET_TIMEOUT = 60
+
 from mediadrop.forms.admin.storage.ftp import FTPStorageForm
 
 class FTPUploadError(Invalid):
     pass
 
+def _split_host_port(server):
+    host, sep, port = server.rpartition(':')
+    if sep and port.isdigit():
+        return host, int(port)
+    return server, 21
+
+def _close_quietly(ftp):
+    try:
+        ftp.quit()
+    except ftp_errors:
+        ftp.close()
+
+
+class FTPConnectionPool(object):
+    """A bounded pool of logged-in FTP connections.
+
+    At most ``max_size`` connections are in use at the same time, further
+    callers of :meth:`get` block until a connection is returned. Idle
+    connections are checked with a ``NOOP`` before they are handed out
+    again if they were not used for ``keepalive`` seconds and are closed
+    after ``max_idle`` seconds (most servers disconnect idle clients
+    anyway).
+
+    :param connect: A callable returning a new logged-in :class:`ftplib.FTP`.
+    """
+    def __init__(self, connect, max_size=2, keepalive=30, max_idle=300):
+        self.connect = connect
+        self.max_size = max_size
+        self.keepalive = keepalive
+        self.max_idle = max_idle
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def get(self):
+        """Return a working connection, blocks if all are in use."""
+        self._slots.acquire()
+        try:
+            while True:
+                self._lock.acquire()
+                try:
+                    if not self._idle:
+                        break
+                    ftp, last_used = self._idle.pop()
+                finally:
+                    self._lock.release()
+                idle_time = time.time() - last_used
+                if idle_time > self.max_idle:
+                    _close_quietly(ftp)
+                    continue
+                if idle_time > self.keepalive:
+                    try:
+                        ftp.voidcmd('NOOP')
+                    except ftp_errors:
+                        ftp.close()
+                        continue
+                return ftp
+            return self.connect()
+        except:
+            self._slots.release()
+            raise
+
+    def put(self, ftp, discard=False):
+        """Return a connection to the pool.
+
+        :param discard: Close the connection instead (e.g. because an error
+            left it in an unknown state).
+        """
+        try:
+            if discard:
+                ftp.close()
+            else:
+                self._lock.acquire()
+                try:
+                    self._idle.append((ftp, time.time()))
+                finally:
+                    self._lock.release()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close all idle connections."""
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+        for ftp, last_used in idle:
+            _close_quietly(ftp)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
 class FTPStorage(FileStorageEngine):
 
     engine_type = u'FTPStorage'
@@ -51,10 +157,18 @@ class FTPStorage(FileStorageEngine):
         FTP_PASSWORD: '',
         FTP_UPLOAD_DIR: '',
         FTP_MAX_INTEGRITY_RETRIES: 0,
+        FTP_MAX_RESUME_RETRIES: 3,
+        FTP_BLOCK_SIZE: DEFAULT_BLOCK_SIZE,
+        FTP_POOL_SIZE: 2,
         HTTP_DOWNLOAD_URI: '',
         RTMP_SERVER_URI: '',
     }
 
+    @property
+    def needs_upload_checksum(self):
+        # for the integrity check, see _verify_upload_integrity()
+        return int(self._data.get(FTP_MAX_INTEGRITY_RETRIES) or 0) > 0
+
     def store(self, media_file, file=None, url=None, meta=None):
         """Store the given file or URL and return a unique identifier for it.
 
@@ -77,28 +191,19 @@ class FTPStorage(FileStorageEngine):
 
         """
         file_name = safe_file_name(media_file, file.filename)
-
         file_url = os.path.join(self._data[HTTP_DOWNLOAD_URI], file_name)
-        upload_dir = self._data[FTP_UPLOAD_DIR]
-        stor_cmd = 'STOR ' + file_name
 
-        ftp = self._connect()
         try:
-            if upload_dir:
-                ftp.cwd(upload_dir)
-            ftp.storbinary(stor_cmd, file.file)
-
-            # Raise a FTPUploadError if the file integrity check fails
-            # TODO: Delete the file if the integrity check fails
-            self._verify_upload_integrity(file.file, file_url)
-            ftp.quit()
+            self._upload(file_name, file.file)
         except ftp_errors, e:
             log.exception(e)
-            ftp.quit()
             msg = _('Could not upload the file from your FTP server: %s')\
                 % e.message
             raise FTPUploadError(msg, None, None)
 
+        # Raise a FTPUploadError if the file integrity check fails
+        # TODO: Delete the file if the integrity check fails
+        self._verify_upload_integrity(file.file, file_url)
         return file_name
 
     def delete(self, unique_id):
@@ -111,18 +216,39 @@ class FTPStorage(FileStorageEngine):
         :returns: True if successful, False if an error occurred.
 
         """
-        upload_dir = self._data[FTP_UPLOAD_DIR]
-        ftp = self._connect()
+        return self.delete_many([unique_id])
+
+    def delete_many(self, unique_ids):
+        """Delete several stored files using a single FTP connection.
+
+        :type unique_ids: list
+        :param unique_ids: The identifying strings of the files.
+
+        :rtype: boolean
+        :returns: True if all files were deleted, False if an error occurred.
+
+        """
+        pool = self._pool()
+        success = True
         try:
-            if upload_dir:
-                ftp.cwd(upload_dir)
-            ftp.delete(unique_id)
-            ftp.quit()
-            return True
+            ftp = pool.get()
+        except ftp_errors, e:
+            log.exception(e)
+            return False
+        try:
+            for unique_id in unique_ids:
+                try:
+                    ftp.delete(unique_id)
+                except error_perm, e:
+                    # e.g. the file does not exist, the connection is fine
+                    log.warn('Could not delete %r: %s', unique_id, e)
+                    success = False
         except ftp_errors, e:
             log.exception(e)
-            ftp.quit()
+            pool.put(ftp, discard=True)
             return False
+        pool.put(ftp)
+        return success
 
     def get_uris(self, media_file):
         """Return a list of URIs from which the stored file can be accessed.
@@ -142,12 +268,89 @@ class FTPStorage(FileStorageEngine):
         return uris
 
     def _connect(self):
-        """Open a connection to the FTP server."""
+        """Open a connection to the FTP server.
+
+        The connection uses binary mode and the upload directory is the
+        working directory.
+        """
+        data = self._data
+        host, port = _split_host_port(data[FTP_SERVER])
+        ftp = FTP(timeout=SOCKET_TIMEOUT)
+        try:
+            ftp.connect(host, port)
+            ftp.login(data[FTP_USERNAME], data[FTP_PASSWORD])
+            if data[FTP_UPLOAD_DIR]:
+                ftp.cwd(data[FTP_UPLOAD_DIR])
+            ftp.voidcmd('TYPE I')
+        except:
+            ftp.close()
+            raise
+        return ftp
+
+    def _pool(self):
+        """Return the connection pool for the current server settings.
+
+        Engine instances are loaded again for every request so the pools
+        are kept in a module-level registry.
+        """
         data = self._data
-        return FTP(data[FTP_SERVER], data[FTP_USERNAME], data[FTP_PASSWORD])
+        key = (data[FTP_SERVER], data[FTP_USERNAME], data[FTP_PASSWORD],
+               data[FTP_UPLOAD_DIR])
+        size = int(data.get(FTP_POOL_SIZE) or 1)
+        _pools_lock.acquire()
+        try:
+            pool = _pools.get(key)
+            if pool is None or pool.max_size != size:
+                if pool is not None:
+                    pool.close()
+                pool = _pools[key] = FTPConnectionPool(self._connect, size)
+            return pool
+        finally:
+            _pools_lock.release()
+
+    def _upload(self, file_name, file):
+        """Upload the file, resuming the transfer if it is interrupted.
+
+        After a transient error the size of the partial file on the server
+        is queried (``SIZE``) and the upload continues from there using
+        ``REST``.
+
+        :raises ftplib.all_errors: If the upload fails permanently.
+        """
+        block_size = int(self._data.get(FTP_BLOCK_SIZE) or DEFAULT_BLOCK_SIZE)
+        max_retries = int(self._data.get(FTP_MAX_RESUME_RETRIES) or 0)
+        pool = self._pool()
+        offset = 0
+        for attempt in xrange(max_retries + 1):
+            ftp = pool.get()
+            try:
+                if attempt > 0:
+                    offset = self._remote_size(ftp, file_name)
+                file.seek(offset)
+                ftp.storbinary('STOR ' + file_name, file, block_size,
+                               rest=offset or None)
+            except error_perm:
+                # permanent errors (e.g. no write permission) won't go away
+                pool.put(ftp)
+                raise
+            except ftp_errors, e:
+                pool.put(ftp, discard=True)
+                if attempt == max_retries:
+                    raise
+                log.warn('Upload of %r interrupted (%s), resuming', file_name, e)
+            else:
+                pool.put(ftp)
+                return
+
+    def _remote_size(self, ftp, file_name):
+        try:
+            return ftp.size(file_name) or 0
+        except error_perm:
+            # nothing was stored yet
+            return 0
 
     def _verify_upload_integrity(self, file, file_url):
-        """Download the given file from the URL and compare the SHA1s.
+        """Download the given file from the URL and compare the checksums.
 
         :type file: :class:`cgi.FieldStorage`
         :param file: A freshly uploaded file object, that has just been
@@ -164,12 +367,11 @@ class FTPStorage(FileStorageEngine):
             doesn't match the original.
 
         """
-        max_tries = int(self._data[FTP_MAX_INTEGRITY_RETRIES])
+        max_tries = int(self._data.get(FTP_MAX_INTEGRITY_RETRIES) or 0)
         if max_tries < 1:
             return True
 
-        file.seek(0)
-        orig_hash = sha1(file.read()).hexdigest()
+        orig_hash = file_sha256(file)
 
         # Try to download the file. Increase the number of retries, or the
         # timeout duration, if the server is particularly slow.
@@ -178,7 +380,10 @@ class FTPStorage(FileStorageEngine):
         for i in xrange(max_tries):
             try:
                 temp_file = urlopen(file_url)
-                dl_hash = sha1(temp_file.read()).hexdigest()
+                dl_hash = hashlib.sha256()
+                for data in iter(lambda: temp_file.read(DEFAULT_BLOCK_SIZE), ''):
+                    dl_hash.update(data)
+                dl_hash = dl_hash.hexdigest()
                 temp_file.close()
             except HTTPError, http_err:
                 # Don't raise the exception now, wait until all attempts fail
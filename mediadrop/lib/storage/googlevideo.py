@@ -34,6 +34,13 @@ class GoogleVideoStorage(EmbedStorageEngine):
     xml_duration = re.compile(r'duration="([^"]*)"')
     xhtml_title = re.compile(r'<title>([^<]*)</title>')
 
+    def _parse_url(self, url, **kwargs):
+        """Return the metadata which can be derived without network access."""
+        return {
+            'unique_id': kwargs['id'],
+            'type': VIDEO,
+        }
+
     def _parse(self, url, **kwargs):
         """Return metadata for the given URL that matches :attr:`url_pattern`.
 
@@ -57,7 +64,7 @@ class GoogleVideoStorage(EmbedStorageEngine):
 
         # Fetch the video title from the main video player page
         try:
-            temp_data = urlopen(google_play_url)
+            temp_data = urlopen(google_play_url, timeout=self.fetch_timeout)
             data = temp_data.read()
             temp_data.close()
         except URLError, e:
@@ -69,7 +76,7 @@ class GoogleVideoStorage(EmbedStorageEngine):
 
         # Fetch the meta data from a MediaRSS feed for this video
         try:
-            temp_data = urlopen(google_data_url)
+            temp_data = urlopen(google_data_url, timeout=self.fetch_timeout)
             data = temp_data.read()
             temp_data.close()
         except URLError, e:
@@ -5,19 +5,69 @@
 # (at your option) any later version.
 # See LICENSE.txt in the main project directory, for more information.
 
+import base64
 import os
+import time
 
 from shutil import copyfileobj
-from urlparse import urlunsplit
+from urlparse import urlsplit, urlunsplit
 
-from pylons import config
+from pylons import config, request
 
 from mediadrop.forms.admin.storage.localfiles import LocalFileStorageForm
+from mediadrop.lib.compat import md5
 from mediadrop.lib.i18n import N_
 from mediadrop.lib.storage.api import safe_file_name, FileStorageEngine
+from mediadrop.lib.uploads import file_sha256, move_upload
 from mediadrop.lib.uri import StorageURI
 from mediadrop.lib.util import delete_files, url_for
 
+# Uploads which can not be renamed into place (e.g. because they were spooled
+# to a different filesystem) are copied with a large buffer to reduce the
+# number of system calls.
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# With content addressing enabled files are stored in a directory named after
+# their SHA-256 checksum ("sha256/ab/ab12...") and identical files are hard
+# links to each other. The number of links serves as the reference count, so
+# the data is removed with the last file.
+CONTENT_DIR = 'sha256'
+
+# Requests can set this WSGI environ key to False to get permanent (unsigned)
+# URLs for files which are rendered into long-lived documents (e.g. sitemaps).
+SIGN_URLS_KEY = 'mediadrop.sign_urls'
+
+def content_dir(digest):
+    """Return the directory (relative to the storage path) for files with
+    the given SHA-256 hex digest."""
+    return '%s/%s/%s' % (CONTENT_DIR, digest[:2], digest)
+
+def secure_link_url(base_url, file_name, secret, expires):
+    """Return a URL for the given file which can be checked by nginx.
+
+    The URL is signed like nginx's ``secure_link`` module expects it with
+    this configuration (``base_url`` being ``http://host/secure``)::
+
+        location /secure/ {
+            secure_link $arg_md5,$arg_expires;
+            secure_link_md5 "$secure_link_expires$uri <secret>";
+            if ($secure_link = "") { return 403; }
+            if ($secure_link = "0") { return 410; }
+            alias /path/to/mediadrop/data/media/;
+        }
+
+    :param base_url: Absolute URL of the location block serving the files.
+    :param file_name: Path of the file, relative to ``base_url``.
+    :param secret: The shared secret.
+    :param expires: Unix timestamp after which the link is rejected.
+    :rtype: str
+    """
+    base_url = base_url.rstrip('/')
+    uri = '%s/%s' % (urlsplit(base_url).path, file_name)
+    digest = md5('%d%s %s' % (expires, uri, secret)).digest()
+    token = base64.urlsafe_b64encode(digest).rstrip('=')
+    return '%s/%s?md5=%s&expires=%d' % (base_url, file_name, token, expires)
+
 class LocalFileStorage(FileStorageEngine):
 
     engine_type = u'LocalFileStorage'
@@ -31,8 +81,23 @@ class LocalFileStorage(FileStorageEngine):
     _default_data = {
         'path': None,
         'rtmp_server_uri': None,
+        'content_addressed': False,
+        'secure_link_url': None,
+        'secure_link_secret': None,
+        'secure_link_key_id': None,
+        'secure_link_lifetime': 3600,
     }
 
+    @property
+    def needs_upload_checksum(self):
+        return bool(self._data.get('content_addressed', False)) \
+            and hasattr(os, 'link')
+
+    @property
+    def signs_urls(self):
+        return bool(self._data.get('secure_link_url', None)
+                    and self._data.get('secure_link_secret', None))
+
     def store(self, media_file, file=None, url=None, meta=None):
         """Store the given file or URL and return a unique identifier for it.
 
@@ -49,15 +114,10 @@ class LocalFileStorage(FileStorageEngine):
 
         """
         file_name = safe_file_name(media_file, file.filename)
-        file_path = self._get_path(file_name)
-
-        temp_file = file.file
-        temp_file.seek(0)
-        permanent_file = open(file_path, 'wb')
-        copyfileobj(temp_file, permanent_file)
-        temp_file.close()
-        permanent_file.close()
+        if self._data.get('content_addressed', False) and hasattr(os, 'link'):
+            return self._store_content_addressed(file.file, file_name)
 
+        self._store_file(file.file, self._get_path(file_name))
         return file_name
 
     def delete(self, unique_id):
@@ -70,7 +130,14 @@ class LocalFileStorage(FileStorageEngine):
 
         """
         file_path = self._get_path(unique_id)
-        return delete_files([file_path], 'media')
+        result = delete_files([file_path], 'media')
+        if unique_id.startswith(CONTENT_DIR + '/'):
+            try:
+                # only possible after the last reference was removed
+                os.rmdir(os.path.dirname(file_path))
+            except OSError:
+                pass
+        return result
 
     def get_uris(self, media_file):
         """Return a list of URIs from which the stored file can be accessed.
@@ -84,9 +151,10 @@ class LocalFileStorage(FileStorageEngine):
         uris = []
 
         # Remotely accessible URL
-        url = url_for(controller='/media', action='serve', id=media_file.id,
-                      slug=media_file.media.slug, container=media_file.container,
-                      qualified=True)
+        url = self._signed_url(media_file) or \
+            url_for(controller='/media', action='serve', id=media_file.id,
+                    slug=media_file.media.slug, container=media_file.container,
+                    qualified=True)
         uris.append(StorageURI(media_file, 'http', url, None))
 
         # An optional streaming RTMP URI
@@ -95,9 +163,14 @@ class LocalFileStorage(FileStorageEngine):
             uris.append(StorageURI(media_file, 'rtmp', media_file.unique_id, rtmp_server_uri))
 
         # Remotely *download* accessible URL
-        url = url_for(controller='/media', action='serve', id=media_file.id,
-                      slug=media_file.media.slug, container=media_file.container,
-                      qualified=True, download=1)
+        signed_url = self._signed_url(media_file)
+        if signed_url:
+            # nginx can add a Content-Disposition header based on $arg_download
+            url = signed_url + '&download=1'
+        else:
+            url = url_for(controller='/media', action='serve', id=media_file.id,
+                          slug=media_file.media.slug, container=media_file.container,
+                          qualified=True, download=1)
         uris.append(StorageURI(media_file, 'download', url, None))
 
         # Internal file URI that will be used by MediaController.serve
@@ -106,6 +179,74 @@ class LocalFileStorage(FileStorageEngine):
 
         return uris
 
+    def _signed_url(self, media_file):
+        """Return an expiring URL which is served by the front-end server
+        directly or None if secure links are not configured.
+
+        The permission check which MediaController.serve would do happens
+        here so it is not possible to sign URLs outside of a request.
+
+        This method is exclusive to this engine.
+        """
+        base_url = self._data.get('secure_link_url', None)
+        secret = self._data.get('secure_link_secret', None)
+        if not (base_url and secret):
+            return None
+        try:
+            perm = request.perm
+            sign_urls = request.environ.get(SIGN_URLS_KEY, True)
+        except (AttributeError, TypeError):
+            # no request (e.g. a batch script) so we can not check permissions
+            return None
+        if not sign_urls:
+            return None
+        if not perm.contains_permission(u'view', media_file.media.resource):
+            return None
+
+        # Round up to full minutes so URLs (and pages containing them) stay
+        # the same for a while and can be cached.
+        lifetime = int(self._data.get('secure_link_lifetime', None) or 3600)
+        expires = (int(time.time()) + lifetime + 59) // 60 * 60
+
+        # Rotating the secret invalidates all links immediately unless the
+        # new secret uses a new key id: nginx can verify links for the old
+        # and the new key id in separate location blocks while old links
+        # expire.
+        key_id = self._data.get('secure_link_key_id', None)
+        if key_id:
+            base_url = '%s/%s' % (base_url.rstrip('/'), key_id)
+        return secure_link_url(base_url, media_file.unique_id, secret, expires)
+
+    def _store_file(self, temp_file, file_path):
+        """Move or copy the uploaded file to the given path.
+
+        This method is exclusive to this engine.
+        """
+        if not move_upload(temp_file, file_path):
+            temp_file.seek(0)
+            permanent_file = open(file_path, 'wb')
+            copyfileobj(temp_file, permanent_file, COPY_BUFFER_SIZE)
+            temp_file.close()
+            permanent_file.close()
+
+    def _store_content_addressed(self, temp_file, file_name):
+        """Store the file in the directory for its checksum and return the
+        unique ID. If an identical file exists already, just link to it.
+
+        This method is exclusive to this engine.
+        """
+        unique_id = '%s/%s' % (content_dir(file_sha256(temp_file)), file_name)
+        file_path = self._get_path(unique_id)
+        if link_to_identical_file(file_path):
+            temp_file.close()
+            return unique_id
+
+        dir_path = os.path.dirname(file_path)
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        self._store_file(temp_file, file_path)
+        return unique_id
+
     def _get_path(self, unique_id):
         """Return the local file path for the given unique ID.
 
@@ -116,4 +257,24 @@ class LocalFileStorage(FileStorageEngine):
             basepath = config['media_dir']
         return os.path.join(basepath, unique_id)
 
+def link_to_identical_file(file_path):
+    """Create ``file_path`` as a hard link to any other file in its
+    (content-addressed) directory.
+
+    :returns: False if there is no other file.
+    """
+    dir_path = os.path.dirname(file_path)
+    try:
+        names = os.listdir(dir_path)
+    except OSError:
+        return False
+    for name in names:
+        try:
+            os.link(os.path.join(dir_path, name), file_path)
+        except OSError:
+            # removed in the meantime, try the next one
+            continue
+        return True
+    return False
+
 FileStorageEngine.register(LocalFileStorage)
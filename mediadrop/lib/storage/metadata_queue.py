@@ -0,0 +1,223 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Fetch the metadata of embedded videos in the background.
+
+Asking YouTube, Vimeo & co. for the title, description, duration and
+thumbnail of a video takes a few seconds. Instead of blocking the request
+which adds the video, :func:`~mediadrop.lib.storage.api.add_new_media_file`
+only stores the video ID (see
+:meth:`~mediadrop.lib.storage.api.EmbedStorageEngine._parse_url`) and
+hands the rest over to the :class:`MetadataFetchQueue` of this process.
+
+Jobs are kept in memory only: if the process is restarted before a job
+was processed the media keeps the details entered by the user. Every job
+keeps the app config of the request which queued it, the worker registers
+it while it processes the job.
+"""
+
+import logging
+import threading
+import time
+from Queue import Queue
+
+from pylons import config
+
+from mediadrop.lib.storage.api import UserStorageError, apply_metadata
+from mediadrop.lib.util import pop_app_config, push_app_config
+
+__all__ = [
+    'MetadataCache',
+    'MetadataFetchQueue',
+    'fetch_metadata_later',
+    'metadata_queue',
+]
+
+log = logging.getLogger(__name__)
+
+
+class MetadataCache(object):
+    """A small thread-safe cache of API responses, keyed by engine and
+    video ID, so adding the same video again does not hit the API."""
+    def __init__(self, max_entries=1000, ttl=60*60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            meta, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            return meta
+        finally:
+            self._lock.release()
+
+    def set(self, key, meta):
+        self._lock.acquire()
+        try:
+            if len(self._entries) >= self.max_entries:
+                # evict the entry which expires first
+                oldest = min(self._entries, key=lambda k: self._entries[k][1])
+                del self._entries[oldest]
+            self._entries[key] = (meta, time.time() + self.ttl)
+        finally:
+            self._lock.release()
+
+
+class MetadataFetchJob(object):
+    def __init__(self, media_file_id, url, app_config):
+        self.media_file_id = media_file_id
+        self.url = url
+        self.app_config = app_config
+        self.attempts = 0
+
+
+class RetryLater(Exception):
+    """The media file is not visible yet (the request which added it has
+    not committed its transaction)."""
+
+
+class MetadataFetchQueue(object):
+    """Fetch metadata for new media files in a background thread.
+
+    Failed fetches are retried ``max_retries`` times, waiting
+    ``retry_delay`` seconds (doubled for every attempt) in between.
+
+    :param start_worker: Start the worker thread when the first job is
+        added. If False jobs are only processed by :meth:`process_pending`.
+    """
+    def __init__(self, max_retries=3, retry_delay=5, cache=None,
+                 start_worker=True):
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.cache = cache or MetadataCache()
+        self.start_worker = start_worker
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def put(self, media_file_id, url):
+        """Fetch the metadata for the given media file ID and URL."""
+        job = MetadataFetchJob(media_file_id, url, config._current_obj())
+        self._queue.put(job)
+        if self.start_worker:
+            self._ensure_worker()
+
+    def process_pending(self):
+        """Process all queued jobs in the current thread.
+
+        The caller is responsible for committing the database session.
+        """
+        while not self._queue.empty():
+            self._process(self._queue.get())
+            self._queue.task_done()
+
+    def join(self):
+        """Wait until the worker processed all queued jobs."""
+        self._queue.join()
+
+    def _ensure_worker(self):
+        self._lock.acquire()
+        try:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run,
+                    name='metadata-fetch-queue')
+                self._worker.daemon = True
+                self._worker.start()
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        from mediadrop.model import DBSession
+        while True:
+            job = self._queue.get()
+            push_app_config(job.app_config)
+            try:
+                if self._process(job):
+                    DBSession.commit()
+                else:
+                    DBSession.rollback()
+            except Exception, e:
+                log.exception(e)
+                DBSession.rollback()
+            finally:
+                DBSession.remove()
+                pop_app_config(job.app_config)
+                self._queue.task_done()
+
+    def _process(self, job):
+        """Fetch and apply the metadata for a single job.
+
+        :returns: True if the media was updated.
+        """
+        job.attempts += 1
+        try:
+            fetch_and_apply_metadata(job.media_file_id, job.url, self.cache)
+        except UserStorageError, e:
+            # e.g. private videos, retrying won't help
+            log.warn('Can not fetch metadata for %r: %s', job.url, e)
+            return False
+        except Exception, e:
+            if job.attempts > self.max_retries:
+                log.error('Giving up fetching metadata for %r: %s', job.url, e)
+                return False
+            delay = self.retry_delay * 2 ** (job.attempts - 1)
+            log.info('Fetching metadata for %r failed (%s), retrying in %d s',
+                     job.url, e, delay)
+            timer = threading.Timer(delay, self._queue.put, [job])
+            timer.daemon = True
+            timer.start()
+            return False
+        return True
+
+def fetch_and_apply_metadata(media_file_id, url, cache=None):
+    """Fetch the metadata of the given media file and update the media.
+
+    :raises RetryLater: If the media file does not exist (yet).
+    """
+    from mediadrop.model import DBSession, Media, MediaFile, get_available_slug
+    media_file = DBSession.query(MediaFile).get(media_file_id)
+    if media_file is None:
+        raise RetryLater('MediaFile %r not found' % media_file_id)
+    engine = media_file.storage
+    key = (engine.engine_type, media_file.unique_id)
+    meta = cache.get(key) if cache is not None else None
+    if meta is None:
+        meta = engine.fetch_metadata(url)
+        if cache is not None:
+            cache.set(key, meta)
+
+    media = media_file.media
+    placeholder = media_file.display_name
+    if meta.get('display_name'):
+        media_file.display_name = meta['display_name']
+        # The title was initialized with the placeholder name.
+        if media.title == placeholder:
+            media.title = meta['display_name']
+            if media.slug.startswith('_stub_'):
+                media.slug = get_available_slug(Media,
+                    '_stub_' + media.title, media)
+    apply_metadata(media, media_file, meta)
+    DBSession.flush()
+
+metadata_queue = MetadataFetchQueue()
+
+def fetch_metadata_later(media_file, url):
+    """Queue the given media file so its metadata is fetched in the background.
+
+    :type media_file: :class:`~mediadrop.model.media.MediaFile`
+    :param url: The URL the media file was added with.
+    """
+    metadata_queue.put(media_file.id, url)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from mediadrop.lib.storage import api
+from mediadrop.lib.storage.api import (enabled_engines, invalidate_engine_cache,
+    sort_engines, EmbedStorageEngine, StorageEngine, URLDispatcher)
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.model import DBSession
+
+
+class EngineOrderTest(DBTestCase):
+    def setUp(self):
+        super(EngineOrderTest, self).setUp()
+        invalidate_engine_cache()
+
+    def _embed_engines(self):
+        return [engine for engine in enabled_engines()
+                if isinstance(engine, EmbedStorageEngine)]
+
+    def test_returns_topologically_sorted_engines(self):
+        engines = DBSession.query(StorageEngine).filter_by(enabled=True).all()
+        assert_equals(list(sort_engines(engines)), enabled_engines())
+
+    def test_sorts_engines_only_once(self):
+        enabled_engines()
+        chain = api._engine_chain
+        enabled_engines()
+        assert_true(chain is api._engine_chain)
+
+    def test_notices_disabled_engines(self):
+        engines = enabled_engines()
+        engines[0].enabled = False
+        DBSession.flush()
+        assert_equals(engines[1:], enabled_engines())
+
+    def test_invalidation_forgets_order(self):
+        enabled_engines()
+        invalidate_engine_cache()
+        assert_none(api._engine_chain)
+
+    def test_dispatcher_matches_like_parse(self):
+        engines = self._embed_engines()
+        dispatcher = URLDispatcher(engines)
+        urls = [
+            u'http://www.youtube.com/watch?feature=player_embedded&v=RIk8A4TrCIY',
+            u'https://vimeo.com/1084537',
+            u'http://www.dailymotion.com/video/x1f5k_foo-bar',
+            u'http://blip.tv/foo/bar-123',
+        ]
+        for url in urls:
+            for engine in engines:
+                match = engine.url_pattern.match(url)
+                if match is not None:
+                    break
+            engine_id, kwargs = dispatcher.match(url)
+            assert_equals(engine.id, engine_id, message=url)
+            assert_equals(match.groupdict(), kwargs)
+
+    def test_dispatcher_returns_none_for_unknown_urls(self):
+        dispatcher = URLDispatcher(self._embed_engines())
+        assert_equals((None, None), dispatcher.match(u'http://site.example/foo.mp4'))
+
+    def test_combines_patterns_with_same_flags(self):
+        engines = self._embed_engines()
+        dispatcher = URLDispatcher(engines)
+        flags = [engine.url_pattern.flags for engine in engines]
+        flag_changes = len([i for i in range(1, len(flags)) if flags[i] != flags[i-1]])
+        assert_length(flag_changes + 1, dispatcher.segments)
+        assert_true(len(dispatcher.segments) < len(engines))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(EngineOrderTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
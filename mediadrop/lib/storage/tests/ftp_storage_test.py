@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+from StringIO import StringIO
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import FTPServer
+except ImportError:
+    # pyftpdlib is only installed for the tests (see tests_require in
+    # setup.py), the FTP tests are skipped without it.
+    FTPServer = None
+
+from mediadrop.lib.attribute_dict import AttrDict
+from mediadrop.lib.storage import ftp
+from mediadrop.lib.storage.ftp import FTPConnectionPool, FTPStorage
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.test.request_mixin import RequestMixin
+
+# pyftpdlib logs every command unless some handler is configured
+logging.getLogger('pyftpdlib').addHandler(logging.NullHandler())
+
+
+class FlakyFile(object):
+    """File which fails once after ``fail_after`` bytes were read, like a
+    connection which breaks in the middle of an upload."""
+    def __init__(self, data, fail_after):
+        self.file = StringIO(data)
+        self.fail_after = fail_after
+        self.offsets = []
+
+    def seek(self, offset, whence=0):
+        self.file.seek(offset, whence)
+        self.offsets.append(self.file.tell())
+
+    def read(self, size=-1):
+        if self.fail_after is not None and self.file.tell() >= self.fail_after:
+            self.fail_after = None
+            raise socket.error('connection reset by peer')
+        return self.file.read(size)
+
+
+class FTPStorageTest(DBTestCase, RequestMixin):
+    def setUp(self):
+        super(FTPStorageTest, self).setUp()
+        self.ftp_root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.ftp_root, 'media'))
+        authorizer = DummyAuthorizer()
+        authorizer.add_user('mediadrop', 'secret', self.ftp_root, perm='elradfmw')
+        class Handler(FTPHandler):
+            pass
+        Handler.authorizer = authorizer
+        self.server = FTPServer(('127.0.0.1', 0), Handler)
+        self.stop_server = threading.Event()
+        self.server_thread = threading.Thread(target=self._serve)
+        self.server_thread.start()
+
+        data = dict(FTPStorage._default_data)
+        data.update({
+            ftp.FTP_SERVER: '127.0.0.1:%d' % self.server.address[1],
+            ftp.FTP_USERNAME: 'mediadrop',
+            ftp.FTP_PASSWORD: 'secret',
+            ftp.FTP_UPLOAD_DIR: 'media',
+            ftp.FTP_BLOCK_SIZE: 1024,
+            ftp.HTTP_DOWNLOAD_URI: 'http://cdn.example/media/',
+        })
+        self.storage = FTPStorage(data=data)
+
+    def tearDown(self):
+        self.storage._pool().close()
+        self.stop_server.set()
+        self.server_thread.join()
+        shutil.rmtree(self.ftp_root)
+        super(FTPStorageTest, self).tearDown()
+
+    def _serve(self):
+        while not self.stop_server.is_set():
+            self.server.ioloop.loop(timeout=0.01, blocking=False)
+        self.server.close_all()
+
+    def _path(self, name):
+        return os.path.join(self.ftp_root, 'media', name)
+
+    def _store(self, file_, filename=u'foo.mp4'):
+        media_file = AttrDict(id=1, container=u'mp4')
+        upload = AttrDict(filename=filename, file=file_)
+        return self.storage.store(media_file, upload)
+
+    def test_stores_file_in_upload_dir(self):
+        unique_id = self._store(StringIO('data' * 1000))
+        assert_equals(u'1-foo.mp4', unique_id)
+        assert_equals('data' * 1000, open(self._path(unique_id), 'rb').read())
+
+    def test_resumes_interrupted_upload(self):
+        data = os.urandom(10 * 1024)
+        flaky_file = FlakyFile(data, fail_after=4 * 1024)
+        unique_id = self._store(flaky_file)
+        assert_equals(data, open(self._path(unique_id), 'rb').read())
+        assert_length(2, flaky_file.offsets)
+
+    def test_gives_up_after_max_resume_retries(self):
+        self.init_fake_request()
+        self.storage._data[ftp.FTP_MAX_RESUME_RETRIES] = 0
+        flaky_file = FlakyFile('x' * 4096, fail_after=1024)
+        assert_raises(ftp.FTPUploadError, lambda: self._store(flaky_file))
+
+    def test_needs_upload_checksum_only_for_integrity_checks(self):
+        assert_false(self.storage.needs_upload_checksum)
+        self.storage._data[ftp.FTP_MAX_INTEGRITY_RETRIES] = u'3'
+        assert_true(self.storage.needs_upload_checksum)
+        # the admin form saves empty fields as empty strings
+        self.storage._data[ftp.FTP_MAX_INTEGRITY_RETRIES] = u''
+        assert_false(self.storage.needs_upload_checksum)
+
+    def test_reuses_connections(self):
+        self._store(StringIO('foo'), filename=u'foo.mp4')
+        pool = self.storage._pool()
+        connection = pool.get()
+        pool.put(connection)
+        self._store(StringIO('bar'), filename=u'bar.mp4')
+        assert_equals([connection], [c for c, last_used in pool._idle])
+
+    def test_can_delete_many_files(self):
+        for name in ('a.mp4', 'b.mp4'):
+            open(self._path(name), 'wb').close()
+        assert_true(self.storage.delete_many(['a.mp4', 'b.mp4']))
+        assert_equals([], os.listdir(os.path.join(self.ftp_root, 'media')))
+
+    def test_delete_many_reports_missing_files(self):
+        open(self._path('a.mp4'), 'wb').close()
+        assert_false(self.storage.delete_many(['missing.mp4', 'a.mp4']))
+        assert_false(os.path.exists(self._path('a.mp4')))
+
+
+class FakeConnection(object):
+    def __init__(self, closed):
+        self.closed = closed
+        self.noop_ok = True
+
+    def voidcmd(self, cmd):
+        if not self.noop_ok:
+            raise EOFError()
+
+    def close(self):
+        self.closed.append(self)
+    quit = close
+
+
+class FTPConnectionPoolTest(PythonicTestCase):
+    def setUp(self):
+        self.closed = []
+        self.pool = FTPConnectionPool(lambda: FakeConnection(self.closed),
+                                      max_size=2, keepalive=0)
+
+    def test_replaces_dead_idle_connections(self):
+        connection = self.pool.get()
+        self.pool.put(connection)
+        connection.noop_ok = False
+
+        new_connection = self.pool.get()
+        assert_not_equals(connection, new_connection)
+        assert_equals([connection], self.closed)
+
+    def test_discarded_connections_are_not_reused(self):
+        connection = self.pool.get()
+        self.pool.put(connection, discard=True)
+        assert_equals([connection], self.closed)
+        assert_equals([], self.pool._idle)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    if FTPServer is None:
+        return suite
+    suite.addTest(unittest.makeSuite(FTPStorageTest))
+    suite.addTest(unittest.makeSuite(FTPConnectionPoolTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
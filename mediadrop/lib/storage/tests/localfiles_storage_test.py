@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import base64
+import hashlib
+import os
+from StringIO import StringIO
+from urlparse import parse_qs, urlsplit
+
+from mediadrop.lib.attribute_dict import AttrDict
+from mediadrop.lib.storage.localfiles import (content_dir, LocalFileStorage,
+    secure_link_url)
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.test.request_mixin import RequestMixin
+from mediadrop.model import DBSession, Media, MediaFile
+
+
+class SecureLinkURLTest(PythonicTestCase):
+    def test_signs_like_nginx_secure_link_md5(self):
+        url = secure_link_url('http://cdn.example/secure/', '1-foo.mp4', 'sikrit', 1400000000)
+        digest = hashlib.md5('1400000000/secure/1-foo.mp4 sikrit').digest()
+        token = base64.urlsafe_b64encode(digest).rstrip('=')
+        assert_equals('http://cdn.example/secure/1-foo.mp4?md5=%s&expires=1400000000' % token, url)
+
+
+class LocalFileStorageSecureLinksTest(DBTestCase, RequestMixin):
+    def setUp(self):
+        super(LocalFileStorageSecureLinksTest, self).setUp()
+        self.init_fake_request()
+        self.storage = DBSession.query(LocalFileStorage).one()
+        self.storage._data.update({
+            'secure_link_url': u'http://cdn.example/secure',
+            'secure_link_secret': u'sikrit',
+            'secure_link_key_id': u'k2',
+        })
+        media = Media.example()
+        self.media_file = MediaFile()
+        self.media_file.media = media
+        self.media_file.type = u'video'
+        self.media_file.container = u'mp4'
+        self.media_file.display_name = u'foo.mp4'
+        self.media_file.unique_id = u'%d-foo.mp4' % media.id
+        self.media_file.storage = self.storage
+        DBSession.flush()
+
+    def _uri(self, scheme):
+        for uri in self.storage.get_uris(self.media_file):
+            if uri.scheme == scheme:
+                return uri.file_uri
+
+    def test_returns_signed_urls_if_user_may_view_media(self):
+        self.set_authenticated_user(None)
+        url = self._uri('http')
+        parts = urlsplit(url)
+        assert_equals('/secure/k2/' + self.media_file.unique_id, parts.path)
+        assert_equals(['md5', 'expires'], sorted(parse_qs(parts.query), reverse=True))
+        assert_equals(url + '&download=1', self._uri('download'))
+
+    def test_falls_back_to_mediadrop_urls_without_secret(self):
+        assert_true(self.storage.signs_urls)
+        self.storage._data['secure_link_secret'] = None
+        assert_false(self.storage.signs_urls)
+        self.set_authenticated_user(None)
+        assert_contains('/files/', self._uri('http'))
+
+
+class LocalFileStorageContentAddressingTest(DBTestCase):
+    def setUp(self):
+        super(LocalFileStorageContentAddressingTest, self).setUp()
+        self.storage = DBSession.query(LocalFileStorage).one()
+        self.storage._data['content_addressed'] = True
+        self.media = Media.example()
+
+    def _store(self, content):
+        media_file = MediaFile()
+        media_file.media = self.media
+        media_file.type = u'video'
+        media_file.container = u'mp4'
+        media_file.display_name = u'lecture.mp4'
+        media_file.storage = self.storage
+        DBSession.flush()
+        upload = AttrDict(filename=u'lecture.mp4', file=StringIO(content))
+        return self.storage.store(media_file, file=upload)
+
+    def test_stores_identical_files_only_once(self):
+        first_id = self._store('lecture recording')
+        second_id = self._store('lecture recording')
+        assert_not_equals(first_id, second_id)
+        digest = hashlib.sha256('lecture recording').hexdigest()
+        assert_equals(content_dir(digest), os.path.dirname(first_id))
+        assert_equals(content_dir(digest), os.path.dirname(second_id))
+
+        first_path = self.storage._get_path(first_id)
+        assert_equals(2, os.stat(first_path).st_nlink)
+        assert_not_equals(content_dir(digest), os.path.dirname(self._store('other')))
+
+    def test_needs_upload_checksum_only_if_content_addressed(self):
+        assert_true(self.storage.needs_upload_checksum)
+        self.storage._data['content_addressed'] = False
+        assert_false(self.storage.needs_upload_checksum)
+
+    def test_removes_file_with_last_reference(self):
+        first_id = self._store('lecture recording')
+        second_id = self._store('lecture recording')
+        second_path = self.storage._get_path(second_id)
+
+        self.storage.delete(first_id)
+        assert_equals('lecture recording', open(second_path, 'rb').read())
+        self.storage.delete(second_id)
+        assert_false(os.path.exists(os.path.dirname(second_path)))
+
+
+import unittest
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SecureLinkURLTest))
+    suite.addTest(unittest.makeSuite(LocalFileStorageSecureLinksTest))
+    suite.addTest(unittest.makeSuite(LocalFileStorageContentAddressingTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import os
+import threading
+from cStringIO import StringIO
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+from PIL import Image
+from pylons import config
+import simplejson
+
+from mediadrop.lib.storage import add_new_media_file, metadata_queue
+from mediadrop.lib.storage.metadata_queue import MetadataFetchQueue
+from mediadrop.lib.storage.vimeo import VimeoStorage
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.test.request_mixin import RequestMixin
+from mediadrop.lib.thumbnails import thumb_path
+from mediadrop.model import DBSession, Media
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class FakeVimeo(object):
+    """Serves the Vimeo API and thumbnails."""
+    def __init__(self):
+        self.requests = []
+        self.failures = 0
+        image = StringIO()
+        Image.new('RGB', (64, 48), (255, 0, 0)).save(image, 'JPEG')
+        self.thumbnail = image.getvalue()
+
+    def __call__(self, environ, start_response):
+        path = environ['PATH_INFO']
+        self.requests.append(path)
+        if self.failures:
+            self.failures -= 1
+            start_response('503 Service Unavailable', [])
+            return ['']
+        if path.endswith('.jpg'):
+            start_response('200 OK', [('Content-Type', 'image/jpeg')])
+            return [self.thumbnail]
+        data = [{
+            'title': u'Big Buck Bunny',
+            'description': u'<p>A rabbit</p>',
+            'duration': 596,
+            'thumbnail_large': self.base_url + '/thumb.jpg',
+        }]
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return [simplejson.dumps(data)]
+
+
+class MetadataFetchQueueTest(DBTestCase, RequestMixin):
+    def setUp(self):
+        super(MetadataFetchQueueTest, self).setUp()
+        self.init_fake_request()
+
+        self.fake_vimeo = FakeVimeo()
+        self.server = make_server('127.0.0.1', 0, self.fake_vimeo,
+                                  handler_class=QuietHandler)
+        self.fake_vimeo.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.server_thread = threading.Thread(target=self.server.serve_forever,
+            kwargs=dict(poll_interval=0.05))
+        self.server_thread.start()
+        self.original_api_url = VimeoStorage.api_url
+        VimeoStorage.api_url = self.fake_vimeo.base_url + '/api/%s.json'
+
+        self.original_queue = metadata_queue.metadata_queue
+        self.queue = MetadataFetchQueue(retry_delay=0, start_worker=False)
+        metadata_queue.metadata_queue = self.queue
+
+    def tearDown(self):
+        metadata_queue.metadata_queue = self.original_queue
+        VimeoStorage.api_url = self.original_api_url
+        self.server.shutdown()
+        self.server_thread.join()
+        super(MetadataFetchQueueTest, self).tearDown()
+
+    def _add_video(self, video_id='1084537'):
+        media = Media.example(title=u'')
+        media_file = add_new_media_file(media, url=u'http://vimeo.com/' + video_id)
+        DBSession.flush()
+        return media, media_file
+
+    def test_adds_video_without_calling_the_api(self):
+        media, media_file = self._add_video()
+        assert_equals(u'1084537', media_file.unique_id)
+        assert_equals([], self.fake_vimeo.requests)
+
+    def test_fills_in_metadata_in_the_background(self):
+        media, media_file = self._add_video()
+        self.queue.process_pending()
+
+        assert_equals(u'Big Buck Bunny', media.title)
+        assert_equals(u'Big Buck Bunny', media_file.display_name)
+        assert_equals(596, media.duration)
+        assert_equals(u'<p>A rabbit</p>', media.description)
+        assert_true(os.path.exists(thumb_path(media, 's')))
+
+    def test_worker_uses_the_config_of_the_request(self):
+        # Pylons registers the app config only for requests, the worker
+        # thread would see the empty default config of the process.
+        config.pop_process_config(self.pylons_config)
+        config.push_thread_config(self.pylons_config)
+        try:
+            media, media_file = self._add_video()
+            DBSession.commit()
+            media_id = media.id
+            self.queue._ensure_worker()
+            self.queue.join()
+        finally:
+            config.pop_thread_config(self.pylons_config)
+            config.push_process_config(self.pylons_config)
+
+        DBSession.remove()
+        media = DBSession.query(Media).get(media_id)
+        assert_equals(u'Big Buck Bunny', media.title)
+        assert_equals(596, media.duration)
+        assert_true(os.path.exists(thumb_path(media, 's')))
+
+    def test_caches_api_responses_by_video_id(self):
+        self._add_video()
+        self._add_video()
+        self.queue.process_pending()
+        api_requests = [path for path in self.fake_vimeo.requests
+                        if path.endswith('.json')]
+        assert_length(1, api_requests)
+
+    def test_retries_failed_fetches(self):
+        self.fake_vimeo.failures = 1
+        media, media_file = self._add_video()
+        self.queue.process_pending()
+        assert_equals(u'1084537', media.title)
+
+        # the retry is queued by a timer thread
+        job = self.queue._queue.get(timeout=5)
+        self.queue._process(job)
+        assert_equals(u'Big Buck Bunny', media.title)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(MetadataFetchQueueTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
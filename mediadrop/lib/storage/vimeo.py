@@ -29,6 +29,15 @@ class VimeoStorage(EmbedStorageEngine):
     url_pattern = re.compile(r'^(http(s?)://)?(\w+\.)?vimeo.com/(?P<id>\d+)')
     """A compiled pattern object that uses named groupings for matches."""
 
+    api_url = 'http://vimeo.com/api/v2/video/%s.json'
+
+    def _parse_url(self, url, **kwargs):
+        """Return the metadata which can be derived without network access."""
+        return {
+            'unique_id': kwargs['id'],
+            'type': VIDEO,
+        }
+
     def _parse(self, url, **kwargs):
         """Return metadata for the given URL that matches :attr:`url_pattern`.
 
@@ -42,22 +51,30 @@ class VimeoStorage(EmbedStorageEngine):
 
         """
         id = kwargs['id']
-        vimeo_data_url = 'http://vimeo.com/api/v2/video/%s.%s' % (id, 'json')
-
-        # Vimeo API requires us to give a user-agent, to avoid 403 errors.
-        headers = {'User-Agent': USER_AGENT}
-        req = Request(vimeo_data_url, headers=headers)
-
         try:
-            temp_data = urlopen(req)
-            try:
-                data = simplejson.loads(temp_data.read())[0]
-            finally:
-                temp_data.close()
+            data = self._fetch_data(id)
         except URLError, e:
             log.exception(e)
             data = {}
+        return self._meta(id, data)
+
+    def fetch_metadata(self, url):
+        """Return the complete metadata, raising an error if Vimeo can not
+        be reached so the fetch is retried later."""
+        id = self.url_pattern.match(url).group('id')
+        return self._meta(id, self._fetch_data(id))
+
+    def _fetch_data(self, id):
+        # Vimeo API requires us to give a user-agent, to avoid 403 errors.
+        headers = {'User-Agent': USER_AGENT}
+        req = Request(self.api_url % id, headers=headers)
+        temp_data = urlopen(req, timeout=self.fetch_timeout)
+        try:
+            return simplejson.loads(temp_data.read())[0]
+        finally:
+            temp_data.close()
 
+    def _meta(self, id, data):
         return {
             'unique_id': id,
             'description': unicode(data.get('description', u'')),
@@ -36,6 +36,13 @@ class YoutubeStorage(EmbedStorageEngine):
     ''', re.VERBOSE)
     """A compiled pattern object that uses named groupings for matches."""
 
+    def _parse_url(self, url, **kwargs):
+        """Return the metadata which can be derived without network access."""
+        return {
+            'unique_id': kwargs['id'],
+            'type': VIDEO,
+        }
+
     def _parse(self, url, **kwargs):
         """Return metadata for the given URL that matches :attr:`url_pattern`.
 
@@ -5,10 +5,15 @@
 # (at your option) any later version.
 # See LICENSE.txt in the main project directory, for more information.
 
+import cPickle as pickle
+from hashlib import sha1
 import logging
 import os.path
+import tempfile
 
+import genshi
 from genshi import Markup, XML
+from genshi.core import END, END_NS, QName, START, START_NS
 from genshi.output import XHTMLSerializer
 from genshi.template import TemplateError, NewTextTemplate
 from genshi.template.loader import (directory,
@@ -20,12 +25,22 @@ from mediadrop.lib.i18n import N_
 __all__ = [
     'TemplateLoader',
     'XHTMLPlusSerializer',
+    'find_templates',
     'render',
+    'render_chunks',
+    'render_fragment',
     'render_stream',
 ]
 
 log = logging.getLogger(__name__)
 
+TEMPLATE_EXTENSIONS = ('.html', '.xml')
+STREAM_CHUNK_SIZE = 64 * 1024
+# Set in the WSGI environ if the response body is rendered while it is
+# sent, see mediadrop.config.middleware.RegistryManager
+STREAMING_RESPONSE_KEY = 'mediadrop.streaming_response'
+XHTML_NAMESPACE = u'http://www.w3.org/1999/xhtml'
+
 def tmpl_globals():
     """Create and return a dictionary of global variables for all templates.
 
@@ -114,6 +129,41 @@ def render_stream(stream, method='auto', template_name=None):
     :returns: A subclassed `unicode` object.
 
     """
+    method = _serialization_method(method, template_name)
+    return Markup(stream.render(method=method, encoding=None))
+
+def render_chunks(stream, method='auto', template_name=None,
+                  encoding='utf-8', chunk_size=STREAM_CHUNK_SIZE):
+    """Serialize the given stream incrementally.
+
+    Unlike :func:`render_stream` the output is never held in memory
+    completely: the template is evaluated while the chunks are consumed
+    (e.g. sent to the client, see ``expose(streaming=True)``).
+
+    :type stream: :class:`genshi.Stream`
+    :param stream: An iterable markup stream.
+    :param method: The serialization method, see :func:`render_stream`.
+    :param template_name: Optional template name, see :func:`render_stream`.
+    :param encoding: The encoding of the chunks.
+    :param chunk_size: Minimum number of characters per chunk (except for
+        the last one).
+    :returns: A generator of encoded strings.
+
+    """
+    method = _serialization_method(method, template_name)
+    buffered = []
+    size = 0
+    for text in stream.serialize(method=method):
+        buffered.append(text)
+        size += len(text)
+        if size >= chunk_size:
+            yield u''.join(buffered).encode(encoding, 'xmlcharrefreplace')
+            buffered = []
+            size = 0
+    if buffered:
+        yield u''.join(buffered).encode(encoding, 'xmlcharrefreplace')
+
+def _serialization_method(method, template_name):
     if method == 'auto':
         if template_name and template_name.endswith('.xml'):
             method = 'xml'
@@ -122,8 +172,36 @@ def render_stream(stream, method='auto', template_name=None):
 
     if method == 'xhtml':
         method = XHTMLPlusSerializer
+    return method
 
-    return Markup(stream.render(method=method, encoding=None))
+def render_fragment(template, tmpl_vars=None):
+    """Render the given template to an XHTML fragment.
+
+    Unlike ``render(template, tmpl_vars, method='xhtml')`` the XHTML
+    namespace is not declared on the first element so the fragment can be
+    embedded into other templates (e.g. when it was cached).
+
+    :param template: A template path.
+    :param tmpl_vars: A dict of variables to pass into the template.
+    :rtype: :class:`genshi.Markup`
+    """
+    stream = render(template, tmpl_vars) | _strip_xhtml_namespace
+    return render_stream(stream, method='xhtml')
+
+def _strip_xhtml_namespace(stream):
+    for kind, data, pos in stream:
+        if kind is START:
+            tag, attrs = data
+            if tag.namespace == XHTML_NAMESPACE:
+                data = QName(tag.localname), attrs
+        elif kind is END:
+            if data.namespace == XHTML_NAMESPACE:
+                data = QName(data.localname)
+        elif kind is START_NS and data == ('', XHTML_NAMESPACE):
+            continue
+        elif kind is END_NS and data == '':
+            continue
+        yield kind, data, pos
 
 class XHTMLPlusSerializer(XHTMLSerializer):
     """
@@ -135,7 +213,119 @@ class XHTMLPlusSerializer(XHTMLSerializer):
     """
     _EMPTY_ELEMS = frozenset(set(['source']) | XHTMLSerializer._EMPTY_ELEMS)
 
+def find_templates(template_paths, plugin_mgr=None):
+    """Return the names of all markup templates of MediaDrop and its plugins.
+
+    :param template_paths: A list of template directories.
+    :param plugin_mgr: Optional :class:`mediadrop.plugin.PluginManager`,
+        plugin templates are named like ``{plugin.name}/index.html``.
+    :rtype: list
+    """
+    template_dirs = [('', path) for path in template_paths]
+    if plugin_mgr is not None:
+        for name, plugin in sorted(plugin_mgr.plugins.iteritems()):
+            if plugin.templates_path:
+                template_dirs.append((name + '/', plugin.templates_path))
+
+    names = []
+    for prefix, template_dir in template_dirs:
+        for dirpath, dirnames, filenames in os.walk(template_dir):
+            dirnames.sort()
+            relpath = os.path.relpath(dirpath, template_dir)
+            for filename in sorted(filenames):
+                if not filename.endswith(TEMPLATE_EXTENSIONS):
+                    continue
+                name = os.path.normpath(os.path.join(relpath, filename))
+                names.append(prefix + name.replace(os.path.sep, '/'))
+    return names
+
 class TemplateLoader(_TemplateLoader):
+    """Genshi template loader which can store parsed templates on disk.
+
+    If a ``cache_dir`` is given the parsed (but not yet prepared) template
+    streams are pickled to that directory so other processes don't have
+    to parse the template files again. Cached templates are only used
+    if the template file was not modified since.
+    """
+    def __init__(self, search_path=None, auto_reload=False, cache_dir=None,
+                 **kwargs):
+        _TemplateLoader.__init__(self, search_path=search_path,
+                                 auto_reload=auto_reload, **kwargs)
+        self.cache_dir = cache_dir
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def preload(self, names):
+        """Load and prepare the given templates (e.g. before serving the
+        first request).
+
+        :param names: Template names, see :func:`find_templates`.
+        :returns: The number of templates which were loaded.
+        """
+        count = 0
+        for name in names:
+            try:
+                # accessing the stream prepares the template (this processes
+                # static includes and the i18n directives)
+                self.load(name).stream
+            except TemplateError, e:
+                log.warn('Could not preload template %r: %s', name, e)
+            else:
+                count += 1
+        return count
+
+    def _cache_path(self, cls, filepath, filename, encoding):
+        """Return the path of the cached template and the stamp which
+        identifies the current version of the template file."""
+        if not self.cache_dir or not filepath or not os.path.isfile(filepath):
+            return None, None
+        template_id = (genshi.__version__, cls.__module__, cls.__name__,
+                       filepath, filename, encoding)
+        stat = os.stat(filepath)
+        stamp = template_id + (stat.st_mtime, stat.st_size)
+        cache_name = sha1(repr(template_id)).hexdigest() + '.pickle'
+        return os.path.join(self.cache_dir, cache_name), stamp
+
+    def _instantiate_cached(self, cls, fileobj, filepath, filename,
+                            encoding=None):
+        cache_path, stamp = self._cache_path(cls, filepath, filename, encoding)
+        if cache_path is None:
+            return self._instantiate(cls, fileobj, filepath, filename,
+                                     encoding=encoding)
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                cached_stamp, state = pickle.load(cache_file)
+            if cached_stamp == stamp:
+                tmpl = cls.__new__(cls)
+                state['loader'] = self
+                tmpl.__setstate__(state)
+                return tmpl
+        except IOError:
+            pass
+        except Exception, e:
+            log.debug('Ignoring broken template cache %r: %s', cache_path, e)
+
+        tmpl = self._instantiate(cls, fileobj, filepath, filename,
+                                 encoding=encoding)
+        state = tmpl.__getstate__()
+        # the loader is not picklable (and restored when loading the file)
+        del state['loader']
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                            suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as cache_file:
+                    pickle.dump((stamp, state), cache_file,
+                                pickle.HIGHEST_PROTOCOL)
+                # atomic so other processes never read a partial file
+                os.rename(tmp_path, cache_path)
+            except:
+                os.remove(tmp_path)
+                raise
+        except (EnvironmentError, pickle.PicklingError), e:
+            log.warn('Could not store parsed template %r: %s', filename, e)
+        return tmpl
+
     def load(self, filename, relative_to=None, cls=None, encoding=None):
         """Load the template with the given name.
 
@@ -244,8 +434,8 @@ class TemplateLoader(_TemplateLoader):
                             # so that nested includes work properly without a
                             # search path
                             filename = filepath
-                        tmpl = self._instantiate(cls, fileobj, filepath,
-                                                 filename, encoding=encoding)
+                        tmpl = self._instantiate_cached(cls, fileobj,
+                            filepath, filename, encoding=encoding)
                         if self.callback:
                             self.callback(tmpl)
                         self._cache[cachekey] = tmpl
@@ -16,16 +16,23 @@ from mediadrop.lib.test.support import *
 
 
 def suite():
-    from mediadrop.controllers.tests import login_test, upload_test
+    from mediadrop.controllers.tests import (api_media_test, login_test,
+        resumable_upload_test, sitemaps_test, upload_test)
     from mediadrop.lib.auth.tests import (filtering_restricted_items_test, 
         group_based_permissions_policy_test, mediadrop_permission_system_test,
         permission_system_test, query_result_proxy_test, static_query_test)
-    from mediadrop.lib.tests import (css_delivery_test, current_url_test,
-        helpers_test, js_delivery_test, observable_test, request_mixin_test,
-        url_for_test, xhtml_normalization_test)
-    from mediadrop.lib.storage.tests import youtube_storage_test
+    from mediadrop.lib.tests import (api_serializer_test, beaker_cache_test,
+        catalogue_export_test, conditional_get_test, css_delivery_test,
+        current_url_test, fileapp_test, fragments_test, helpers_test, js_delivery_test, mail_queue_test,
+        middleware_test, observable_test, request_mixin_test, response_cache_test,
+        sitemap_files_test, spam_check_test,
+        templating_test, thumbnails_test, uploads_test, url_for_test, vulgarity_test,
+        xhtml_normalization_test, xhtml_sanitizer_test)
+    from mediadrop.lib.storage.tests import (engine_order_test, ftp_storage_test,
+        localfiles_storage_test, metadata_queue_test, youtube_storage_test)
     from mediadrop.model.tests import (category_example_test, group_example_test, 
-        media_example_test, media_status_test, media_test, user_example_test)
+        media_example_test, media_status_test, media_test, podcast_test,
+        user_example_test)
     from mediadrop.plugin.tests import abstract_class_registration_test, events_test, observes_test
     
     from mediadrop.validation.tests import (limit_feed_items_validator_test, 
@@ -35,33 +42,57 @@ def suite():
     import unittest
     suite = unittest.TestSuite()
     suite.addTest(abstract_class_registration_test.suite())
+    suite.addTest(api_media_test.suite())
+    suite.addTest(api_serializer_test.suite())
+    suite.addTest(beaker_cache_test.suite())
+    suite.addTest(catalogue_export_test.suite())
     suite.addTest(category_example_test.suite())
+    suite.addTest(conditional_get_test.suite())
     suite.addTest(css_delivery_test.suite())
     suite.addTest(current_url_test.suite())
+    suite.addTest(engine_order_test.suite())
     suite.addTest(events_test.suite())
+    suite.addTest(fileapp_test.suite())
     suite.addTest(filtering_restricted_items_test.suite())
+    suite.addTest(fragments_test.suite())
+    suite.addTest(ftp_storage_test.suite())
     suite.addTest(group_based_permissions_policy_test.suite())
     suite.addTest(group_example_test.suite())
     suite.addTest(helpers_test.suite())
     suite.addTest(limit_feed_items_validator_test.suite())
+    suite.addTest(localfiles_storage_test.suite())
     suite.addTest(login_test.suite())
+    suite.addTest(mail_queue_test.suite())
     suite.addTest(media_example_test.suite())
     suite.addTest(media_status_test.suite())
     suite.addTest(media_test.suite())
+    suite.addTest(metadata_queue_test.suite())
     suite.addTest(mediadrop_permission_system_test.suite())
+    suite.addTest(middleware_test.suite())
     suite.addTest(permission_system_test.suite())
     suite.addTest(observes_test.suite())
+    suite.addTest(podcast_test.suite())
     suite.addTest(js_delivery_test.suite())
     suite.addTest(observable_test.suite())
     suite.addTest(query_result_proxy_test.suite())
     suite.addTest(request_mixin_test.suite())
+    suite.addTest(response_cache_test.suite())
+    suite.addTest(resumable_upload_test.suite())
+    suite.addTest(sitemap_files_test.suite())
+    suite.addTest(sitemaps_test.suite())
+    suite.addTest(spam_check_test.suite())
     suite.addTest(static_query_test.suite())
+    suite.addTest(templating_test.suite())
+    suite.addTest(thumbnails_test.suite())
     suite.addTest(upload_test.suite())
+    suite.addTest(uploads_test.suite())
     suite.addTest(uri_validator_test.suite())
     suite.addTest(url_for_test.suite())
     suite.addTest(user_example_test.suite())
+    suite.addTest(vulgarity_test.suite())
     suite.addTest(youtube_storage_test.suite())
     suite.addTest(xhtml_normalization_test.suite())
+    suite.addTest(xhtml_sanitizer_test.suite())
     return suite
 
 if __name__ == '__main__':
@@ -25,6 +25,8 @@ class ControllerTestCase(DBTestCase, RequestMixin):
         if user or not hasattr(request, 'perm'):
             self.set_authenticated_user(user, request.environ)
         self._inject_url_generator_for_request(request)
+        # set by PylonsApp, required by pylons.controllers.util.forward()
+        request.environ['pylons.controller'] = controller
         
         response_info = dict()
         def fake_start_response(status, headers, exc_info=None):
@@ -56,6 +56,8 @@ class DBTestCase(PythonicTestCase):
         pylons.cache._pop_object()
         try:
             pylons.app_globals.settings_cache.clear()
+            pylons.app_globals.fragment_cache.clear()
+            pylons.app_globals.fragment_versions.clear()
             pylons.app_globals._pop_object()
         except TypeError:
             # The test might have not set up any app_globals
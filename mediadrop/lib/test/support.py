@@ -16,6 +16,7 @@ import pylons
 from pylons.controllers.util import Request, Response
 from pylons.util import AttribSafeContextObj, ContextObj
 from routes.util import URLGenerator
+from sqlalchemy.pool import StaticPool
 import tw
 from tw.mods.pylonshf import PylonsHostFramework
 from webob.request import environ_from_url
@@ -41,6 +42,9 @@ def setup_environment_and_database(env_dir=None, enabled_plugins=''):
     app_config = {
         'plugins': enabled_plugins,
         'sqlalchemy.url': 'sqlite://',
+        # background workers must see the same in-memory database
+        'sqlalchemy.poolclass': StaticPool,
+        'sqlalchemy.connect_args': {'check_same_thread': False},
         'layout_template': 'layout',
         'external_template': 'false',
         'image_dir': os.path.join(env_dir, 'images'),
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from sqlalchemy import event
+
+from mediadrop.lib.api_serializer import MediaSerializer, parse_fields
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.test.request_mixin import RequestMixin
+from mediadrop.model import Category, Comment, DBSession, Media, Podcast
+from mediadrop.model.authors import Author, AuthorWithIP
+
+
+class MediaSerializerTest(DBTestCase, RequestMixin):
+    def setUp(self):
+        super(MediaSerializerTest, self).setUp()
+        self.init_fake_request()
+
+    def _podcast(self):
+        podcast = Podcast()
+        podcast.slug = u'show'
+        podcast.title = u'Show'
+        podcast.author = Author(u'Joe', u'joe@site.example')
+        DBSession.add(podcast)
+        DBSession.flush()
+        return podcast
+
+    def _comment(self, media, publishable):
+        comment = Comment()
+        comment.author = AuthorWithIP(u'Joe', u'joe@site.example', '127.0.0.1')
+        comment.subject = u'Re: %s' % media.title
+        comment.body = u'Nice video!'
+        comment.publishable = publishable
+        media.comments.append(comment)
+
+    def _count_queries(self, func):
+        statements = []
+        def count(conn, cursor, statement, *args):
+            if statements is not None:
+                statements.append(statement)
+        # SQLAlchemy 0.7 can not remove listeners, disable it instead
+        event.listen(DBSession.get_bind(), 'before_cursor_execute', count)
+        try:
+            func()
+            return len(statements)
+        finally:
+            statements = None
+
+    def test_serializes_related_data(self):
+        media = Media.example(title=u'Episode')
+        media.podcast = self._podcast()
+        media.categories.append(Category.example(name=u'Music'))
+        self._comment(media, publishable=True)
+        self._comment(media, publishable=False)
+        other = Media.example(title=u'Other')
+        DBSession.flush()
+
+        info, other_info = MediaSerializer().serialize([media, other])
+        assert_equals(media.id, info['id'])
+        assert_equals(u'show', info['podcast'])
+        assert_equals(u'http://mediadrop.example:80/podcasts/show/episode',
+                      info['url'])
+        assert_equals({u'music': u'Music'}, info['categories'])
+        assert_equals(1, info['comment_count'])
+        assert_equals('http://mediadrop.example:80/images/media/%dl.jpg' % media.id,
+                      info['thumbs']['l']['url'])
+        assert_not_contains('embed', info)
+
+        assert_none(other_info['podcast'])
+        assert_equals(u'http://mediadrop.example:80/media/other', other_info['url'])
+        assert_equals({}, other_info['categories'])
+        assert_equals(0, other_info['comment_count'])
+
+    def test_loads_only_requested_fields(self):
+        media = Media.example()
+        serializer = MediaSerializer(parse_fields(u'id, title'))
+        assert_equals([dict(id=media.id, title=media.title)],
+                      serializer.serialize([media]))
+        assert_raises(ValueError, lambda: parse_fields(u'id,secret'))
+
+    def test_query_count_does_not_depend_on_number_of_media(self):
+        category = Category.example()
+        media_list = []
+        for i in range(5):
+            media = Media.example()
+            media.categories.append(category)
+            media_list.append(media)
+        DBSession.flush()
+
+        serializer = MediaSerializer()
+        two = self._count_queries(lambda: serializer.serialize(media_list[:2]))
+        five = self._count_queries(lambda: serializer.serialize(media_list))
+        assert_equals(two, five)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(MediaSerializerTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import threading
+import time
+
+import pylons
+from pylons.controllers.util import Response
+
+from mediadrop.lib.decorators import beaker_cache, cache_statistics
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.test.request_mixin import RequestMixin
+
+
+class CachedController(object):
+    def __init__(self, duration=0):
+        self.calls = 0
+        self.duration = duration
+
+    @beaker_cache(key=None, expire=60, stale_expire=60, jitter=0)
+    def action(self):
+        self.calls += 1
+        time.sleep(self.duration)
+        return u'response %d' % self.calls
+
+
+class BeakerCacheTest(DBTestCase, RequestMixin):
+    def setUp(self):
+        super(BeakerCacheTest, self).setUp()
+        self.init_fake_request()
+        self.cache = pylons.app_globals.cache.get_cache(
+            '%s.CachedController' % __name__)
+        self.cache.clear()
+        cache_statistics.actions.clear()
+        self.controller = CachedController()
+
+    def in_thread(self, func):
+        app_globals = pylons.app_globals._current_obj()
+        request = pylons.request._current_obj()
+        def run():
+            pylons.app_globals._push_object(app_globals)
+            pylons.request._push_object(request)
+            pylons.response._push_object(Response())
+            try:
+                func()
+            finally:
+                pylons.response._pop_object()
+                pylons.request._pop_object()
+                pylons.app_globals._pop_object()
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def expire_value(self, key='action', namespace=None):
+        cache = self.cache
+        if namespace is not None:
+            cache = pylons.app_globals.cache.get_cache(namespace)
+        value = cache.get(key)
+        value['fresh_until'] = time.time() - 1
+        cache.put(key, value, expiretime=120)
+
+    def stats(self):
+        return dict(cache_statistics.summary())['%s.CachedController.action' % __name__]
+
+    def test_caches_response(self):
+        assert_equals(u'response 1', self.controller.action())
+        assert_equals(u'response 1', self.controller.action())
+        stats = self.stats()
+        assert_equals(1, stats['misses'])
+        assert_equals(1, stats['hits'])
+        assert_equals(1, stats['regenerations'])
+
+    def test_serves_stale_response_while_another_request_regenerates_it(self):
+        self.controller.action()
+        self.expire_value()
+        lock = self.cache.namespace.get_creation_lock('action')
+        locked, release = threading.Event(), threading.Event()
+        def hold_lock():
+            lock.acquire()
+            locked.set()
+            release.wait()
+            lock.release()
+        thread = self.in_thread(hold_lock)
+        locked.wait()
+        try:
+            assert_equals(u'response 1', self.controller.action())
+        finally:
+            release.set()
+            thread.join()
+        assert_equals(1, self.stats()['stale'])
+
+        assert_equals(u'response 2', self.controller.action())
+        assert_equals(u'response 2', self.controller.action())
+
+    def test_regenerates_missing_value_only_once(self):
+        self.controller.duration = 0.2
+        threads = [self.in_thread(self.controller.action) for i in range(3)]
+        for thread in threads:
+            thread.join()
+        assert_equals(1, self.controller.calls)
+        assert_equals(1, self.stats()['regenerations'])
+        assert_equals(3, self.stats()['misses'])
+
+    def test_jitter_expires_values_earlier(self):
+        @beaker_cache(key=None, expire=100, jitter=0.5)
+        def action():
+            return u'response'
+        action()
+        cache = pylons.app_globals.cache.get_cache(__name__)
+        fresh_for = cache.get('action')['fresh_until'] - time.time()
+        assert_true(50 <= fresh_for <= 100, message=repr(fresh_for))
+
+    def test_caches_only_small_streamed_responses(self):
+        chunks = ['<rss>', '<item/>' * 3, '</rss>']
+        calls = []
+        @beaker_cache(key=None, expire=60, max_size=40)
+        def streamed():
+            calls.append(1)
+            return (chunk for chunk in chunks)
+        assert_equals(''.join(chunks), streamed())
+        assert_equals(''.join(chunks), streamed())
+        assert_length(1, calls)
+
+        chunks[1] = '<item/>' * 10
+        self.expire_value(streamed.__name__, __name__)
+        response = streamed()
+        assert_false(isinstance(response, basestring))
+        assert_equals(''.join(chunks), ''.join(response))
+        ''.join(streamed())
+        assert_length(3, calls)
+
+    def test_caches_results_which_are_not_strings(self):
+        calls = []
+        @beaker_cache(key=None, expire=60)
+        def json_action():
+            calls.append(1)
+            return dict(media=[1, 2])
+        assert_equals(dict(media=[1, 2]), json_action())
+        assert_equals(dict(media=[1, 2]), json_action())
+        assert_length(1, calls)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(BeakerCacheTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
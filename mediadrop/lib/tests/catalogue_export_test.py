@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from datetime import datetime
+
+import simplejson
+
+from mediadrop.lib.catalogue_export import (export_lines, export_media,
+    parse_modified_since)
+from mediadrop.lib.cli_commands import set_base_url
+from mediadrop.lib.storage.api import add_new_media_file
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.test.request_mixin import RequestMixin
+from mediadrop.model import DBSession, Media
+
+
+class CatalogueExportTest(DBTestCase, RequestMixin):
+    def setUp(self):
+        super(CatalogueExportTest, self).setUp()
+        self.init_fake_request()
+
+    def publish_media(self, title, modified_on=datetime(2013, 1, 1)):
+        media = Media.example(title=title, reviewed=True, encoded=True,
+            publishable=True, publish_on=datetime(2013, 1, 1))
+        DBSession.flush()
+        media.modified_on = modified_on
+        DBSession.commit()
+        return media
+
+    def test_exports_all_media_in_batches(self):
+        media_ids = [self.publish_media(u'Media %d' % i).id for i in range(5)]
+        Media.example(title=u'Draft')
+        DBSession.commit()
+
+        exported = list(export_media(batch_size=2))
+        assert_equals(media_ids, [info['id'] for info in exported][-5:])
+        assert_not_contains(u'Draft', [info['title'] for info in exported])
+        assert_equals([], exported[-1]['files'])
+
+        chunks = list(export_lines(batch_size=2))
+        lines = ''.join(chunks).splitlines()
+        assert_length(len(exported), lines)
+        assert_equals(len(exported) // 2 + len(exported) % 2, len(chunks))
+        assert_equals(exported[-1], simplejson.loads(lines[-1]))
+
+    def test_exports_only_media_modified_since_the_given_date(self):
+        old = self.publish_media(u'Old', modified_on=datetime(2013, 1, 1))
+        new = self.publish_media(u'New', modified_on=datetime(2013, 3, 1))
+        with_new_file = self.publish_media(u'New file',
+                                           modified_on=datetime(2013, 1, 1))
+        add_new_media_file(with_new_file, url=u'http://site.example/new.mp4')
+        with_new_file.modified_on = datetime(2013, 1, 1)
+        DBSession.commit()
+
+        since = parse_modified_since(u'2013-02-01')
+        exported = [info['id'] for info in export_media(since)]
+        assert_not_contains(old.id, exported)
+        assert_equals([new.id, with_new_file.id], exported[-2:])
+        assert_raises(ValueError, lambda: parse_modified_since(u'February'))
+
+    def test_uses_the_given_base_url(self):
+        media = self.publish_media(u'Public')
+        # URLs for the fake request are cached already
+        list(export_media())
+        set_base_url('https://videos.site.example/mediadrop/')
+        info = list(export_media())[-1]
+        assert_equals(media.id, info['id'])
+        assert_equals('https://videos.site.example/mediadrop/media/public',
+                      info['url'])
+        assert_raises(ValueError, lambda: set_base_url('videos.site.example'))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CatalogueExportTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
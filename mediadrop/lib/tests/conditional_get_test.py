@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from datetime import datetime, timedelta
+
+import pylons
+from webob.exc import HTTPNotModified
+
+from mediadrop.lib.conditional_get import (abort_if_not_modified,
+    check_conditional_get, media_validators)
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.test.request_mixin import RequestMixin
+from mediadrop.model import DBSession, Media
+
+
+class ConditionalGetTest(DBTestCase, RequestMixin):
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        self.request = self.init_fake_request()
+        self.set_authenticated_user(None)
+        self.last_modified = datetime(2013, 5, 1, 12, 30)
+
+    def check(self, **kwargs):
+        check_conditional_get(self.last_modified, ('data', ), **kwargs)
+        return pylons.response
+
+    def test_sets_validators(self):
+        response = self.check(max_age=180)
+        assert_not_none(response.etag)
+        assert_not_none(response.last_modified)
+        assert_equals('public, max-age=180', response.headers['Cache-Control'])
+        assert_not_contains('Pragma', response.headers)
+
+    def test_keeps_no_cache_without_max_age(self):
+        pylons.response.headers['Cache-Control'] = 'no-cache'
+        assert_equals('no-cache', self.check().headers['Cache-Control'])
+
+    def test_aborts_if_etag_matches(self):
+        etag = self.check().etag
+        self.request.environ['HTTP_IF_NONE_MATCH'] = '"%s"' % etag
+        assert_raises(HTTPNotModified, self.check)
+
+        self.request.environ['HTTP_IF_NONE_MATCH'] = '"other"'
+        self.check()
+
+    def test_aborts_if_not_modified_since(self):
+        last_modified = self.check().headers['Last-Modified']
+        self.request.environ['HTTP_IF_MODIFIED_SINCE'] = last_modified
+        assert_raises(HTTPNotModified, self.check)
+
+        self.last_modified += timedelta(seconds=1)
+        self.check()
+
+    def test_etag_takes_precedence_over_modification_date(self):
+        response = self.check()
+        self.request.environ['HTTP_IF_MODIFIED_SINCE'] = \
+            response.headers['Last-Modified']
+        self.request.environ['HTTP_IF_NONE_MATCH'] = '"other"'
+        self.check()
+
+    def test_can_abort_with_restored_headers(self):
+        abort_if_not_modified()
+        pylons.response.etag = 'abc'
+        self.request.environ['HTTP_IF_NONE_MATCH'] = '"abc"'
+        assert_raises(HTTPNotModified, abort_if_not_modified)
+
+    def published_media(self):
+        media = Media.example(reviewed=True, encoded=True, publishable=True,
+                              publish_on=datetime(2013, 1, 1))
+        DBSession.flush()
+        return media
+
+    def test_media_validators_detect_changes(self):
+        media = self.published_media()
+        query = Media.query.filter(Media.author_name == u'Joe').published()
+        validators = media_validators(query)
+        assert_equals(validators, media_validators(query))
+        assert_equals(media.modified_on, validators[0])
+
+        Media.example()
+        # unpublished media are not part of the query
+        assert_equals(validators, media_validators(query))
+
+        DBSession.delete(media)
+        DBSession.flush()
+        assert_not_equals(validators, media_validators(query))
+
+    def test_media_validators_include_counters_on_request(self):
+        self.published_media().increment_views()
+        query = Media.query.published()
+        validators = media_validators(query, counters=True)
+        assert_equals(validators, media_validators(query, counters=True))
+
+        Media.query.published().first().increment_views()
+        assert_not_equals(validators, media_validators(query, counters=True))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ConditionalGetTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,102 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import os
+import tempfile
+
+from webob import Request
+
+from mediadrop.lib.fileapp import FileApp, parse_range_header
+from mediadrop.lib.test.pythonic_testcase import *
+
+
+class ParseRangeHeaderTest(PythonicTestCase):
+    def test_can_parse_simple_ranges(self):
+        assert_equals([(0, 500)], parse_range_header('bytes=0-499', 1000))
+        assert_equals([(500, 1000)], parse_range_header('bytes=500-', 1000))
+        assert_equals([(900, 1000)], parse_range_header('bytes=-100', 1000))
+        assert_equals([(0, 1000)], parse_range_header('bytes=0-5000', 1000))
+
+    def test_merges_overlapping_ranges(self):
+        assert_equals([(0, 300), (500, 600)],
+            parse_range_header('bytes=500-599,0-199,100-299', 1000))
+
+    def test_returns_none_for_invalid_headers(self):
+        assert_none(parse_range_header('items=0-10', 1000))
+        assert_none(parse_range_header('bytes=10-5', 1000))
+        assert_none(parse_range_header('bytes=a-b', 1000))
+
+    def test_returns_empty_list_for_unsatisfiable_ranges(self):
+        assert_equals([], parse_range_header('bytes=2000-', 1000))
+
+
+class FileAppTest(PythonicTestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        self.content = ''.join(chr(i % 256) for i in range(10000))
+        os.write(fd, self.content)
+        os.close(fd)
+        self.app = FileApp(self.filename, content_type='video/mp4', chunk_size=1000)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def _get(self, **headers):
+        request = Request.blank('/')
+        request.headers.update(headers)
+        return request.get_response(self.app)
+
+    def test_can_serve_complete_file(self):
+        response = self._get()
+        assert_equals(200, response.status_int)
+        assert_equals('bytes', response.headers['Accept-Ranges'])
+        assert_equals(self.content, response.body)
+
+    def test_can_serve_single_range(self):
+        response = self._get(Range='bytes=100-199')
+        assert_equals(206, response.status_int)
+        assert_equals('bytes 100-199/10000', response.headers['Content-Range'])
+        assert_equals(self.content[100:200], response.body)
+
+        response = self._get(Range='bytes=9000-')
+        assert_equals(self.content[9000:], response.body)
+
+    def test_can_serve_multiple_ranges(self):
+        response = self._get(Range='bytes=0-9,5000-5009')
+        assert_equals(206, response.status_int)
+        content_type = response.headers['Content-Type']
+        assert_true(content_type.startswith('multipart/byteranges; boundary='))
+        assert_equals(int(response.headers['Content-Length']), len(response.body))
+        assert_contains(self.content[0:10], response.body)
+        assert_contains('Content-Range: bytes 5000-5009/10000', response.body)
+        assert_contains(self.content[5000:5010], response.body)
+
+    def test_rejects_unsatisfiable_ranges(self):
+        response = self._get(Range='bytes=20000-')
+        assert_equals(416, response.status_int)
+        assert_equals('bytes */10000', response.headers['Content-Range'])
+
+    def test_answers_conditional_requests_with_304(self):
+        etag = self._get().headers['ETag']
+        last_modified = self._get().headers['Last-Modified']
+
+        assert_equals(304, self._get(**{'If-None-Match': etag}).status_int)
+        assert_equals(304, self._get(**{'If-Modified-Since': last_modified}).status_int)
+        assert_equals(200, self._get(**{'If-None-Match': '"foo"'}).status_int)
+
+    def test_ignores_range_if_validator_does_not_match(self):
+        response = self._get(Range='bytes=0-9', **{'If-Range': '"outdated"'})
+        assert_equals(200, response.status_int)
+        assert_equals(self.content, response.body)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ParseRangeHeaderTest))
+    suite.addTest(unittest.makeSuite(FileAppTest))
+    return suite
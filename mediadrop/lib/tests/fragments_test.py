@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import threading
+
+from genshi.core import Markup
+import pylons
+from pylons import config
+
+from mediadrop.lib.fragments import cached_fragment, invalidate_fragments
+from mediadrop.lib.players import AbstractFlashPlayer, FlowPlayer, media_player
+from mediadrop.lib.storage.api import add_new_media_file
+from mediadrop.lib.storage.localfiles import LocalFileStorage
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.test.request_mixin import RequestMixin
+from mediadrop.lib.util import pop_app_config, push_app_config
+from mediadrop.model import DBSession, Media, MediaFile, Setting
+
+
+class FragmentCacheTest(DBTestCase, RequestMixin):
+    def setUp(self):
+        super(FragmentCacheTest, self).setUp()
+        self.init_fake_request()
+        self.media = Media.example()
+        self.renderings = 0
+
+    def render(self):
+        self.renderings += 1
+        return u'<p>%d</p>' % self.renderings
+
+    def fragment(self, *args, **kwargs):
+        return cached_fragment('test', self.media, self.render, *args, **kwargs)
+
+    def test_caches_rendered_fragments(self):
+        assert_equals(Markup(u'<p>1</p>'), self.fragment())
+        assert_equals(Markup(u'<p>1</p>'), self.fragment())
+        assert_equals(u'<p>2</p>', self.fragment('other-args'))
+        assert_isinstance(self.fragment(), Markup)
+
+    def test_renders_fragment_again_if_state_changed(self):
+        assert_equals(u'<p>1</p>', self.fragment(state=1))
+        assert_equals(u'<p>1</p>', self.fragment(state=1))
+        assert_equals(u'<p>2</p>', self.fragment(state=2))
+        assert_length(1, pylons.app_globals.fragment_cache.namespace.keys())
+
+    def test_can_invalidate_fragments(self):
+        self.fragment()
+        invalidate_fragments(self.media.id)
+        assert_equals(u'<p>2</p>', self.fragment())
+        invalidate_fragments()
+        assert_equals(u'<p>3</p>', self.fragment())
+
+    def test_invalidates_fragments_when_media_is_changed(self):
+        self.fragment()
+        add_new_media_file(self.media, url=u'http://site.example/videos.mp4')
+        DBSession.flush()
+        assert_equals(u'<p>2</p>', self.fragment())
+
+        self.media.title = u'New Title'
+        DBSession.flush()
+        assert_equals(u'<p>3</p>', self.fragment())
+
+    def test_can_invalidate_fragments_in_background_workers(self):
+        self.fragment()
+        def worker():
+            push_app_config(self.pylons_config)
+            try:
+                invalidate_fragments(self.media.id)
+            finally:
+                pop_app_config(self.pylons_config)
+        # Pylons registers the app config only for requests
+        config.pop_process_config(self.pylons_config)
+        try:
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        finally:
+            config.push_process_config(self.pylons_config)
+        assert_equals(u'<p>2</p>', self.fragment())
+
+    def test_invalidates_fragments_when_settings_are_changed(self):
+        self.fragment()
+        setting = Setting.query.filter(Setting.key == u'appearance_show_like').one()
+        setting.value = u''
+        DBSession.flush()
+        assert_equals(u'<p>2</p>', self.fragment())
+
+    def test_does_not_cache_if_disabled(self):
+        pylons.app_globals.fragment_cache_expire = 0
+        self.fragment()
+        assert_equals(u'<p>2</p>', self.fragment())
+
+    def test_caches_rendered_player(self):
+        AbstractFlashPlayer.register(FlowPlayer)
+        FlowPlayer.inject_in_db(enable_player=True)
+        add_new_media_file(self.media, url=u'http://site.example/videos.mp4')
+        DBSession.flush()
+        player = media_player(self.media)
+        assert_isinstance(player, Markup)
+        assert_contains(u'id="%s-player-wrapper"' % self.media.slug, player)
+        assert_equals(player, media_player(self.media))
+        assert_not_equals(player, media_player(self.media, show_like=False))
+
+    def test_does_not_cache_player_with_signed_urls(self):
+        AbstractFlashPlayer.register(FlowPlayer)
+        FlowPlayer.inject_in_db(enable_player=True)
+        storage = DBSession.query(LocalFileStorage).one()
+        storage._data.update({
+            'secure_link_url': u'http://cdn.example/secure',
+            'secure_link_secret': u'sikrit',
+        })
+        media_file = MediaFile()
+        media_file.media = self.media
+        media_file.type = u'video'
+        media_file.container = u'mp4'
+        media_file.display_name = u'foo.mp4'
+        media_file.unique_id = u'%d-foo.mp4' % self.media.id
+        media_file.storage = storage
+        DBSession.flush()
+        self.set_authenticated_user(None)
+
+        player = media_player(self.media)
+        assert_contains(u'cdn.example/secure', player)
+        storage._data['secure_link_secret'] = u'rotated'
+        assert_not_equals(player, media_player(self.media))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(FragmentCacheTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -24,10 +24,27 @@ class DefaultPageTitleTest(DBTestCase, RequestMixin):
         assert_equals('MediaDrop', default_page_title())
 
 
+class FilterVulgarityTest(DBTestCase, RequestMixin):
+    def setUp(self):
+        super(FilterVulgarityTest, self).setUp()
+        self.request = self.init_fake_request()
+
+    def test_filters_words_from_settings(self):
+        from mediadrop.lib.helpers import filter_vulgarity
+        self.request.settings['vulgarity_filtered_words'] = u'darn, heck'
+        assert_equals(u'oh **** ****', filter_vulgarity(u'oh heck DARN'))
+
+    def test_returns_text_if_no_words_are_configured(self):
+        from mediadrop.lib.helpers import filter_vulgarity
+        self.request.settings['vulgarity_filtered_words'] = u''
+        assert_equals(u'oh heck', filter_vulgarity(u'oh heck'))
+
+
 import unittest
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(DefaultPageTitleTest))
+    suite.addTest(unittest.makeSuite(FilterVulgarityTest))
     return suite
 
 if __name__ == '__main__':
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import asyncore
+import os
+import shutil
+import smtpd
+import socket
+import tempfile
+import threading
+import time
+
+from mediadrop.lib.mail_queue import MailQueue, MailSpool, SMTPConnection
+from mediadrop.lib.test.pythonic_testcase import *
+
+
+class RecordingSMTPServer(smtpd.SMTPServer):
+    """Stand-in SMTP server which stores all received messages."""
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.connections = 0
+        self.reply = None
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        if self.reply:
+            return self.reply
+        self.messages.append((mailfrom, rcpttos, data))
+
+
+class MailQueueTest(PythonicTestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.server = RecordingSMTPServer()
+        self._stop = threading.Event()
+        self.server_thread = threading.Thread(target=self._serve)
+        self.server_thread.start()
+        self.queue = self._queue('127.0.0.1:%d' % self.server.port)
+
+    def tearDown(self):
+        self.queue.connection.close()
+        self._stop.set()
+        self.server_thread.join()
+        asyncore.close_all()
+        shutil.rmtree(self.spool_dir)
+
+    def _serve(self):
+        while not self._stop.is_set():
+            asyncore.loop(timeout=0.01, count=1)
+
+    def _queue(self, server):
+        return MailQueue(MailSpool(self.spool_dir), SMTPConnection(server),
+                         retry_delay=60, start_worker=False)
+
+    def _put(self, to_addr=u'admin@site.example'):
+        self.queue.put(u'noreply@site.example', [to_addr],
+                       u'Subject: Hi\n\nNew comment by Jürgen\n')
+
+    def _files(self, state):
+        return os.listdir(self.queue.spool.dirs[state])
+
+    def test_delivers_queued_messages(self):
+        self._put()
+        assert_equals(1, self.queue.process())
+
+        assert_length(1, self.server.messages)
+        mailfrom, rcpttos, data = self.server.messages[0]
+        assert_equals('noreply@site.example', mailfrom)
+        assert_equals(['admin@site.example'], rcpttos)
+        assert_true('Jürgen' in data)
+        assert_equals([], self._files('new'))
+        assert_equals([], self._files('sending'))
+
+    def test_reuses_the_connection(self):
+        for i in range(5):
+            self._put(u'user%d@site.example' % i)
+        assert_equals(5, self.queue.process())
+        self._put()
+        assert_equals(1, self.queue.process())
+
+        assert_length(6, self.server.messages)
+        assert_equals(1, self.server.connections)
+
+    def test_reconnects_after_server_closed_the_connection(self):
+        self._put()
+        self.queue.process()
+        # simulate an idle timeout on the server side
+        self.queue.connection.smtp.sock.shutdown(socket.SHUT_RDWR)
+        self._put()
+        assert_equals(1, self.queue.process())
+        assert_length(2, self.server.messages)
+
+    def test_retries_later_if_the_server_is_unreachable(self):
+        unused_port = self.server.port
+        self.queue.connection.close()
+        self.server.close()
+        self.queue = self._queue('127.0.0.1:%d' % unused_port)
+        self._put()
+        self._put()
+        assert_equals(0, self.queue.process())
+
+        assert_length(2, self._files('new'))
+        # The first message is retried in a minute, the second one was not
+        # sent at all so it is due immediately.
+        due = self.queue.spool.claim(10)
+        assert_length(1, due)
+        name, entry = due[0]
+        assert_equals(0, entry['attempts'])
+
+    def test_gives_up_on_permanent_errors(self):
+        self.server.reply = '550 No such user'
+        self._put()
+        assert_equals(0, self.queue.process())
+
+        assert_equals([], self._files('new'))
+        assert_length(1, self._files('failed'))
+
+    def test_recovers_messages_of_crashed_workers(self):
+        self._put()
+        name, entry = self.queue.spool.claim(1)[0]
+        path = os.path.join(self.queue.spool.dirs['sending'], name)
+        an_hour_ago = time.time() - 3600
+        os.utime(path, (an_hour_ago, an_hour_ago))
+
+        self.queue.spool.recover(max_age=60)
+        assert_equals(1, self.queue.process())
+
+    def test_does_not_recover_fresh_claims_of_old_messages(self):
+        self._put()
+        name = self._files('new')[0]
+        an_hour_ago = time.time() - 3600
+        os.utime(os.path.join(self.queue.spool.dirs['new'], name),
+                 (an_hour_ago, an_hour_ago))
+        self.queue.spool.claim(1)
+
+        self.queue.spool.recover(max_age=60)
+        assert_equals([name], self._files('sending'))
+        assert_equals([], self._files('new'))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(MailQueueTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
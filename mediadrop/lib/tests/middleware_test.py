@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import gzip
+from StringIO import StringIO
+
+from paste.registry import StackedObjectProxy
+from paste.response import header_value
+
+from mediadrop.config.middleware import RegistryManager, setup_gzip_middleware
+from mediadrop.lib.templating import STREAMING_RESPONSE_KEY
+from mediadrop.lib.test.pythonic_testcase import *
+
+
+greeting = StackedObjectProxy(name='greeting')
+
+class StreamingResponseTest(PythonicTestCase):
+    def call(self, app, accept_encoding='gzip'):
+        environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': accept_encoding}
+        response = []
+        def start_response(status, headers, exc_info=None):
+            response[:] = [status, headers]
+        app_iter = app(environ, start_response)
+        try:
+            body = list(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        return response[1], body
+
+    def streaming_app(self, chunks):
+        def app(environ, start_response):
+            environ['paste.registry'].register(greeting, u'hello')
+            environ[STREAMING_RESPONSE_KEY] = True
+            start_response('200 OK', [('Content-Type', 'application/rss+xml')])
+            return ('%s %d ' % (greeting._current_obj(), i)
+                    for i in range(chunks))
+        return app
+
+    def test_keeps_registered_globals_for_streamed_responses(self):
+        headers, body = self.call(RegistryManager(self.streaming_app(3)))
+        assert_equals(['hello 0 ', 'hello 1 ', 'hello 2 '], body)
+        assert_raises(TypeError, greeting._current_obj)
+
+    def test_compresses_streamed_responses_in_chunks(self):
+        app = setup_gzip_middleware(RegistryManager(self.streaming_app(1000)), {})
+        headers, body = self.call(app)
+        assert_equals('gzip', header_value(headers, 'content-encoding'))
+        assert_none(header_value(headers, 'content-length'))
+        assert_true(len(body) > 1)
+        expected = ''.join('hello %d ' % i for i in range(1000))
+        assert_equals(expected, gzip.GzipFile(fileobj=StringIO(''.join(body))).read())
+
+    def test_sets_content_length_for_complete_responses(self):
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/html')])
+            return ['<p>Hello</p>']
+        headers, body = self.call(setup_gzip_middleware(app, {}))
+        assert_equals('gzip', header_value(headers, 'content-encoding'))
+        assert_equals(str(len(''.join(body))), header_value(headers, 'content-length'))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(StreamingResponseTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
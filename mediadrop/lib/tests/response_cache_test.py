@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from beaker.cache import CacheManager
+from pylons import config
+
+from mediadrop.lib.response_cache import (CACHE_OPTIONS_KEY, ResponseCache,
+    ResponseCacheMiddleware)
+from mediadrop.lib.spam_check import SpamCheckJob, SpamCheckQueue
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.model import AuthorWithIP, Category, Comment, DBSession, Media
+
+
+class ResponseCacheTest(DBTestCase):
+    def setUp(self):
+        super(ResponseCacheTest, self).setUp()
+        self.cache = ResponseCache(CacheManager(), type='memory')
+        # memory caches are shared by all cache managers in the process
+        self.cache.responses.clear()
+        self.cache.tag_versions.clear()
+        self.middleware = ResponseCacheMiddleware(self.app, self.cache,
+            language=lambda: 'en', bypass_cookies=('authtkt',))
+        self.calls = 0
+        self.tags = ('media', )
+        self.response_headers = [('Content-Type', 'text/html')]
+
+    def app(self, environ, start_response):
+        self.calls += 1
+        if self.tags is not None:
+            self.cache.mark(environ, self.tags)
+        start_response('200 OK', list(self.response_headers))
+        return ['page %d' % self.calls]
+
+    def request(self, path='/media', method='GET', cookie=None):
+        environ = {
+            'REQUEST_METHOD': method,
+            'wsgi.url_scheme': 'http',
+            'HTTP_HOST': 'site.example',
+            'PATH_INFO': path,
+        }
+        if cookie:
+            environ['HTTP_COOKIE'] = cookie
+        response = []
+        def start_response(status, headers, exc_info=None):
+            response[:] = [status, headers]
+        body = ''.join(self.middleware(environ, start_response))
+        assert_equals('200 OK', response[0])
+        return body
+
+    def test_serves_cached_responses(self):
+        assert_equals('page 1', self.request())
+        assert_equals('page 1', self.request())
+        assert_equals('page 2', self.request('/media/other'))
+        assert_equals(1, self.cache.hits)
+        assert_equals(2, self.cache.misses)
+        assert_equals(1.0 / 3, self.cache.hit_ratio)
+
+    def test_does_not_cache_unmarked_responses(self):
+        self.tags = None
+        assert_equals('page 1', self.request())
+        assert_equals('page 2', self.request())
+
+    def test_bypasses_cache_for_logged_in_users_and_posts(self):
+        self.request()
+        assert_equals('page 2', self.request(cookie='foo=1; authtkt=abc'))
+        assert_equals('page 3', self.request(method='POST'))
+        assert_equals('page 1', self.request(cookie='authtkt_foo=1'))
+
+    def test_does_not_cache_responses_which_set_cookies(self):
+        self.response_headers.append(('Set-Cookie', 'foo=bar'))
+        self.request()
+        assert_equals('page 2', self.request())
+
+    def test_can_purge_responses_by_tag(self):
+        self.request()
+        self.cache.purge('comments-1')
+        assert_equals('page 1', self.request())
+        self.cache.purge('media')
+        assert_equals('page 2', self.request())
+
+    def test_records_tag_versions_before_rendering(self):
+        environ = {}
+        self.cache.mark(environ, ('media', ))
+        assert_equals(set(['media', 'all']),
+                      set(environ[CACHE_OPTIONS_KEY]['tags']))
+
+    def test_purges_responses_when_data_is_changed(self):
+        app_globals = config['pylons.app_globals']
+        app_globals.response_cache = self.cache
+        try:
+            self.tags = ('categories', )
+            self.request()
+            Category.example()
+            DBSession.flush()
+            assert_equals('page 2', self.request())
+        finally:
+            app_globals.response_cache = None
+
+    def test_purges_responses_when_background_workers_change_data(self):
+        app_globals = config['pylons.app_globals']
+        app_globals.response_cache = self.cache
+        media = Media.example()
+        comment = Comment()
+        comment.author = AuthorWithIP(u'Joe', u'joe@site.example', '127.0.0.1')
+        comment.subject = u'Re: %s' % media.title
+        comment.body = u'Nice video!'
+        media.comments.append(comment)
+        DBSession.commit()
+        self.tags = ('comments-%d' % media.id, )
+        queue = SpamCheckQueue()
+        # Pylons registers the app config only for requests, the worker
+        # threads would see the empty default config of the process.
+        config.pop_process_config(self.pylons_config)
+        config.push_thread_config(self.pylons_config)
+        try:
+            self.request()
+            queue.put(SpamCheckJob(comment.id, {}))
+            queue.join()
+            assert_equals('page 2', self.request())
+        finally:
+            config.pop_thread_config(self.pylons_config)
+            config.push_process_config(self.pylons_config)
+            app_globals.response_cache = None
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ResponseCacheTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from datetime import datetime
+import os
+
+import pylons
+
+from mediadrop.lib.sitemap_files import SitemapFiles
+from mediadrop.lib.storage.api import add_new_media_file
+from mediadrop.lib.storage.localfiles import LocalFileStorage
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.test.request_mixin import RequestMixin
+from mediadrop.model import DBSession, Media, MediaFile
+
+
+class SitemapFilesTest(DBTestCase, RequestMixin):
+    def setUp(self):
+        super(SitemapFilesTest, self).setUp()
+        self.init_fake_request()
+        self.set_authenticated_user(None)
+        self.directory = os.path.join(self.env_dir, 'sitemaps')
+        self.files = SitemapFiles(self.directory, shard_size=5)
+
+    def publish_media(self, title):
+        media = Media.example(title=title, reviewed=True, encoded=True,
+            publishable=True, publish_on=datetime(2013, 1, 1))
+        add_new_media_file(media, url=u'http://site.example/videos.mp4')
+        DBSession.commit()
+        # add_new_media_file appends the file to media.files twice
+        DBSession.refresh(media)
+        return media
+
+    def read(self, filename):
+        return open(self.files.path(filename), 'rb').read()
+
+    def test_writes_sharded_sitemaps_and_feed(self):
+        # media 2-4 are in shard 0
+        self.publish_media(u'Sharded')
+
+        assert_equals(2, self.files.update())
+        assert_equals(
+            set(['manifest.json', 'sitemap.xml', 'mrss.xml', 'sitemap0.xml',
+                 'mrss0.xml', 'sitemap1.xml', 'mrss1.xml']),
+            set(os.listdir(self.directory)))
+        index = self.read('sitemap.xml')
+        assert_contains('/sitemap0.xml</loc>', index)
+        assert_contains('/sitemap1.xml</loc>', index)
+        assert_not_contains('/sitemap2.xml</loc>', index)
+        assert_contains('/media/sharded</loc>', self.read('sitemap1.xml'))
+        assert_not_contains('/media/sharded</loc>', self.read('sitemap0.xml'))
+        assert_contains('<title>Sharded</title>', self.read('mrss.xml'))
+        assert_equals(4, self.read('mrss.xml').count('<item>'))
+
+    def test_renders_only_changed_shards(self):
+        media = self.publish_media(u'Changed')
+        self.files.update()
+        assert_equals(0, self.files.update())
+
+        media.title = u'Changed again'
+        DBSession.commit()
+        assert_equals(1, self.files.update())
+        assert_contains('<title>Changed again</title>', self.read('mrss.xml'))
+
+        media.publish_until = datetime(2013, 2, 1)
+        DBSession.commit()
+        assert_equals(0, self.files.update())
+        assert_false(os.path.exists(self.files.path('sitemap1.xml')))
+        assert_not_contains('/sitemap1.xml</loc>', self.read('sitemap.xml'))
+        assert_not_contains('<title>Changed again</title>',
+                            self.read('mrss.xml'))
+
+    def test_links_to_the_base_url(self):
+        self.publish_media(u'Linked')
+        files = SitemapFiles(self.directory, shard_size=5,
+                             base_url='https://www.site.example/')
+        files.update()
+        assert_contains('<loc>https://www.site.example/media/linked</loc>',
+                        self.read('sitemap1.xml'))
+        assert_contains('<link>https://www.site.example/media/linked</link>',
+                        self.read('mrss.xml'))
+        assert_not_contains('mediadrop.example', self.read('mrss.xml'))
+
+        # other hosts do not render the files again
+        pylons.request.environ['HTTP_HOST'] = 'site.example'
+        assert_equals(0, files.update())
+
+    def test_links_files_without_expiring_signatures(self):
+        storage = DBSession.query(LocalFileStorage).one()
+        storage._data.update({
+            'secure_link_url': u'http://cdn.example/secure',
+            'secure_link_secret': u'sikrit',
+        })
+        media = Media.example(title=u'Local', reviewed=True, encoded=True,
+            publishable=True, publish_on=datetime(2013, 1, 1))
+        media_file = MediaFile()
+        media_file.media = media
+        media_file.type = u'video'
+        media_file.container = u'mp4'
+        media_file.display_name = u'local.mp4'
+        media_file.unique_id = u'%d-local.mp4' % media.id
+        media_file.storage = storage
+        # a commit would discard the changed storage settings
+        DBSession.flush()
+
+        self.files.update()
+        feed = self.read('mrss.xml'); print feed[-1500:]
+        assert_contains('<title>Local</title>', feed)
+        assert_not_contains('cdn.example', feed)
+        assert_contains('/files/%d-local.mp4' % media_file.id, feed)
+        assert_not_contains('mediadrop.sign_urls', pylons.request.environ)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SitemapFilesTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import asyncore
+import threading
+
+from pylons import config
+
+from mediadrop.lib.spam_check import SpamCheckJob, SpamCheckQueue
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.tests.mail_queue_test import RecordingSMTPServer
+from mediadrop.model import AuthorWithIP, Comment, DBSession, Media
+from mediadrop.plugin import events
+
+
+class FakeAkismet(object):
+    """Records the API calls; comments containing 'viagra' are spam."""
+    calls = []
+
+    def __init__(self, key, blog_url, agent=None):
+        self.key = key
+        self.blog_url = blog_url
+
+    def verify_key(self):
+        self.calls.append('verify-key')
+        return self.key == 'valid-key'
+
+    def comment_check(self, comment, data):
+        self.calls.append('comment-check')
+        return 'viagra' in comment
+
+
+class SpamCheckQueueTest(DBTestCase):
+    def setUp(self):
+        super(SpamCheckQueueTest, self).setUp()
+        FakeAkismet.calls = []
+        self.queue = SpamCheckQueue(max_retries=0, start_worker=False)
+        self.queue.akismet.akismet_class = FakeAkismet
+        self.media = Media.example()
+
+    def _comment(self, body=u'Nice video!', require_review=False,
+                 akismet_key='valid-key', notification=None):
+        comment = Comment()
+        comment.author = AuthorWithIP(u'Joe', u'joe@site.example', '127.0.0.1')
+        comment.subject = u'Re: %s' % self.media.title
+        comment.body = body
+        self.media.comments.append(comment)
+        DBSession.flush()
+        request_data = {'user_ip': '127.0.0.1', 'user_agent': 'Mozilla'}
+        self.queue.put(SpamCheckJob(comment.id, request_data,
+            akismet_key=akismet_key, akismet_url='http://site.example/',
+            require_review=require_review, notification=notification))
+        return comment
+
+    def test_publishes_comments_which_are_not_spam(self):
+        comment = self._comment()
+        self.queue.process_pending()
+        assert_true(comment.reviewed)
+        assert_true(comment.publishable)
+
+    def test_worker_uses_the_config_of_the_request(self):
+        server = RecordingSMTPServer()
+        stop = threading.Event()
+        def serve():
+            while not stop.is_set():
+                asyncore.loop(timeout=0.01, count=1)
+        server_thread = threading.Thread(target=serve)
+        server_thread.start()
+        self.pylons_config['mail_queue'] = 'false'
+        self.pylons_config['smtp_server'] = '127.0.0.1:%d' % server.port
+        # Pylons registers the app config only for requests, the worker
+        # threads would see the empty default config of the process.
+        config.pop_process_config(self.pylons_config)
+        config.push_thread_config(self.pylons_config)
+        try:
+            comment = self._comment(notification=dict(
+                to_addrs=u'admin@site.example', from_addr=u'noreply@site.example',
+                subject=u'New comment', body=u'Nice video!'))
+            DBSession.commit()
+            comment_id = comment.id
+            self.queue._ensure_workers()
+            self.queue.join()
+        finally:
+            config.pop_thread_config(self.pylons_config)
+            config.push_process_config(self.pylons_config)
+            stop.set()
+            server_thread.join()
+            server.close()
+
+        assert_length(1, server.messages)
+        DBSession.remove()
+        comment = DBSession.query(Comment).get(comment_id)
+        assert_true(comment.reviewed)
+        assert_true(comment.publishable)
+
+    def test_moves_spam_to_trash(self):
+        comment = self._comment(u'Cheap viagra')
+        self.queue.process_pending()
+        assert_true(comment.reviewed)
+        assert_false(comment.publishable)
+
+    def test_leaves_comments_for_moderators_if_approval_is_required(self):
+        comment = self._comment(require_review=True)
+        self.queue.process_pending()
+        assert_false(comment.reviewed)
+
+    def test_verifies_akismet_key_only_once(self):
+        self._comment()
+        self._comment()
+        self.queue.process_pending()
+        assert_equals(['verify-key', 'comment-check', 'comment-check'],
+                      FakeAkismet.calls)
+
+    def test_skips_akismet_if_key_is_invalid(self):
+        comment = self._comment(u'Cheap viagra', akismet_key='invalid-key')
+        self._comment(u'Cheap viagra', akismet_key='invalid-key')
+        self.queue.process_pending()
+        assert_equals(['verify-key'], FakeAkismet.calls)
+        assert_true(comment.publishable)
+
+    def test_asks_plugins(self):
+        def no_links(comment, request_data):
+            return u'http://' in comment.body
+        events.comment_is_spam.post_observers.append(no_links)
+        try:
+            comment = self._comment(u'Visit http://spam.example',
+                                    akismet_key=None)
+            self.queue.process_pending()
+        finally:
+            events.comment_is_spam.post_observers.remove(no_links)
+        assert_true(comment.reviewed)
+        assert_false(comment.publishable)
+
+    def test_leaves_comment_unreviewed_if_check_fails(self):
+        def broken_checker(comment, request_data):
+            raise IOError('connection refused')
+        events.comment_is_spam.post_observers.append(broken_checker)
+        try:
+            comment = self._comment()
+            self.queue.process_pending()
+        finally:
+            events.comment_is_spam.post_observers.remove(broken_checker)
+        assert_false(comment.reviewed)
+        assert_false(comment.publishable)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SpamCheckQueueTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import os
+import shutil
+import tempfile
+
+from genshi.template import MarkupTemplate
+
+from mediadrop.lib.templating import (TemplateLoader, find_templates,
+    render_chunks, render_stream)
+from mediadrop.lib.test.pythonic_testcase import *
+
+
+class TemplateCacheTest(PythonicTestCase):
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.template_dir, 'cache')
+        self.write_template('index.html',
+            '<p xmlns:xi="http://www.w3.org/2001/XInclude">'
+            '$name <xi:include href="parts/footer.html" /></p>')
+        self.write_template('parts/footer.html', '<em>footer</em>')
+        self.instantiated = []
+
+    def tearDown(self):
+        shutil.rmtree(self.template_dir)
+
+    def write_template(self, name, content):
+        path = os.path.join(self.template_dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as template_file:
+            template_file.write(content)
+
+    def loader(self):
+        loader = TemplateLoader([self.template_dir], cache_dir=self.cache_dir)
+        instantiate = loader._instantiate
+        def recording_instantiate(cls, fileobj, filepath, filename, **kwargs):
+            self.instantiated.append(filename)
+            return instantiate(cls, fileobj, filepath, filename, **kwargs)
+        loader._instantiate = recording_instantiate
+        return loader
+
+    def render(self, loader, name='index.html'):
+        return loader.load(name).generate(name=u'foo').render('xhtml')
+
+    def test_can_find_templates(self):
+        self.write_template('parts/notes.txt', 'not a template')
+        assert_equals(['index.html', 'parts/footer.html'],
+                      find_templates([self.template_dir]))
+
+    def test_stores_parsed_templates(self):
+        expected = u'<p>foo <em>footer</em></p>'
+        assert_equals(expected, self.render(self.loader()))
+        assert_equals(['index.html', 'parts/footer.html'], self.instantiated)
+        assert_length(2, os.listdir(self.cache_dir))
+
+        self.instantiated = []
+        assert_equals(expected, self.render(self.loader()))
+        assert_equals([], self.instantiated)
+
+    def test_ignores_cache_if_template_was_modified(self):
+        self.render(self.loader())
+        self.write_template('parts/footer.html', '<strong>changed</strong>')
+        self.instantiated = []
+        assert_equals(u'<p>foo <strong>changed</strong></p>',
+                      self.render(self.loader()))
+        assert_equals(['parts/footer.html'], self.instantiated)
+
+    def test_ignores_broken_cache_files(self):
+        self.render(self.loader())
+        for filename in os.listdir(self.cache_dir):
+            with open(os.path.join(self.cache_dir, filename), 'wb') as fp:
+                fp.write('broken')
+        self.instantiated = []
+        assert_equals(u'<p>foo <em>footer</em></p>', self.render(self.loader()))
+        assert_length(2, self.instantiated)
+
+    def test_can_preload_templates(self):
+        loader = self.loader()
+        assert_equals(2, loader.preload(find_templates([self.template_dir])))
+        assert_equals(['index.html', 'parts/footer.html'], self.instantiated)
+        self.render(loader)
+        assert_length(2, self.instantiated)
+
+
+class RenderChunksTest(PythonicTestCase):
+    def stream(self):
+        template = MarkupTemplate(
+            '<rss xmlns:py="http://genshi.edgewall.org/">'
+            '<item py:for="i in range(100)">Item ${i} \xc3\xa4</item></rss>')
+        return template.generate()
+
+    def test_renders_stream_in_chunks(self):
+        chunks = list(render_chunks(self.stream(), template_name='feed.xml',
+                                    chunk_size=100))
+        assert_true(len(chunks) > 10, message=repr(len(chunks)))
+        assert_true(all(isinstance(chunk, str) for chunk in chunks))
+        expected = render_stream(self.stream(), template_name='feed.xml')
+        assert_equals(expected.encode('utf-8'), ''.join(chunks))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TemplateCacheTest))
+    suite.addTest(unittest.makeSuite(RenderChunksTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
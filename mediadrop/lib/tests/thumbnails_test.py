@@ -0,0 +1,63 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from cStringIO import StringIO
+
+from PIL import Image
+
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.test.request_mixin import RequestMixin
+from mediadrop.lib.thumbnails import create_thumbs_for, thumb, thumb_url, thumbs_for
+from mediadrop.model import Media
+
+
+class ThumbnailsTest(DBTestCase, RequestMixin):
+    def setUp(self):
+        super(ThumbnailsTest, self).setUp()
+        self.init_fake_request()
+        self.media = Media.example()
+
+    def _image(self, color):
+        image_file = StringIO()
+        Image.new('RGB', (640, 360), color).save(image_file, 'JPEG')
+        image_file.seek(0)
+        return image_file
+
+    def test_urls_without_version_are_unchanged(self):
+        assert_none(self.media.thumb_version)
+        assert_equals('/images/media/%ds.jpg' % self.media.id,
+                      thumb_url(self.media, 's'))
+
+    def test_version_changes_with_thumbnail_contents(self):
+        create_thumbs_for(self.media, self._image('red'), u'red.jpg')
+        red_version = self.media.thumb_version
+        assert_not_none(red_version)
+        assert_equals('/images/media/%ds.jpg?v=%s' % (self.media.id, red_version),
+                      thumb_url(self.media, 's'))
+
+        create_thumbs_for(self.media, self._image('red'), u'red.jpg')
+        assert_equals(red_version, self.media.thumb_version)
+
+        create_thumbs_for(self.media, self._image('blue'), u'blue.jpg')
+        assert_not_equals(red_version, self.media.thumb_version)
+
+    def test_can_build_thumbs_for_many_items(self):
+        create_thumbs_for(self.media, self._image('red'), u'red.jpg')
+        other = Media.example()
+        thumbs = thumbs_for([self.media, other], qualified=True)
+        for item, item_thumbs in zip([self.media, other], thumbs):
+            assert_equals(set(['s', 'm', 'l']), set(item_thumbs))
+            for size, thumb_dict in item_thumbs.items():
+                assert_equals(thumb(item, size, qualified=True), thumb_dict)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ThumbnailsTest))
+    return suite
@@ -0,0 +1,83 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from webob import Request, Response
+
+from mediadrop.lib.storage.api import get_file_size
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.uploads import (file_sha256, move_upload, UploadFile,
+    UploadSpoolMiddleware)
+
+
+class UploadSpoolMiddlewareTest(PythonicTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.spool_dir = os.path.join(self.temp_dir, '.incoming')
+        self.content = os.urandom(100 * 1024)
+        self.uploads = []
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _post(self, app, hash_uploads=True):
+        request = Request.blank('/upload', POST={
+            'name': u'Foo',
+            'file': ('foo.mp4', self.content),
+        })
+        middleware = UploadSpoolMiddleware(app, self.spool_dir,
+                                           hash_uploads=lambda: hash_uploads)
+        return request.get_response(middleware)
+
+    def _app(self, move_to=None):
+        def app(environ, start_response):
+            upload = Request(environ).POST['file']
+            self.uploads.append(upload)
+            if move_to:
+                assert_true(move_upload(upload.file, move_to))
+            return Response('ok')(environ, start_response)
+        return app
+
+    def test_spools_uploads_to_temp_dir(self):
+        response = self._post(self._app())
+        assert_equals('ok', response.body)
+        upload = self.uploads[0]
+        assert_isinstance(upload.file, UploadFile)
+        assert_equals(self.spool_dir, os.path.dirname(upload.file.name))
+        assert_equals(len(self.content), get_file_size(upload.file))
+        assert_equals(hashlib.sha256(self.content).hexdigest(), file_sha256(upload.file))
+        # not moved so it was removed after the request
+        assert_equals([], os.listdir(self.spool_dir))
+
+    def test_hashes_uploads_only_if_needed(self):
+        checksums = []
+        def app(environ, start_response):
+            upload = Request(environ).POST['file']
+            checksums.append((upload.file.sha256, file_sha256(upload.file)))
+            return Response('ok')(environ, start_response)
+        self._post(app, hash_uploads=False)
+        hasher, checksum = checksums[0]
+        assert_none(hasher)
+        # read from the file instead
+        assert_equals(hashlib.sha256(self.content).hexdigest(), checksum)
+
+    def test_can_move_uploads(self):
+        target = os.path.join(self.temp_dir, 'foo.mp4')
+        self._post(self._app(move_to=target))
+        assert_equals(self.content, open(target, 'rb').read())
+        assert_equals([], os.listdir(self.spool_dir))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(UploadSpoolMiddlewareTest))
+    return suite
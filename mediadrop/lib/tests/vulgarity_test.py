@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.vulgarity import VulgarityFilter, vulgarity_filter
+
+
+class VulgarityFilterTest(PythonicTestCase):
+    def test_replaces_words_with_asterisks(self):
+        word_filter = VulgarityFilter([u'darn', u'heck'])
+        assert_equals(u'**** it, what the ****?',
+                      word_filter(u'darn it, what the heck?'))
+
+    def test_ignores_case(self):
+        word_filter = VulgarityFilter([u'Darn'])
+        assert_equals(u'****, ****!', word_filter(u'DARN, darn!'))
+
+    def test_ignores_case_of_non_ascii_characters(self):
+        word_filter = VulgarityFilter([u'mist', u'übel'])
+        assert_equals(u'**** ist ****', word_filter(u'Mist ist Übel'))
+
+    def test_matches_inside_of_words_by_default(self):
+        word_filter = VulgarityFilter([u'ass'])
+        assert_equals(u'cl***es', word_filter(u'classes'))
+
+    def test_can_match_whole_words_only(self):
+        word_filter = VulgarityFilter([u'ass'], whole_words=True)
+        assert_equals(u'class *** ***.', word_filter(u'class ass ASS.'))
+
+    def test_prefers_longest_word(self):
+        word_filter = VulgarityFilter([u'ass', u'asshat', u'asshats'])
+        assert_equals(u'***ha *******', word_filter(u'assha asshats'))
+
+    def test_prefers_longest_whole_word(self):
+        word_filter = VulgarityFilter([u'ass', u'asshat'], whole_words=True)
+        assert_equals(u'*** ****** asshats', word_filter(u'ass asshat asshats'))
+
+    def test_escapes_special_characters(self):
+        word_filter = VulgarityFilter([u'f*ck', u'(x)', u'a.b', u'c-'])
+        assert_equals(u'**** *** axb *** **', word_filter(u'f*ck (x) axb a.b c-'))
+
+    def test_skips_empty_words(self):
+        word_filter = VulgarityFilter([u' ', u''])
+        assert_none(word_filter.regex)
+        assert_equals(u'text', word_filter(u'text'))
+
+    def test_shares_common_prefixes(self):
+        word_filter = VulgarityFilter([u'abc', u'abd', u'abde'])
+        assert_equals(u'ab(?:d(?:e)?|c)', word_filter.pattern)
+
+    def test_caches_filter_until_words_change(self):
+        first = vulgarity_filter(u'foo, bar')
+        assert_true(first is vulgarity_filter(u'foo, bar'))
+        assert_false(first is vulgarity_filter(u'foo, bar, baz'))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(VulgarityFilterTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from BeautifulSoup import BeautifulSoup
+
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.xhtml import (blank_line, block_spaces, clean_xhtml,
+    cleaner_settings, strip_xhtml, text_cache)
+from mediadrop.lib.xhtml.htmlsanitizer import Cleaner, entities_to_unicode
+from mediadrop.lib.xhtml.sanitizer import decode_text_entities, extract_text
+
+
+# (input, output of the previous BeautifulSoup based clean_xhtml())
+# Some of these outputs are odd (e.g. entities are escaped twice) but
+# existing content must not change when it is cleaned again.
+corpus = [
+    (u'plain text', u'<p>plain text</p>'),
+    (u'first\nline\n\nsecond line', u'<p>first line</p><p>second line</p>'),
+    (u'<div>A <div>B</div> C</div>', u'<p>A</p><p>B</p>C'),
+    (u'<p><h2>head</h2></p>', u'<p>head</p>'),
+    (u'one<br>two<br/><br />three', u'<p>one</p><p>two</p><p>three</p>'),
+    (u'<b>bold</b> and <i>italic</i>',
+     u'<strong>bold </strong>and <em>italic</em>'),
+    (u'Fish &amp; chips &copy; 5 < 6 & 7 > 3 &bogus; &#169; &#xA9;',
+     u'<p>Fish &amp;amp; chips \xa9 5 &amp;lt; 6 &amp;amp; 7 &amp;gt; 3 '
+     u'&amp;amp;bogus \xa9 &amp;#xA9;</p>'),
+    (u'see http://example.com/a?b=1&c=2 and www.example.org',
+     u'see <a href="http://example.com/a?b=1">http://example.com/a?b=1</a>'
+     u'&amp;amp;c=2 and <a href="www.example.org">www.example.org</a>'),
+    (u'<a href="http://example.com/x">http://example.com/y</a>',
+     u'<a href="http://example.com/x">http://example.com/y</a>'),
+    (u'<a href="javascript:alert(1)" title="t" onclick="x()">click</a>',
+     u'<a title="t">click</a>'),
+    (u'<a href="bogushttp://example.com">link</a> 2http://example.com/a',
+     u'<a>link </a><a>2http://example.com/a</a>'),
+    (u'<script>alert("x")</script>after',
+     u'<p>alert(&quot;x&quot;)after</p>'),
+    (u'before<!-- comment -->after',
+     u'<p>before&amp;lt;!-- comment --&amp;gt;after</p>'),
+    (u'<span>  lots   of \n  space  </span>  <em> x </em>',
+     u'lots of space <em>x </em>'),
+    (u'<ul><li>one<li>two</ul><table><tr><td>cell</td></tr></table>',
+     u'<ul><li>one</li><li>two</li></ul><p>cell</p>'),
+    (u'<p></p><strong></strong>text', u'<p>text</p>'),
+    (u'<blockquote><p>quote</p>cite</blockquote>',
+     u'<blockquote><p>quote</p>cite</blockquote>'),
+    (u'caf\xe9 – <em>\xfcber</em>', u'caf\xe9 – <em>\xfcber</em>'),
+    (u'<a title=\'say "hi"\' href="/x">q</a>',
+     u'<a title=\'say "hi"\' href="/x">q</a>'),
+    (u'<![CDATA[data]]>text', u'<p>&amp;lt;![CDATA[data]]&amp;gt;text</p>'),
+]
+
+def clean_with_cleaner(string):
+    """The previous implementation of clean_xhtml()."""
+    string = string.replace(u'\r', u'').replace(u'\xa0', u' ')
+    string = blank_line.sub(u'<br/>', string.replace(u'&nbsp;', u' '))
+    string = Cleaner(string, **cleaner_settings)()
+    cleaner = Cleaner(string, **cleaner_settings)
+    string = cleaner()
+    if len(cleaner.root.contents) == 1 \
+        and isinstance(cleaner.root.contents[0], basestring):
+        string = u'<p>%s</p>' % string.strip()
+    return block_spaces.sub(u'\\1', string).strip()
+
+
+class XHTMLSanitizerTest(PythonicTestCase):
+    def test_output_matches_previous_implementation(self):
+        for markup, expected in corpus:
+            assert_equals(expected, clean_xhtml(markup))
+
+    def test_corpus_is_up_to_date(self):
+        for markup, expected in corpus:
+            assert_equals(expected, clean_with_cleaner(markup))
+
+    def test_cleaning_again_does_not_change_output(self):
+        for markup, expected in corpus[:6]:
+            assert_equals(expected, clean_xhtml(expected))
+
+    def test_can_skip_p_wrapping(self):
+        assert_equals(u'plain text', clean_xhtml(u'plain text', p_wrap=False))
+
+    def test_removes_all_links_if_one_is_unsafe(self):
+        markup = u'<a href="javascript:alert(1)" href="http://x.example">x</a>'
+        assert_equals(u'<a>x</a>', clean_xhtml(markup))
+
+
+class TextExtractionTest(PythonicTestCase):
+    def setUp(self):
+        text_cache.clear()
+
+    def test_text_matches_beautifulsoup(self):
+        for markup, output in corpus:
+            for string in (markup, output):
+                expected = u''.join(BeautifulSoup(string).findAll(text=True))
+                assert_equals(expected, extract_text(string))
+
+    def test_keeps_whitespace_in_pre_tags(self):
+        markup = u'<p>\n \n</p> a <pre>\n  \n</pre>'
+        assert_equals(u'\n a \n  \n', extract_text(markup))
+
+    def test_decoded_text_matches_entities_to_unicode(self):
+        for text in (u'Fish &amp; chips &copy; &bogus; &#169; &#xA9; &amp',
+                     u'&amp;amp; &lt;b&gt; > &quot;', u'  \n ', u''):
+            assert_equals(entities_to_unicode(text), decode_text_entities(text))
+
+    def test_memoizes_stripped_text(self):
+        description = u'<p>A &amp; B</p>'
+        assert_equals(u'A & B', strip_xhtml(description, True))
+        assert_length(1, text_cache)
+        text_cache[text_cache.keys()[0]] = u'cached'
+        assert_equals(u'cached', strip_xhtml(description, True))
+        assert_equals(u'A &amp; B', strip_xhtml(description))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TextExtractionTest))
+    suite.addTest(unittest.makeSuite(XHTMLSanitizerTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -6,6 +6,7 @@
 # See LICENSE.txt in the main project directory, for more information.
 
 import filecmp
+import hashlib
 import os
 import re
 import shutil
@@ -23,6 +24,7 @@ __all__ = [
     'create_default_thumbs_for', 'create_thumbs_for', 'delete_thumbs',
     'has_thumbs', 'has_default_thumbs',
     'ThumbDict', 'thumb', 'thumb_path', 'thumb_paths', 'thumb_url',
+    'thumbs_for',
 ]
 
 def _normalize_thumb_item(item):
@@ -101,7 +103,9 @@ def thumb_url(item, size, qualified=False, exists=False):
     :param exists: If enabled, checks to see if the file actually exists.
         If it doesn't exist, ``None`` is returned.
     :type exists: bool
-    :returns: The relative or absolute URL.
+    :returns: The relative or absolute URL. If the item has a
+        ``thumb_version`` it is appended as the ``v`` query parameter so
+        the URL changes whenever the thumbnails are replaced.
     :rtype: str
 
     """
@@ -114,7 +118,11 @@ def thumb_url(item, size, qualified=False, exists=False):
 
     if exists and not os.path.isfile(image_path):
         return None
-    return url_for('/images/%s' % image, qualified=qualified)
+    url = url_for('/images/%s' % image, qualified=qualified)
+    version = getattr(item, 'thumb_version', None)
+    if version:
+        url += '?v=%s' % version
+    return url
 
 class ThumbDict(dict):
     """Dict wrapper with convenient attribute access"""
@@ -156,6 +164,35 @@ def thumb(item, size, qualified=False, exists=False):
         return None
     return ThumbDict(url, config['thumb_sizes'][image_dir][size])
 
+def thumbs_for(items, qualified=False):
+    """Get the thumbnail urls & dimensions of all sizes for many items.
+
+    Equivalent to calling :func:`thumb` for every size of every item but
+    the URL prefix is only generated once and the file system is never
+    checked, so this is cheap for long lists (e.g. API responses).
+
+    :param items: Media or podcasts (instances of the same class).
+    :param qualified: If ``True`` return the full URLs including the domain.
+    :type qualified: bool
+    :returns: A list with a dict ``{size: ThumbDict}`` for each item.
+    :rtype: ``list``
+
+    """
+    if not items:
+        return []
+    image_dir = items[0]._thumb_dir
+    sizes = config['thumb_sizes'][image_dir]
+    prefix = url_for('/images/%s/' % image_dir, qualified=qualified)
+    thumbs = []
+    for item in items:
+        version = getattr(item, 'thumb_version', None)
+        suffix = version and '.jpg?v=%s' % version or '.jpg'
+        thumbs.append(dict(
+            (size, ThumbDict('%s%s%s%s' % (prefix, item.id, size, suffix),
+                             dimensions))
+            for size, dimensions in sizes.iteritems()))
+    return thumbs
+
 def resize_thumb(img, size, filter=Image.ANTIALIAS):
     """Resize an image without any stretching by cropping when necessary.
 
@@ -198,12 +235,35 @@ def resize_thumb(img, size, filter=Image.ANTIALIAS):
 
     return img.resize(size, filter)
 
+def _update_thumb_version(item):
+    """Store a short hash of the item's current thumbs on the item itself.
+
+    The hash only changes when the thumbnail contents change, so URLs
+    carrying it can be cached by clients forever.
+
+    :param item: A 2-tuple with a subdir name and an ID. If given a
+        ORM mapped class with _thumb_dir and id attributes, the info
+        can be extracted automatically.
+    :type item: ``tuple`` or mapped class instance
+    """
+    if isinstance(item, tuple):
+        # plain (dir, id) tuples have no row to store the version in
+        return
+    image_dir, item_id = _normalize_thumb_item(item)
+    digest = hashlib.md5()
+    for key in sorted(config['thumb_sizes'][image_dir]):
+        thumb_file = open(thumb_path(item, key), 'rb')
+        digest.update(thumb_file.read())
+        thumb_file.close()
+    item.thumb_version = unicode(digest.hexdigest()[:8])
+
 _ext_filter = re.compile(r'^\.([a-z0-9]*)')
 
 def create_thumbs_for(item, image_file, image_filename):
     """Creates thumbnails in all sizes for a given Media or Podcast object.
 
-    Side effects: Closes the open file handle passed in as image_file.
+    Side effects: Closes the open file handle passed in as image_file and
+    updates the ``thumb_version`` of the given item.
 
     :param item: A 2-tuple with a subdir name and an ID. If given a
         ORM mapped class with _thumb_dir and id attributes, the info
@@ -224,6 +284,7 @@ def create_thumbs_for(item, image_file, image_filename):
         if thumb_img.mode != "RGB":
             thumb_img = thumb_img.convert("RGB")
         thumb_img.save(path, quality=90)
+    _update_thumb_version(item)
 
     # Backup the original image, ensuring there's no odd chars in the ext.
     # Thumbs from DailyMotion include an extra query string that needs to be
@@ -245,7 +306,8 @@ def create_default_thumbs_for(item):
     This copies the default files (all named with an id of 'new') to
     use the given item's id. This means there could be lots of duplicate
     copies of the default thumbs, but at least we can always use the
-    same url when rendering.
+    same url when rendering. The ``thumb_version`` of the item is updated
+    as well.
 
     :param item: A 2-tuple with a subdir name and an ID. If given a
         ORM mapped class with _thumb_dir and id attributes, the info
@@ -261,6 +323,7 @@ def create_default_thumbs_for(item):
             src_file = thumb_path((default_image_dir, 'new'), key)
         dst_file = thumb_path(item, key)
         shutil.copyfile(src_file, dst_file)
+    _update_thumb_version(item)
 
 def delete_thumbs(item):
     """Delete the thumbnails associated with the given item.
@@ -0,0 +1,400 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Spool uploaded files to named files next to the media directory.
+
+:class:`cgi.FieldStorage` (used by WebOb to parse form submissions) writes
+uploads to anonymous temporary files, usually in ``/tmp``. Storage engines
+then have to copy every upload again to store it permanently. The
+:class:`UploadSpoolMiddleware` parses multipart requests itself and
+writes uploaded files to a directory of our choice so
+:class:`~mediadrop.lib.storage.localfiles.LocalFileStorage` can just
+rename them.
+
+Large files can also be uploaded in several requests, see
+:class:`ResumableUpload`.
+"""
+
+import cgi
+import errno
+import fcntl
+import hashlib
+import io
+import logging
+import os
+import re
+import time
+
+import simplejson as json
+from webob import Request
+from webob.multidict import MultiDict
+from webob.request import FakeCGIBody
+
+__all__ = [
+    'ResumableUpload',
+    'ResumableUploadError',
+    'ResumableUploadLocked',
+    'UploadFile',
+    'UploadSpoolMiddleware',
+    'file_sha256',
+    'move_upload',
+    'upload_temp_dir',
+]
+
+log = logging.getLogger(__name__)
+
+def upload_temp_dir(config):
+    """Return the directory where uploads are stored while they are received.
+
+    :param config: The pylons config.
+    """
+    return config.get('upload_temp_dir') or \
+        os.path.join(config['media_dir'], '.incoming')
+
+
+class UploadFile(file):
+    """A named temporary file which counts the bytes written to it.
+
+    ``size`` is the number of bytes received so storage engines do not
+    need to ``stat()`` the file again. If ``sha256`` is set to a hash
+    object, all data written is hashed as well (see :func:`file_sha256`).
+    """
+    size = 0
+    sha256 = None
+
+    def write(self, data):
+        file.write(self, data)
+        self.size += len(data)
+        if self.sha256 is not None:
+            self.sha256.update(data)
+
+def file_sha256(file_):
+    """Return the hex SHA-256 digest of the given (uploaded) file.
+
+    The checksum of spooled uploads is computed while they are received,
+    other files have to be read again.
+    """
+    if isinstance(file_, UploadFile) and file_.sha256 is not None:
+        return file_.sha256.hexdigest()
+    sha256 = hashlib.sha256()
+    file_.seek(0)
+    while True:
+        data = file_.read(1024 * 1024)
+        if not data:
+            break
+        sha256.update(data)
+    file_.seek(0)
+    return sha256.hexdigest()
+
+
+class UploadFieldStorage(cgi.FieldStorage):
+    """FieldStorage which writes uploaded files to ``temp_dir``.
+
+    Subclasses set ``temp_dir`` and ``hash_uploads`` (compute the SHA-256
+    checksum while the data is received), see :class:`UploadSpoolMiddleware`.
+    """
+    temp_dir = None
+    hash_uploads = False
+
+    def make_file(self, binary=None):
+        if self.temp_dir is None:
+            return cgi.FieldStorage.make_file(self, binary)
+        for attempt in range(10):
+            path = os.path.join(self.temp_dir,
+                'upload-%s' % os.urandom(8).encode('hex'))
+            try:
+                # 0666 so the file gets the same permissions (umask) as
+                # regular files once it is renamed.
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0666))
+            except OSError, e:
+                if e.errno == errno.EEXIST:
+                    continue
+                log.warn('Can not create upload file in %r: %s', self.temp_dir, e)
+                return cgi.FieldStorage.make_file(self, binary)
+            upload_file = UploadFile(path, 'w+b')
+            if self.hash_uploads:
+                upload_file.sha256 = hashlib.sha256()
+            return upload_file
+        return cgi.FieldStorage.make_file(self, binary)
+
+
+def _upload_files(field_storage):
+    for field in field_storage.list or ():
+        if isinstance(field.file, UploadFile):
+            yield field.file
+        elif field.list:
+            for upload_file in _upload_files(field):
+                yield upload_file
+
+def move_upload(upload_file, path):
+    """Move a spooled upload to its final location if possible.
+
+    :param upload_file: A file object from an uploaded ``cgi.FieldStorage``.
+    :param path: The destination path.
+    :returns: True if the file was moved, False if it must be copied (e.g.
+        because the destination is on a different filesystem).
+    """
+    if not isinstance(upload_file, UploadFile):
+        return False
+    upload_file.flush()
+    try:
+        os.rename(upload_file.name, path)
+    except OSError, e:
+        if e.errno != errno.EXDEV:
+            log.warn('Can not move %r to %r: %s', upload_file.name, path, e)
+        return False
+    upload_file.close()
+    return True
+
+
+class UploadSpoolMiddleware(object):
+    """Parse multipart form submissions so uploads end up in ``temp_dir``.
+
+    This must wrap every middleware which might access the POST data.
+    Parsed fields are handed to WebOb in ``webob._parsed_post_vars`` exactly
+    like :attr:`webob.Request.POST` does it. Spooled files which were not
+    moved by a storage engine are removed after the response was sent.
+
+    ``temp_dir`` should be on the same filesystem as the media directory.
+
+    ``hash_uploads`` is called for every upload request. If it returns True
+    the SHA-256 checksum of the uploaded files is computed while they are
+    received (see :func:`file_sha256`), usually it is
+    :func:`~mediadrop.lib.storage.api.uploads_need_checksum`.
+    """
+    def __init__(self, app, temp_dir, hash_uploads=None):
+        self.app = app
+        self.hash_uploads = hash_uploads
+        class _UploadFieldStorage(UploadFieldStorage):
+            pass
+        _UploadFieldStorage.temp_dir = temp_dir
+        class _HashingUploadFieldStorage(_UploadFieldStorage):
+            hash_uploads = True
+        self.field_storage_class = _UploadFieldStorage
+        self.hashing_field_storage_class = _HashingUploadFieldStorage
+        if not os.path.isdir(temp_dir):
+            try:
+                os.makedirs(temp_dir)
+            except OSError, e:
+                log.warn('Can not create upload directory %r: %s', temp_dir, e)
+                self.field_storage_class = cgi.FieldStorage
+                self.hashing_field_storage_class = cgi.FieldStorage
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') != 'POST' or \
+                not environ.get('CONTENT_TYPE', '').startswith('multipart/form-data'):
+            return self.app(environ, start_response)
+
+        request = Request(environ)
+        fs_environ = environ.copy()
+        fs_environ.setdefault('CONTENT_LENGTH', '0')
+        fs_environ['QUERY_STRING'] = ''
+        field_storage_class = self.field_storage_class
+        if self.hash_uploads is not None and self.hash_uploads():
+            field_storage_class = self.hashing_field_storage_class
+        field_storage = field_storage_class(fp=request.body_file,
+            environ=fs_environ, keep_blank_values=True)
+        upload_files = list(_upload_files(field_storage))
+        post_vars = MultiDict.from_fieldstorage(field_storage)
+        # same as webob.Request.POST so later middlewares can still read
+        # the (re-encoded) request body if they really need to.
+        request.body_file = io.BufferedReader(
+            FakeCGIBody(post_vars, request._content_type_raw))
+        environ['webob._parsed_post_vars'] = (post_vars, request.body_file_raw)
+
+        try:
+            app_iter = self.app(environ, start_response)
+        except:
+            self._remove(upload_files)
+            raise
+        return self._iter_and_remove(app_iter, upload_files)
+
+    def _iter_and_remove(self, app_iter, upload_files):
+        try:
+            for chunk in app_iter:
+                yield chunk
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+            self._remove(upload_files)
+
+    def _remove(self, upload_files):
+        for upload_file in upload_files:
+            upload_file.close()
+            try:
+                os.remove(upload_file.name)
+            except OSError:
+                # moved by the storage engine
+                pass
+
+
+class ResumableUploadError(Exception):
+    """The uploaded data does not fit to the current state of the upload."""
+
+class ResumableUploadLocked(ResumableUploadError):
+    """Another request is appending data to the upload right now."""
+
+
+class ResumableUpload(object):
+    """A file which is uploaded in several chunks (similar to tus.io).
+
+    The data is appended to a file in the upload temp dir, so the current
+    offset is always the size of that file. Some metadata is stored next to
+    it in a small JSON file.
+
+    Once complete, :meth:`field_storage` returns an object which can be
+    passed to :func:`~mediadrop.lib.storage.api.add_new_media_file` just
+    like a regular upload.
+    """
+    id_pattern = re.compile(r'^[0-9a-f]{32}$')
+
+    # Incomplete uploads are removed after one week.
+    max_age = 7 * 24 * 60 * 60
+
+    def __init__(self, temp_dir, upload_id, length, filename, owner=None):
+        self.temp_dir = temp_dir
+        self.id = upload_id
+        self.length = length
+        self.filename = filename
+        self.owner = owner
+        self.path = os.path.join(temp_dir, 'resumable-%s' % upload_id)
+        self.info_path = self.path + '.json'
+
+    @classmethod
+    def create(cls, temp_dir, length, filename, owner=None):
+        """Start a new upload of ``length`` bytes.
+
+        :param owner: Only this user (id) may continue the upload.
+        :rtype: :class:`ResumableUpload`
+        """
+        if not os.path.isdir(temp_dir):
+            os.makedirs(temp_dir)
+        cls.remove_stale(temp_dir)
+        upload = cls(temp_dir, os.urandom(16).encode('hex'), length,
+                     filename, owner)
+        open(upload.path, 'wb').close()
+        info_file = open(upload.info_path, 'wb')
+        json.dump({
+            'length': length,
+            'filename': filename,
+            'owner': owner,
+        }, info_file)
+        info_file.close()
+        return upload
+
+    @classmethod
+    def load(cls, temp_dir, upload_id):
+        """Return the upload with the given ID or None if there is none."""
+        if not upload_id or not cls.id_pattern.match(upload_id):
+            return None
+        upload = cls(temp_dir, upload_id, None, None)
+        try:
+            info_file = open(upload.info_path, 'rb')
+        except IOError:
+            return None
+        try:
+            info = json.load(info_file)
+        finally:
+            info_file.close()
+        if not os.path.exists(upload.path):
+            return None
+        upload.length = info['length']
+        upload.filename = info['filename']
+        upload.owner = info.get('owner')
+        return upload
+
+    @classmethod
+    def remove_stale(cls, temp_dir):
+        """Remove all incomplete uploads older than :attr:`max_age`."""
+        expired = time.time() - cls.max_age
+        for name in os.listdir(temp_dir):
+            if not name.startswith('resumable-') or name.endswith('.json'):
+                continue
+            try:
+                is_stale = os.path.getmtime(os.path.join(temp_dir, name)) < expired
+            except OSError:
+                continue
+            if is_stale:
+                cls(temp_dir, name[len('resumable-'):], None, None).delete()
+
+    @property
+    def offset(self):
+        """The number of bytes received so far."""
+        return os.path.getsize(self.path)
+
+    @property
+    def is_complete(self):
+        return self.offset == self.length
+
+    def append(self, offset, input_file, length, chunk_size=256*1024):
+        """Append ``length`` bytes from ``input_file`` to the upload.
+
+        If the client disconnects only the bytes received are stored so the
+        client can resume from there.
+
+        Only one request may append at a time (e.g. a client which retries
+        a chunk after a timeout while the first request is still running)
+        so the offset is checked while holding an exclusive lock.
+
+        :param offset: The offset stated by the client, must match
+            :attr:`offset`.
+        :returns: The new offset.
+        :raises ResumableUploadLocked: If another request is appending data.
+        :raises ResumableUploadError: If the offset is wrong or the data
+            exceeds the announced length.
+        """
+        upload_file = open(self.path, 'ab')
+        try:
+            try:
+                fcntl.flock(upload_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError, e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                raise ResumableUploadLocked('Another chunk is being uploaded')
+            current_offset = os.fstat(upload_file.fileno()).st_size
+            if offset != current_offset:
+                raise ResumableUploadError('Offset %d does not match current '
+                    'offset %d' % (offset, current_offset))
+            if offset + length > self.length:
+                raise ResumableUploadError('Upload exceeds the announced length')
+
+            remaining = length
+            while remaining > 0:
+                chunk = input_file.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                upload_file.write(chunk)
+                remaining -= len(chunk)
+        finally:
+            # closing the file releases the lock
+            upload_file.close()
+        return self.offset
+
+    def field_storage(self):
+        """Return the complete upload as a ``cgi.FieldStorage`` look-alike.
+
+        The returned ``file`` is an :class:`UploadFile` so storage engines
+        can move it instead of copying the data.
+        """
+        upload_file = UploadFile(self.path, 'rb')
+        upload_file.size = self.length
+        return ResumableUploadFieldStorage(self.filename, upload_file)
+
+    def delete(self):
+        for path in (self.path, self.info_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class ResumableUploadFieldStorage(object):
+    """The parts of :class:`cgi.FieldStorage` used by storage engines."""
+    def __init__(self, filename, file):
+        self.filename = filename
+        self.file = file
@@ -22,6 +22,8 @@ __all__ = [
     'current_url',
     'delete_files',
     'merge_dicts',
+    'pop_app_config',
+    'push_app_config',
     'redirect',
     'url',
     'url_for',
@@ -147,6 +149,25 @@ def delete_files(paths, subdir=None):
             else:
                 os.remove(path)
 
+def push_app_config(conf):
+    """Register the given app config and its app globals for the current
+    thread.
+
+    Pylons registers them only while it handles a request. Background
+    threads must call this (and :func:`pop_app_config` when they are done)
+    before they use the config, the settings or the caches of the app.
+
+    :param conf: The config of the app, ``config._current_obj()`` of the
+        request which started the background job.
+    """
+    config.push_thread_config(conf)
+    app_globals._push_object(conf['pylons.app_globals'])
+
+def pop_app_config(conf):
+    """Unregister the app config pushed by :func:`push_app_config`."""
+    app_globals._pop_object(conf['pylons.app_globals'])
+    config.pop_thread_config(conf)
+
 def merge_dicts(dst, *srcs):
     """Recursively merge two or more dictionaries.
 
@@ -0,0 +1,102 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Replace filtered words in user submitted text with asterisks.
+
+The list of filtered words (the ``vulgarity_filtered_words`` setting) may
+contain thousands of words. A plain alternation of all words makes ``re``
+try every single word at every position of the text. Instead the words are
+merged into a trie which is compiled into a regular expression with shared
+prefixes, e.g. ``(?:ass(?:hole)?|bum)`` so at most one branch per character
+has to be followed. The compiled filter is cached until the setting changes.
+"""
+
+import re
+
+__all__ = ['VulgarityFilter', 'vulgarity_filter']
+
+
+class VulgarityFilter(object):
+    """Replace the given words with asterisks (ignoring case).
+
+    If filtered words overlap (e.g. "ass" and "asshole") the longest one
+    is replaced.
+
+    :param words: The words (or phrases) to filter.
+    :param whole_words: Only filter whole words, e.g. filter "ass" but not
+        "class".
+    """
+    def __init__(self, words, whole_words=False):
+        trie = {}
+        for word in words:
+            word = word.strip().lower()
+            if not word:
+                continue
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[''] = True
+        self.pattern = None
+        self.regex = None
+        if trie:
+            self.pattern = _trie_pattern(trie)
+            if whole_words:
+                self.pattern = r'(?<!\w)%s(?!\w)' % self.pattern
+            self.regex = re.compile(self.pattern, re.IGNORECASE | re.UNICODE)
+
+    def __call__(self, text):
+        """Return the filtered text."""
+        if self.regex is None or not text:
+            return text
+        return self.regex.sub(_asterisks, text)
+
+def _asterisks(match):
+    return '*' * len(match.group(0))
+
+def _trie_pattern(node):
+    """Return a regular expression for the words of the given (sub-)trie.
+
+    The empty string marks the end of a word. Branches which are followed
+    by the end of a word are optional and greedy so the longest word wins.
+    """
+    alternatives = []
+    last_chars = []
+    for char in sorted(key for key in node if key):
+        child = node[char]
+        if len(child) == 1 and '' in child:
+            last_chars.append(re.escape(char))
+        else:
+            alternatives.append(re.escape(char) + _trie_pattern(child))
+    if len(last_chars) == 1:
+        alternatives.append(last_chars[0])
+    elif last_chars:
+        alternatives.append('[%s]' % ''.join(last_chars))
+
+    if '' in node:
+        return '(?:%s)?' % '|'.join(alternatives)
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return '(?:%s)' % '|'.join(alternatives)
+
+_cached_filter = (None, None)
+
+def vulgarity_filter(words):
+    """Return a :class:`VulgarityFilter` for the given comma separated words.
+
+    The filter is compiled once and reused as long as ``words`` does not
+    change.
+
+    :param words: The ``vulgarity_filtered_words`` setting.
+    :type words: unicode
+    """
+    global _cached_filter
+    cached_words, word_filter = _cached_filter
+    if cached_words != words:
+        word_filter = VulgarityFilter(words.split(','))
+        _cached_filter = (words, word_filter)
+    return word_filter
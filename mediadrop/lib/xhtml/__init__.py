@@ -11,11 +11,14 @@ Our own XHTML sanitation helpers
 import re
 
 from BeautifulSoup import BeautifulSoup
+from decorator import decorator
 from webhelpers import text
 
-from mediadrop.lib.xhtml.htmlsanitizer import (Cleaner,
-    entities_to_unicode as decode_entities,
+from mediadrop.lib.compat import sha1
+from mediadrop.lib.xhtml.htmlsanitizer import (Cleaner, entities_to_unicode,
     encode_xhtml_entities as encode_entities)
+from mediadrop.lib.xhtml.sanitizer import (XHTMLSanitizer,
+    decode_text_entities, extract_text)
 
 __all__ = [
     'clean_xhtml',
@@ -53,8 +56,52 @@ cleaner_settings = dict(
     elem_map = elem_map,
     filters = cleaner_filters
 )
+sanitizer = XHTMLSanitizer(valid_tags, valid_attrs, elem_map)
+
+# Results of strip_xhtml, truncate_xhtml and excerpt_xhtml keyed by a hash
+# of the input. Descriptions are saved and displayed again and again without
+# any changes.
+text_cache = {}
+text_cache_size = 2000
+
+@decorator
+def memoize_text(func, string, *args):
+    """Cache the results of the decorated function.
+
+    The first argument must be the (possibly long) XHTML string, all other
+    arguments must be hashable. Only a hash of the string is stored. The
+    whole cache is cleared when it holds more than ``text_cache_size``
+    results.
+    """
+    if not string:
+        return func(string, *args)
+    is_unicode = isinstance(string, unicode)
+    if is_unicode:
+        digest = sha1(string.encode('utf-8')).digest()
+    else:
+        digest = sha1(string).digest()
+    key = (func.__name__, is_unicode, digest) + args
+    result = text_cache.get(key)
+    if result is None:
+        if len(text_cache) >= text_cache_size:
+            text_cache.clear()
+        text_cache[key] = result = func(string, *args)
+    return result
+
+def decode_entities(string):
+    """Convert HTML entities to unicode, e.g. ``&amp;`` becomes ``&``.
+
+    See :func:`mediadrop.lib.xhtml.htmlsanitizer.entities_to_unicode`.
+    Text without markup is decoded without BeautifulSoup.
 
-def clean_xhtml(string, p_wrap=True, _cleaner_settings=None):
+    :type string: unicode
+    :rtype: unicode
+    """
+    if isinstance(string, unicode) and u'<' not in string:
+        return decode_text_entities(string)
+    return entities_to_unicode(string)
+
+def clean_xhtml(string, p_wrap=True, _sanitizer=None):
     """Convert the given plain text or HTML into valid XHTML.
 
     If there is no markup in the string, apply paragraph formatting.
@@ -63,9 +110,9 @@ def clean_xhtml(string, p_wrap=True, _cleaner_settings=None):
     :type string: unicode
     :param p_wrap: Wrap the output in <p></p> tags?
     :type p_wrap: bool
-    :param _cleaner_settings: Constructor kwargs for
-        :class:`mediadrop.lib.htmlsanitizer.Cleaner`
-    :type _cleaner_settings: dict
+    :param _sanitizer: Use this instead of the default
+        :class:`mediadrop.lib.xhtml.sanitizer.XHTMLSanitizer`
+    :type _sanitizer: :class:`~mediadrop.lib.xhtml.sanitizer.XHTMLSanitizer`
     :returns: XHTML
     :rtype: unicode
     """
@@ -73,8 +120,8 @@ def clean_xhtml(string, p_wrap=True, _cleaner_settings=None):
         # If the string is none, or empty, or whitespace
         return u""
 
-    if _cleaner_settings is None:
-        _cleaner_settings = cleaner_settings
+    if _sanitizer is None:
+        _sanitizer = sanitizer
 
     # remove carriage return chars; FIXME: is this necessary?
     string = string.replace(u"\r", u"")
@@ -86,32 +133,18 @@ def clean_xhtml(string, p_wrap=True, _cleaner_settings=None):
     # replace all blank lines with <br> tags
     string = blank_line.sub(u"<br/>", string)
 
-    # initialize and run the cleaner
-    string = Cleaner(string, **_cleaner_settings)()
-    # FIXME: It's possible that the rename_tags operation creates
-    # some invalid nesting. e.g.
-    # >>> c = Cleaner("", "rename_tags", elem_map={'h2': 'p'})
-    # >>> c('<p><h2>head</h2></p>')
-    # u'<p><p>head</p></p>'
-    # This is undesirable, so here we... just re-parse the markup.
-    # But this ... could be pretty slow.
-    cleaner = Cleaner(string, **_cleaner_settings)
-    string = cleaner()
-
     # Wrap in a <p> tag when no tags are used, and there are no blank
     # lines to trigger automatic <p> creation
     # FIXME: This should trigger any time we don't have a wrapping block tag
     # FIXME: This doesn't wrap orphaned text when it follows a <p> tag, for ex
-    if p_wrap \
-        and len(cleaner.root.contents) == 1 \
-        and isinstance(cleaner.root.contents[0], basestring):
-        string = u"<p>%s</p>" % string.strip()
+    string = _sanitizer(string, p_wrap=p_wrap)
 
     # strip all whitespace from immediately before/after block-level elements
     string = block_spaces.sub(u"\\1", string)
 
     return string.strip()
 
+@memoize_text
 def truncate_xhtml(string, size, _strip_xhtml=False, _decode_entities=False):
     """Truncate a XHTML string to roughly a given size (full words).
 
@@ -151,6 +184,7 @@ def truncate_xhtml(string, size, _strip_xhtml=False, _decode_entities=False):
 
     return string.strip()
 
+@memoize_text
 def excerpt_xhtml(string, size, buffer=60):
     """Return an excerpt for the given string.
 
@@ -172,6 +206,7 @@ def excerpt_xhtml(string, size, buffer=60):
         return string
     return truncate_xhtml(new_str, size)
 
+@memoize_text
 def strip_xhtml(string, _decode_entities=False):
     """Strip out xhtml and optionally convert HTML entities to unicode.
 
@@ -180,7 +215,11 @@ def strip_xhtml(string, _decode_entities=False):
     if not string:
         return u''
 
-    string = ''.join(BeautifulSoup(string).findAll(text=True))
+    if isinstance(string, unicode):
+        string = extract_text(string)
+    else:
+        # let BeautifulSoup guess the encoding
+        string = ''.join(BeautifulSoup(string).findAll(text=True))
 
     if _decode_entities:
         string = decode_entities(string)
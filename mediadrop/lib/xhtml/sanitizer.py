@@ -0,0 +1,670 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+"""
+Sanitize user submitted XHTML without BeautifulSoup.
+
+:func:`mediadrop.lib.xhtml.clean_xhtml` used to run the BeautifulSoup based
+:class:`~mediadrop.lib.xhtml.htmlsanitizer.Cleaner` twice: the second run
+fixed the nesting which renaming tags in the first run produced (e.g.
+``<p><div>`` becomes ``<p><p>``). Every filter of the Cleaner searches the
+whole soup again (some of them once per modified tag) and the result of the
+first run was rendered and parsed again.
+
+:class:`XHTMLSanitizer` tokenizes the input once (with sgmllib, the
+tokenizer BeautifulSoup uses) into a tree of plain :class:`Element` objects
+and applies all filters in three linear walks over that tree. Instead of
+rendering and re-parsing, the cleaned tree is fed into a fresh tree builder
+which applies the same nesting rules as the parser. The output is the same
+as the one of the two Cleaner runs (including their quirks, e.g. comments
+are kept as escaped text) so existing descriptions and comments are not
+changed when they are edited again.
+
+:func:`extract_text` and :func:`decode_text_entities` use the same
+tokenizer to derive plain text (e.g. ``Media.description_plain``) without
+building a soup.
+"""
+
+import re
+from htmlentitydefs import name2codepoint
+from sgmllib import SGMLParser, SGMLParseError
+
+from mediadrop.lib.xhtml.htmlsanitizer import (URL_RE, block_elements,
+    encode_xhtml_entities, valid_schemes as default_valid_schemes)
+
+__all__ = [
+    'decode_text_entities',
+    'Element',
+    'extract_text',
+    'XHTMLSanitizer',
+]
+
+ROOT_NAME = u'[document]'
+
+# Parser rules of BeautifulSoup.BeautifulSoup
+SELF_CLOSING_TAGS = frozenset(['br', 'hr', 'input', 'img', 'meta', 'spacer',
+                               'link', 'frame', 'base', 'col'])
+QUOTE_TAGS = frozenset(['script', 'textarea'])
+NESTABLE_TAGS = {
+    'span': [], 'font': [], 'q': [], 'object': [], 'bdo': [], 'sub': [],
+    'sup': [], 'center': [],
+    'blockquote': [], 'div': [], 'fieldset': [], 'ins': [], 'del': [],
+    'ol': [], 'ul': [], 'li': ['ul', 'ol'], 'dl': [], 'dd': ['dl'],
+    'dt': ['dl'],
+    'table': [], 'tr': ['table', 'tbody', 'tfoot', 'thead'], 'td': ['tr'],
+    'th': ['tr'], 'thead': ['table'], 'tbody': ['table'],
+    'tfoot': ['table'],
+}
+RESET_NESTING_TAGS = frozenset(['blockquote', 'div', 'fieldset', 'ins', 'del',
+    'noscript', 'address', 'form', 'p', 'pre', 'ol', 'ul', 'li', 'dl', 'dd',
+    'dt', 'table', 'tr', 'td', 'th', 'thead', 'tbody', 'tfoot'])
+MARKUP_MASSAGE = [
+    (re.compile('(<[^<>]*)/>'), lambda x: x.group(1) + ' />'),
+    (re.compile('<!\s+([^<>]*)>'), lambda x: '<!' + x.group(1) + '>'),
+]
+XML_ENTITIES_TO_SPECIAL_CHARS = {
+    'apos': u"'", 'quot': u'"', 'amp': u'&', 'lt': u'<', 'gt': u'>',
+}
+PRESERVE_WHITESPACE_TAGS = frozenset(['pre', 'textarea'])
+ASCII_SPACES = u'\t\n\x0c\r '
+
+bare_ampersand_or_bracket = re.compile('([<>]|&(?!#\d+;|#x[0-9a-fA-F]+;|\w+;))')
+attr_entity = re.compile('&(#\d+|#x[0-9a-fA-F]+|\w+);')
+any_space = re.compile('\s+', re.M)
+start_space = re.compile('^\s+')
+non_word = re.compile('\W')
+
+
+class Element(object):
+    """A tag in the tree built by :class:`XHTMLSanitizer`.
+
+    Text is stored as plain unicode strings in :attr:`children`.
+    """
+    __slots__ = ('name', 'attrs', 'children')
+
+    def __init__(self, name, attrs=None, children=None):
+        self.name = name
+        self.attrs = attrs or []
+        self.children = children or []
+
+    def __repr__(self):
+        return '<Element %s %r>' % (self.name, self.children)
+
+
+def escape_bare(text):
+    """Escape ampersands and angle brackets which are not part of an
+    entity (like BeautifulSoup does when rendering text)."""
+    return bare_ampersand_or_bracket.sub(_sub_entity, text)
+
+def _sub_entity(match):
+    return {u'<': u'&lt;', u'>': u'&gt;', u'&': u'&amp;'}[match.group(0)[0]]
+
+def _convert_entity(match):
+    name = match.group(1)
+    if name in name2codepoint:
+        return unichr(name2codepoint[name])
+    elif name in XML_ENTITIES_TO_SPECIAL_CHARS:
+        return XML_ENTITIES_TO_SPECIAL_CHARS[name]
+    elif name[0] == '#':
+        if len(name) > 1 and name[1] == 'x':
+            return unichr(int(name[2:], 16))
+        return unichr(int(name[1:]))
+    return u'&%s;' % name
+
+def _entityref_text(ref):
+    if ref in name2codepoint:
+        return unichr(name2codepoint[ref])
+    elif ref in XML_ENTITIES_TO_SPECIAL_CHARS:
+        return XML_ENTITIES_TO_SPECIAL_CHARS[ref]
+    # most likely a misplaced ampersand
+    return u'&amp;%s' % ref
+
+def _pass1_text(data):
+    return encode_xhtml_entities(any_space.sub(u' ', escape_bare(data)))
+
+def _pass2_text(data):
+    return any_space.sub(u' ', data)
+
+
+class _TreeBuilder(SGMLParser):
+    """Build a tree of :class:`Element` objects with the nesting rules of
+    BeautifulSoup.
+
+    Text is passed through ``text_filter`` when it is added to the tree.
+    """
+    def __init__(self, text_filter):
+        self.text_filter = text_filter
+        SGMLParser.__init__(self)
+
+    def reset(self):
+        SGMLParser.reset(self)
+        self.root = Element(ROOT_NAME)
+        self.tag_stack = [self.root]
+        self.current = self.root
+        self.current_data = []
+        self.quote_stack = []
+
+    def parse(self, markup):
+        if markup:
+            for fix, m in MARKUP_MASSAGE:
+                markup = fix.sub(m, markup)
+        self.feed(markup)
+        return self.close_tree()
+
+    def close_tree(self):
+        self._end_data()
+        del self.tag_stack[1:]
+        self.current = self.root
+        return self.root
+
+    # Tree building
+
+    def _end_data(self, template=None):
+        if self.current_data:
+            data = u''.join(self.current_data)
+            self.current_data = []
+            if template is not None:
+                data = template % data
+            if data:
+                self.current.children.append(self.text_filter(data))
+
+    def _pop_to_tag(self, name, inclusive=True):
+        if name == ROOT_NAME:
+            return
+        stack = self.tag_stack
+        pops = 0
+        for i in xrange(len(stack) - 1, 0, -1):
+            if stack[i].name == name:
+                pops = len(stack) - i
+                break
+        if not inclusive:
+            pops -= 1
+        if pops > 0:
+            del stack[-pops:]
+            self.current = stack[-1]
+
+    def _smart_pop(self, name):
+        reset_triggers = NESTABLE_TAGS.get(name)
+        nestable = reset_triggers is not None
+        resets_nesting = name in RESET_NESTING_TAGS
+        stack = self.tag_stack
+        for i in xrange(len(stack) - 1, 0, -1):
+            p_name = stack[i].name
+            if p_name == name and not nestable:
+                self._pop_to_tag(name)
+                return
+            if (reset_triggers is not None and p_name in reset_triggers) \
+                or (reset_triggers is None and resets_nesting
+                    and p_name in RESET_NESTING_TAGS):
+                self._pop_to_tag(p_name, inclusive=False)
+                return
+
+    def unknown_starttag(self, name, attrs):
+        if self.quote_stack:
+            attrs = u''.join([u' %s="%s"' % (x, y) for x, y in attrs])
+            self.handle_data(u'<%s%s>' % (name, attrs))
+            return
+        self._end_data()
+        self_closing = name in SELF_CLOSING_TAGS
+        if not self_closing:
+            self._smart_pop(name)
+        attrs = [(key, attr_entity.sub(_convert_entity, value))
+                 for key, value in attrs]
+        element = Element(name, attrs)
+        self.current.children.append(element)
+        if not self_closing:
+            self.tag_stack.append(element)
+            self.current = element
+        if name in QUOTE_TAGS:
+            self.quote_stack.append(name)
+            self.literal = 1
+
+    def unknown_endtag(self, name):
+        if self.quote_stack and self.quote_stack[-1] != name:
+            self.handle_data(u'</%s>' % name)
+            return
+        self._end_data()
+        self._pop_to_tag(name)
+        if self.quote_stack and self.quote_stack[-1] == name:
+            self.quote_stack.pop()
+            self.literal = (len(self.quote_stack) > 0)
+
+    def start_meta(self, attrs):
+        # BeautifulSoup looks for a charset in <meta> tags, which puts them
+        # on the sgmllib stack.
+        self.unknown_starttag('meta', attrs)
+
+    # Tokenizer callbacks (the same as in BeautifulSoup with
+    # convertEntities=XHTML_ENTITIES)
+
+    def handle_data(self, data):
+        self.current_data.append(data)
+
+    def _special_string(self, text, template):
+        self._end_data()
+        self.handle_data(text)
+        self._end_data(template)
+
+    def handle_pi(self, text):
+        if text[:3] == 'xml':
+            text = u"xml version='1.0' encoding='%SOUP-ENCODING%'"
+        text = text.replace(u'%SOUP-ENCODING%', u'utf-8')
+        self._special_string(text, u'<?%s?>')
+
+    def handle_comment(self, text):
+        self._special_string(escape_bare(text), u'<!--%s-->')
+
+    def handle_decl(self, data):
+        self._special_string(escape_bare(data), u'<!%s>')
+
+    def handle_cdata(self, data):
+        self._special_string(escape_bare(data), u'<![CDATA[%s]]>')
+
+    def handle_charref(self, ref):
+        self.handle_data(unichr(int(ref)))
+
+    def handle_entityref(self, ref):
+        self.handle_data(_entityref_text(ref))
+
+    def convert_charref(self, name):
+        try:
+            n = int(name)
+        except ValueError:
+            return
+        if not 0 <= n <= 127:
+            return
+        return self.convert_codepoint(n)
+
+    def parse_declaration(self, i):
+        if self.rawdata[i:i+9] == '<![CDATA[':
+            k = self.rawdata.find(']]>', i)
+            if k == -1:
+                k = len(self.rawdata)
+            self.handle_cdata(self.rawdata[i+9:k])
+            return k + 3
+        try:
+            return SGMLParser.parse_declaration(self, i)
+        except SGMLParseError:
+            data = self.rawdata[i:]
+            self.handle_data(data)
+            return i + len(data)
+
+    def reparse_attr(self, value):
+        """Return the value of an attribute after rendering and parsing it
+        again."""
+        if u'"' in value and u"'" in value:
+            value = value.replace(u"'", u'&squot;')
+        value = escape_bare(value)
+        value = self.entity_or_charref.sub(self._convert_ref, value)
+        return attr_entity.sub(_convert_entity, value)
+
+
+
+class _TextExtractor(_TreeBuilder):
+    """Collect the text of markup like
+    ``BeautifulSoup(markup).findAll(text=True)`` does.
+
+    Entities are not converted and the contents of comments, declarations
+    and CDATA sections are text, too.
+    """
+    def __init__(self):
+        _TreeBuilder.__init__(self, None)
+
+    def reset(self):
+        _TreeBuilder.reset(self)
+        self.texts = []
+
+    def extract(self, markup):
+        self.parse(markup)
+        return u''.join(self.texts)
+
+    def _end_data(self, template=None):
+        if not self.current_data:
+            return
+        data = u''.join(self.current_data)
+        self.current_data = []
+        if not data.strip(ASCII_SPACES) \
+            and not self._preserve_whitespace():
+            if u'\n' in data:
+                data = u'\n'
+            else:
+                data = u' '
+        self.texts.append(data)
+
+    def _preserve_whitespace(self):
+        for element in self.tag_stack:
+            if element.name in PRESERVE_WHITESPACE_TAGS:
+                return True
+        return False
+
+    def handle_pi(self, text):
+        if text[:3] == 'xml':
+            text = u"xml version='1.0' encoding='%SOUP-ENCODING%'"
+        self._special_string(text, None)
+
+    def handle_comment(self, text):
+        self._special_string(text, None)
+
+    def handle_decl(self, data):
+        self._special_string(data, None)
+
+    def handle_cdata(self, data):
+        self._special_string(data, None)
+
+    def handle_charref(self, ref):
+        self.handle_data(u'&#%s;' % ref)
+
+    def handle_entityref(self, ref):
+        self.handle_data(u'&%s;' % ref)
+
+
+class _EntityDecoder(SGMLParser):
+    """Convert the entities of text without markup like
+    :func:`~mediadrop.lib.xhtml.htmlsanitizer.entities_to_unicode` does."""
+    def reset(self):
+        SGMLParser.reset(self)
+        self.current_data = []
+
+    def decode(self, text):
+        # Like BeautifulSoup, don't close the parser: an incomplete entity
+        # at the end of the text is dropped.
+        self.feed(text)
+        data = u''.join(self.current_data)
+        if self.current_data and not data.strip(ASCII_SPACES):
+            if u'\n' in data:
+                data = u'\n'
+            else:
+                data = u' '
+        return escape_bare(data).replace(u'&amp;', u'&')
+
+    def handle_data(self, data):
+        self.current_data.append(data)
+
+    def handle_charref(self, ref):
+        self.handle_data(unichr(int(ref)))
+
+    def handle_entityref(self, ref):
+        self.handle_data(_entityref_text(ref))
+
+
+def extract_text(markup):
+    """Return the text of the given markup without any tags.
+
+    The result is the same as
+    ``u''.join(BeautifulSoup(markup).findAll(text=True))`` but no soup is
+    built. Entities are not converted.
+
+    :type markup: unicode
+    :rtype: unicode
+    """
+    return _TextExtractor().extract(markup)
+
+def decode_text_entities(text):
+    """Convert the entities of the given text to unicode characters.
+
+    The text must not contain any markup (i.e. no ``<``). The result is the
+    same as the one of
+    :func:`~mediadrop.lib.xhtml.htmlsanitizer.entities_to_unicode`.
+
+    :type text: unicode
+    :rtype: unicode
+    """
+    return _EntityDecoder().decode(text)
+
+class XHTMLSanitizer(object):
+    """Turn user submitted HTML into safe XHTML.
+
+    Tags which are not in ``valid_tags`` are removed (but not their
+    contents), tags in ``elem_map`` are renamed, attributes not in
+    ``valid_attrs`` and links with other schemes than ``valid_schemes`` are
+    removed. URLs are turned into links, line breaks into paragraphs and
+    whitespace is condensed.
+
+    :param valid_tags: Tag names which are allowed (after renaming).
+    :param valid_attrs: Attribute names which are allowed.
+    :param elem_map: A dict mapping tag names to new names.
+    :param valid_schemes: Allowed URL schemes of ``href`` and ``src``
+        attributes.
+    """
+    link_attrs = ('src', 'href')
+
+    def __init__(self, valid_tags, valid_attrs, elem_map=None,
+                 valid_schemes=None):
+        self.valid_tags = frozenset(valid_tags)
+        self.valid_attrs = frozenset(valid_attrs)
+        self.elem_map = dict(elem_map or {})
+        if valid_schemes is None:
+            valid_schemes = default_valid_schemes
+        self.valid_schemes = frozenset(valid_schemes)
+        self.block_elements = frozenset(block_elements) | set(['br', 'p'])
+
+    def __call__(self, markup, p_wrap=False):
+        """Return the sanitized markup.
+
+        :param p_wrap: Wrap the output in <p></p> tags if it is plain text.
+        :rtype: unicode
+        """
+        root = self.clean(markup)
+        if p_wrap and len(root.children) == 1 \
+            and not isinstance(root.children[0], Element):
+            return u'<p>%s</p>' % root.children[0].strip()
+        return render(root)
+
+    def clean(self, markup):
+        """Return the root :class:`Element` of the sanitized markup."""
+        root = _TreeBuilder(_pass1_text).parse(markup)
+        self._br_to_p(root)
+        self._clean_tree(root)
+
+        # Renaming tags may result in invalid nesting (e.g. <p><p>) so
+        # build the tree again with the same nesting rules as the parser.
+        builder = _TreeBuilder(_pass2_text)
+        self._rebuild(root, builder)
+        root = builder.close_tree()
+        self._clean_tree(root)
+        return root
+
+    def _clean_tree(self, root):
+        _separate_strings(root)
+        _reassign_whitespace(root)
+        root.children = self._finish(root, False)
+
+    def _rebuild(self, element, builder):
+        for child in element.children:
+            if child.__class__ is Element:
+                attrs = [(key, builder.reparse_attr(value))
+                         for key, value in child.attrs]
+                builder.unknown_starttag(child.name, attrs)
+                self._rebuild(child, builder)
+                builder.unknown_endtag(child.name)
+            else:
+                builder.handle_data(child)
+
+    def _br_to_p(self, element):
+        """Move the lines around <br> tags into paragraphs.
+
+        :returns: The new children of the given element.
+        """
+        children = []
+        lines = False
+        for child in element.children:
+            if child.__class__ is Element:
+                if child.name == 'br':
+                    lines = True
+                elif child.children:
+                    new_children = self._br_to_p(child)
+                    if new_children is not None:
+                        # a paragraph which contained lines
+                        children.extend(new_children)
+                        continue
+                    children.append(child)
+                    continue
+            children.append(child)
+        if not lines:
+            element.children = children
+            return None
+
+        block_elements = self.block_elements
+        new_children = []
+        paragraph = None
+        for child in children:
+            if child.__class__ is Element and child.name in block_elements:
+                paragraph = None
+                if child.name != 'br':
+                    new_children.append(child)
+            else:
+                if paragraph is None:
+                    paragraph = Element(u'p')
+                    new_children.append(paragraph)
+                paragraph.children.append(child)
+        if element.name == 'p':
+            return new_children
+        element.children = new_children
+        return None
+
+    def _finish(self, element, in_link):
+        """Linkify text, rename tags, strip attributes and remove empty or
+        invalid tags.
+
+        :returns: The new children of the given element.
+        """
+        in_link = in_link or element.name == 'a'
+        children = []
+        for child in element.children:
+            if child.__class__ is not Element:
+                if in_link:
+                    children.append(child)
+                    continue
+                for node in _linkify(child):
+                    if node.__class__ is Element:
+                        node.attrs = self._strip_attrs(node.attrs)
+                    children.append(node)
+                continue
+
+            grandchildren = self._finish(child, in_link)
+            child.name = self.elem_map.get(child.name, child.name)
+            child.attrs = self._strip_attrs(child.attrs)
+            if not grandchildren:
+                continue
+            if _only_whitespace(grandchildren) \
+                or child.name not in self.valid_tags:
+                children.extend(grandchildren)
+                continue
+            child.children = grandchildren
+            children.append(child)
+        return children
+
+    def _strip_attrs(self, attrs):
+        valid_attrs = self.valid_attrs
+        attrs = [(key, value) for key, value in attrs if key in valid_attrs]
+        for key in self.link_attrs:
+            for attr, value in attrs:
+                if attr == key and not self._valid_link(value):
+                    attrs = [(k, v) for k, v in attrs if k != key]
+                    break
+        return attrs
+
+    def _valid_link(self, url):
+        scheme_bits = url.split(u':', 1)
+        return len(scheme_bits) == 1 or scheme_bits[0] in self.valid_schemes
+
+def _only_whitespace(children):
+    for child in children:
+        if child.__class__ is Element or child.strip():
+            return False
+    return True
+
+def _separate_strings(element):
+    """Merge neighbouring strings and split the leading whitespace off
+    strings which are followed by a tag."""
+    children = []
+    text = None
+    for child in element.children:
+        if child.__class__ is Element:
+            _separate_strings(child)
+            if text is not None:
+                _append_text(children, text)
+                text = None
+            children.append(child)
+        elif text is None:
+            text = child
+        else:
+            text = any_space.sub(u' ', text + child)
+    if text is not None:
+        _append_text(children, text)
+    element.children = children
+
+def _append_text(children, text):
+    match = start_space.match(text)
+    if match and match.end() < len(text):
+        children.append(u' ')
+        children.append(text[match.end():])
+    else:
+        children.append(text)
+
+def _text_positions(element, positions):
+    children = element.children
+    for i, child in enumerate(children):
+        if child.__class__ is Element:
+            _text_positions(child, positions)
+        else:
+            positions.append((children, i))
+    return positions
+
+def _reassign_whitespace(root):
+    """Append strings which contain only whitespace to the previous string
+    in the document."""
+    after = None
+    for children, i in reversed(_text_positions(root, [])):
+        if after is not None:
+            after_children, j = after
+            whitespace = after_children[j]
+            if not whitespace.strip():
+                children[i] = any_space.sub(u' ', children[i] + whitespace)
+                del after_children[j]
+        after = (children, i)
+
+def _linkify(text):
+    """Return the given text with URLs replaced by <a> elements."""
+    nodes = []
+    o = 0
+    for m in URL_RE.finditer(text):
+        s, e = m.span()
+        if e >= len(text) or non_word.match(text[e]):
+            if o < s:
+                nodes.append(text[o:s])
+            url = m.group()
+            nodes.append(Element(u'a', [(u'href', url)], [url]))
+            o = e
+    if not o:
+        return [text]
+    if o < len(text):
+        nodes.append(text[o:])
+    return nodes
+
+def render(element):
+    """Return the XHTML of the children of the given :class:`Element`."""
+    parts = []
+    _render(element, parts)
+    return u''.join(parts)
+
+def _render(element, parts):
+    for child in element.children:
+        if child.__class__ is not Element:
+            parts.append(child)
+            continue
+        parts.append(u'<' + child.name)
+        for key, value in child.attrs:
+            template = u' %s="%s"'
+            if u'"' in value:
+                template = u" %s='%s'"
+                if u"'" in value:
+                    value = value.replace(u"'", u'&squot;')
+            parts.append(template % (key, escape_bare(value)))
+        parts.append(u'>')
+        _render(child, parts)
+        parts.append(u'</%s>' % child.name)
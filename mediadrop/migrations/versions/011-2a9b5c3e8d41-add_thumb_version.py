@@ -0,0 +1,35 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""add thumb_version columns
+
+store a content version for media and podcast thumbnails so their URLs
+change whenever the thumbnails are replaced.
+
+added: 2026-10-19 (v0.11dev)
+
+Revision ID: 2a9b5c3e8d41
+Revises: e1488bb4dd
+Create Date: 2026-10-19 09:12:40.118327
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2a9b5c3e8d41'
+down_revision = 'e1488bb4dd'
+
+from alembic.op import add_column, drop_column
+from sqlalchemy import Column, Unicode
+
+
+TABLES = ('media', 'podcasts')
+
+def upgrade():
+    for table_name in TABLES:
+        add_column(table_name, Column('thumb_version', Unicode(16)))
+
+def downgrade():
+    for table_name in TABLES:
+        drop_column(table_name, 'thumb_version')
@@ -0,0 +1,37 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""add description excerpt columns
+
+store the excerpts of media and podcast descriptions (and the plain text
+of podcast descriptions) so listings and feeds don't parse the XHTML for
+every request. Existing rows are filled by
+batch-scripts/update_description_excerpts.py.
+
+added: 2026-10-19 (v0.11dev)
+
+Revision ID: 5d3f0e9a7b21
+Revises: 2a9b5c3e8d41
+Create Date: 2026-10-19 14:32:07.516223
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d3f0e9a7b21'
+down_revision = '2a9b5c3e8d41'
+
+from alembic.op import add_column, drop_column
+from sqlalchemy import Column, UnicodeText
+
+
+def upgrade():
+    add_column('media', Column('description_excerpt', UnicodeText))
+    add_column('podcasts', Column('description_plain', UnicodeText))
+    add_column('podcasts', Column('description_excerpt', UnicodeText))
+
+def downgrade():
+    drop_column('media', 'description_excerpt')
+    drop_column('podcasts', 'description_plain')
+    drop_column('podcasts', 'description_excerpt')
@@ -35,7 +35,7 @@ from mediadrop.lib.compat import any
 from mediadrop.lib.filetypes import AUDIO, AUDIO_DESC, VIDEO, guess_mimetype
 from mediadrop.lib.players import pick_any_media_file, pick_podcast_media_file
 from mediadrop.lib.util import calculate_popularity
-from mediadrop.lib.xhtml import line_break_xhtml, strip_xhtml
+from mediadrop.lib.xhtml import excerpt_xhtml, line_break_xhtml, strip_xhtml
 from mediadrop.model import (get_available_slug, SLUG_LENGTH, 
     _mtm_count_property, _properties_dict_from_labels, MatchAgainstClause)
 from mediadrop.model.meta import DBSession, metadata
@@ -45,6 +45,8 @@ from mediadrop.model.comments import Comment, CommentQuery, comments
 from mediadrop.model.tags import Tag, TagList, extract_tags, fetch_and_create_tags
 from mediadrop.plugin import events
 
+#: Length of :attr:`Media.description_excerpt`
+DESCRIPTION_EXCERPT_LENGTH = 340
 
 media = Table('media', metadata,
     Column('id', Integer, autoincrement=True, primary_key=True, doc=\
@@ -103,6 +105,14 @@ media = Table('media', metadata,
     Column('description_plain', UnicodeText, doc=\
         """A public-facing plaintext description. Should be a paragraph or more."""),
 
+    Column('description_excerpt', UnicodeText, doc=\
+        """An XHTML excerpt of the description for the media page.
+
+        Generated from :attr:`description` by
+        :func:`mediadrop.lib.xhtml.excerpt_xhtml`. It is the same as the
+        description if that is short enough. ``None`` if it was not
+        generated yet."""),
+
     Column('notes', UnicodeText, doc=\
         """Notes for administrative use -- never displayed publicly."""),
 
@@ -145,6 +155,12 @@ media = Table('media', metadata,
     Column('author_name', Unicode(50), nullable=False),
     Column('author_email', Unicode(255), nullable=False),
 
+    Column('thumb_version', Unicode(16), doc=\
+        """A short token which changes whenever the thumbnails are replaced.
+
+        It is appended to thumbnail URLs so they can be cached forever.
+        See :func:`mediadrop.lib.thumbnails.thumb_url`."""),
+
     mysql_engine='InnoDB',
     mysql_charset='utf8',
 )
@@ -571,6 +587,8 @@ class Media(object):
         self.description_plain = line_break_xhtml(
             line_break_xhtml(value)
         )
+        self.description_excerpt = excerpt_xhtml(value,
+                                                 DESCRIPTION_EXCERPT_LENGTH)
         return value
 
     @validates('description_plain')
@@ -25,6 +25,7 @@ from mediadrop.lib.i18n import _
 from mediadrop.lib.players import AbstractPlayer
 from mediadrop.model.meta import DBSession, metadata
 from mediadrop.model.util import JSONType
+from mediadrop.plugin import events
 
 log = logging.getLogger(__name__)
 
@@ -112,6 +113,7 @@ class PlayerPrefs(object):
 
 mapper(
     PlayerPrefs, players,
+    extension=events.MapperObserver(events.PlayerPrefs),
     order_by=(
         players.c.enabled.desc(),
         players.c.priority,
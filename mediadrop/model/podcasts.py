@@ -21,11 +21,14 @@ from sqlalchemy.types import Unicode, UnicodeText, Integer, DateTime, Boolean, F
 from sqlalchemy.orm import mapper, relation, backref, synonym, composite, validates, dynamic_loader, column_property
 from pylons import request
 
+from mediadrop.lib.xhtml import line_break_xhtml, strip_xhtml, truncate_xhtml
 from mediadrop.model import Author, SLUG_LENGTH, slugify, get_available_slug
 from mediadrop.model.meta import DBSession, metadata
 from mediadrop.model.media import Media, MediaQuery, media
 from mediadrop.plugin import events
 
+#: Length of :attr:`Podcast.description_excerpt`
+DESCRIPTION_EXCERPT_LENGTH = 375
 
 podcasts = Table('podcasts', metadata,
     Column('id', Integer, autoincrement=True, primary_key=True, doc=\
@@ -50,6 +53,16 @@ podcasts = Table('podcasts', metadata,
 
     Column('description', UnicodeText),
 
+    Column('description_plain', UnicodeText, doc=\
+        """A plaintext version of :attr:`description`."""),
+
+    Column('description_excerpt', UnicodeText, doc=\
+        """The description truncated to an XHTML excerpt for listings.
+
+        Generated from :attr:`description` by
+        :func:`mediadrop.lib.xhtml.truncate_xhtml`. ``None`` if it was not
+        generated yet."""),
+
     Column('category', Unicode(50), doc=\
         """The `iTunes category <http://www.apple.com/itunes/podcasts/specs.html#categories>`_
 
@@ -81,6 +94,12 @@ podcasts = Table('podcasts', metadata,
         this address -- unless, of course, the request is coming from
         Feedburner."""),
 
+    Column('thumb_version', Unicode(16), doc=\
+        """A short token which changes whenever the thumbnails are replaced.
+
+        It is appended to thumbnail URLs so they can be cached forever.
+        See :func:`mediadrop.lib.thumbnails.thumb_url`."""),
+
     mysql_engine='InnoDB',
     mysql_charset='utf8',
 )
@@ -104,6 +123,14 @@ class Podcast(object):
     def validate_slug(self, key, slug):
         return slugify(slug)
 
+    @validates('description')
+    def _validate_description(self, key, value):
+        self.description_plain = strip_xhtml(
+            line_break_xhtml(line_break_xhtml(value)), True)
+        self.description_excerpt = truncate_xhtml(value,
+                                                  DESCRIPTION_EXCERPT_LENGTH)
+        return value
+
 
 mapper(Podcast, podcasts, order_by=podcasts.c.title, extension=events.MapperObserver(events.Podcast), properties={
     'author': composite(Author,
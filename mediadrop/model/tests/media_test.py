@@ -11,6 +11,7 @@ from mediadrop.lib.players import AbstractFlashPlayer, FlowPlayer
 from mediadrop.lib.storage.api import add_new_media_file
 from mediadrop.lib.test.db_testcase import DBTestCase
 from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.xhtml import excerpt_xhtml
 from mediadrop.plugin import events
 from mediadrop.plugin.events import observes
 
@@ -61,6 +62,16 @@ class MediaTest(DBTestCase):
         self.media.update_status()
         second_encoding_event.assert_was_not_called()
 
+    def test_stores_description_excerpt(self):
+        self.media.description = u'<p>short &amp; sweet</p>'
+        assert_equals(u'short & sweet', self.media.description_plain)
+        assert_equals(u'<p>short &amp; sweet</p>', self.media.description_excerpt)
+
+        self.media.description = u'<p>%s</p>' % (u'word ' * 100)
+        assert_equals(excerpt_xhtml(self.media.description, 340),
+                      self.media.description_excerpt)
+        assert_not_equals(self.media.description, self.media.description_excerpt)
+
 
 import unittest
 def suite():
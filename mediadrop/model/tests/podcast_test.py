@@ -0,0 +1,39 @@
+# This file is a part of MediaDrop (http://www.mediadrop.net),
+# Copyright 2009-2013 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from mediadrop.lib.test.pythonic_testcase import *
+from mediadrop.lib.xhtml import truncate_xhtml
+from mediadrop.model import Podcast
+
+
+class PodcastTest(PythonicTestCase):
+    def test_stores_plain_description_and_excerpt(self):
+        podcast = Podcast()
+        podcast.description = u'<p>first &amp; second</p><p>third</p>'
+        assert_equals(u'first & second\nthird', podcast.description_plain)
+        assert_equals(u'<p>first & second</p><p>third</p>',
+                      podcast.description_excerpt)
+
+        podcast.description = u'<p>%s</p>' % (u'word ' * 100)
+        assert_equals(truncate_xhtml(podcast.description, 375),
+                      podcast.description_excerpt)
+
+    def test_can_remove_description(self):
+        podcast = Podcast()
+        podcast.description = None
+        assert_equals(u'', podcast.description_plain)
+        assert_equals(u'', podcast.description_excerpt)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(PodcastTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
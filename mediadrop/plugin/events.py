@@ -295,6 +295,8 @@ class PodcastsController(object):
 class SitemapsController(object):
     # observers (if they are not marked as "run_before=True") must support pure 
     # string output (from beaker cache) instead of a dict with template variables.
+    # google and mrss return the response of a pre-generated file (see
+    # mediadrop.lib.sitemap_files).
     google = Event(['page', 'limit', '**kwargs'])
     mrss = Event(['**kwargs'])
     latest = Event(['limit', 'skip', '**kwargs'])
@@ -330,6 +332,14 @@ class MediaFile(object):
     before_update = Event(['instance'])
     after_update = Event(['instance'])
 
+class PlayerPrefs(object):
+    before_delete = Event(['instance'])
+    after_delete = Event(['instance'])
+    before_insert = Event(['instance'])
+    after_insert = Event(['instance'])
+    before_update = Event(['instance'])
+    after_update = Event(['instance'])
+
 class Podcast(object):
     before_delete = Event(['instance'])
     after_delete = Event(['instance'])
@@ -414,6 +424,9 @@ Admin.ThumbForm = Event(['form'])
 media_types = GeneratorEvent([])
 plugin_settings_links = GeneratorEvent([])
 EncodeMediaFile = Event(['media_file'])
+# Observers return True if a new comment is spam. They are called by the
+# spam check workers (mediadrop.lib.spam_check) so there is no request.
+comment_is_spam = GeneratorEvent(['comment', 'request_data'])
 page_title = FetchFirstResultEvent('default=None, category=None, \
     media=None, podcast=None, upload=None, **kwargs')
 meta_keywords = FetchFirstResultEvent('category=None, media=None, \
@@ -32,8 +32,14 @@ class AbstractClassRegistrationTest(PythonicTestCase):
         
         def size(self):
             return 42
+    def setUp(self):
+        # keep the storage engines etc. registered for later tests
+        self._registry = dict((key, list(value)) for key, value
+                              in AbstractMetaClass._registry.items())
+
     def tearDown(self):
         AbstractMetaClass._registry.clear()
+        AbstractMetaClass._registry.update(self._registry)
     
     
     # --- tests ---------------------------------------------------------------
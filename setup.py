@@ -54,6 +54,10 @@ install_requires = setup_requires + [
     'simplejson >= 2.2.1', # (version required by Pylons 1.0)
 ]
 
+tests_require = [
+    'pyftpdlib', # stand-in FTP server for the FTPStorage tests
+]
+
 if sys.version_info < (2, 7):
     # importlib is included in Python 2.7
     # however we can't do try/import/except because this might generate eggs
@@ -109,6 +113,8 @@ setup(
 
     setup_requires=setup_requires,
     install_requires=install_requires,
+    tests_require=tests_require,
+    extras_require={'test': tests_require},
     paster_plugins=[
         'PasteScript',
         'Pylons',